@@ -0,0 +1,75 @@
+"""Awaitable facade over Database -> SQLite calls and file hashing run on an executor, never on the awaiting thread
+
+The app runs Kivy on an asyncio loop (see main.py), so a coroutine awaiting an AsyncDatabase call resumes on the Kivy
+thread, between frames, once the work is done. Code after an await may touch widgets and loaded objects freely.
+Panes start coroutines from their (synchronous) event handlers with spawn:
+
+    def add_file(self, path):
+        async def add():
+            success, new_file = await File.new_file_async(path, self.adb)     # UI keeps drawing meanwhile
+            if success:
+                self.files[new_file.path] = new_file                        # Back on the Kivy thread
+        spawn(add())
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import logging
+async_logger = logging.getLogger(__name__)
+
+
+class AsyncDatabase:
+    """
+    Runs the calls of a Database on a thread pool, as awaitables. Writes are still serialized by the database's own
+    lock, and reads spread over its reader pool, so a pool of READERS + 1 threads keeps both busy.
+    """
+
+    def __init__(self, database, workers=None):
+        self.database = database
+        self.executor = ThreadPoolExecutor(max_workers=workers or database.READERS + 1,
+                                           thread_name_prefix="elory_async")
+
+    async def run(self, func, *args, **kwargs):
+        """Await func(*args, **kwargs) run on the executor -> for compound work that belongs in one worker call"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def create_entry(self, item, values: list, batch=False, verify=False):
+        return await self.run(self.database.create_entry, item, values, batch, verify)
+
+    async def read_entry(self, values: list):
+        return await self.run(self.database.read_entry, values)
+
+    async def update_entry(self, item, values: list, batch=False):
+        return await self.run(self.database.update_entry, item, values, batch)
+
+    async def delete_entry(self, item, values: list, batch=False):
+        return await self.run(self.database.delete_entry, item, values, batch)
+
+    async def query_files(self, expression):
+        return await self.run(self.database.query_files, expression)
+
+    async def file_counts(self):
+        return await self.run(self.database.file_counts)
+
+    def close(self):
+        """Drop queued calls and release the threads -> a call already running (e.g. a file being hashed) finishes
+        on its own thread, without holding up the app's close"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_running = set()    # The loop only keeps weak references to tasks -> hold them until done
+
+
+def _report(task):
+    _running.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        async_logger.error(f"Background task failed: {task.exception()!r}", exc_info=task.exception())
+
+
+def spawn(coroutine):
+    """Start a coroutine on the running loop from synchronous code (a Kivy event handler). Failures are logged"""
+    task = asyncio.ensure_future(coroutine)
+    _running.add(task)
+    task.add_done_callback(_report)
+    return task
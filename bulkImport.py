@@ -0,0 +1,189 @@
+"""Recursive bulk import of a directory tree into a database, resumable from its last committed batch, and
+reconciliation of stored files that were moved or renamed within it
+
+Headless use:
+    python bulkImport.py DATABASE ROOT [--ext jpg png ...] [--glob "IMG_*" ...] [--batch 500] [--workers 4] [--restart]
+                                       [--reconcile]
+"""
+import argparse
+import os
+import sys
+from fnmatch import fnmatch
+from itertools import chain, islice
+from os.path import abspath, relpath
+
+from elorydb import Database
+
+import logging
+import_logger = logging.getLogger(__name__)
+
+
+def _walk_key(root, path):
+    # Sorting paths by their components gives exactly the order scan visits them in
+    return tuple(relpath(path, root).split(os.sep))
+
+
+def scan(root, globs=None, extensions=None, after=None):
+    """
+    Yield the absolute paths of files under root, depth first with each directory in name order.
+    globs -> file name patterns to accept, e.g. ["IMG_*"]
+    extensions -> file extensions to accept, e.g. ["jpg", ".png"]. Files matching any glob or extension are accepted,
+        or all files when neither is given
+    after -> a path previously yielded. Only files after it are yielded, and directories entirely before it are
+        never opened
+    """
+    root = abspath(root)
+    extensions = {ext.lower() if ext.startswith(".") else "." + ext.lower() for ext in extensions or ()}
+    globs = list(globs or ())
+    after = _walk_key(root, after) if after else None
+
+    def entries(directory):
+        try:
+            with os.scandir(directory) as it:
+                return iter(sorted(it, key=lambda entry: entry.name))
+        except OSError as err:
+            import_logger.warning(f"Skipped unreadable directory '{directory}': {err}")
+            return iter(())
+
+    stack = [entries(root)]
+    while stack:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+            continue
+        key = _walk_key(root, entry.path) if after else None
+        if entry.is_dir(follow_symlinks=False):
+            if after and key < after and key != after[:len(key)]:     # Wholly before the checkpoint
+                continue
+            stack.append(entries(entry.path))
+            continue
+        if not entry.is_file(follow_symlinks=False) or (after and key <= after):
+            continue
+        accept = not (globs or extensions)
+        accept = accept or os.path.splitext(entry.name)[1].lower() in extensions
+        accept = accept or any(fnmatch(entry.name, pattern) for pattern in globs)
+        if accept:
+            yield entry.path
+
+
+def _unknown(database, paths, batch_size=500):
+    # Paths not in the database yet, looked up a batch at a time
+    paths = iter(paths)
+    while batch := list(islice(paths, batch_size)):
+        for path, rows in zip(batch, database.read_entry([("files", "file_path", path) for path in batch])):
+            if not rows:
+                yield path
+
+
+def reconcile(database, roots, globs=None, extensions=None, workers=None):
+    """
+    Repair the paths of stored files that were moved or renamed under roots (see scan and Database.locate_missing).
+    All paths are updated in a single transaction.
+    returns [(file_id, old path, new path), ...] of the files moved -> pass to File.relocate_all for loaded objects
+    """
+    paths = chain.from_iterable(scan(root, globs, extensions) for root in roots)
+    moves = database.locate_missing(_unknown(database, paths), workers)
+    results = database.update_entry("file", [{'file_id': file_id, 'file_path': path} for file_id, _, path in moves],
+                                    batch=True)
+    moved = [move for move, result in zip(moves, results) if result[0]]
+    import_logger.info(f"Reconciled {len(moved)} moved files under {', '.join(map(repr, roots))}")
+    return moved
+
+
+def import_tree(database, root, globs=None, extensions=None, batch_size=500, restart=False, progress=None):
+    """
+    Add every matching file under root (see scan) to a connected database, in batches of one transaction each.
+    Files are hashed in parallel (see Database.HASH_WORKERS), and files already in the database are skipped unread.
+    A batch is read in full before its transaction opens, so other connections can still write while files are hashed.
+
+    After every batch a checkpoint is saved with the database, so an interrupted import resumes after the last
+    committed batch when called again. restart -> ignore any checkpoint and walk the whole tree again
+    progress -> called with the report after every batch
+    returns a report {"imported": int, "existing": int, "duplicates": [(path, path already in database), ...],
+                      "failed": [path, ...], "resumed_from": path or None}
+        -> counts run across resumed imports, lists only cover this call
+    """
+    root = abspath(root)
+    checkpoint = None if restart else database.load_checkpoint(root)
+    report = {"imported": 0, "existing": 0, "duplicates": [], "failed": [], "resumed_from": None}
+    previous = (0, 0, 0, 0)
+    if checkpoint:
+        report["resumed_from"] = checkpoint[0]
+        previous = checkpoint[1:]
+        import_logger.info(f"Resuming import of '{root}' after '{checkpoint[0]}'")
+
+    def totals():
+        return (previous[0] + report["imported"], previous[1] + report["existing"],
+                previous[2] + len(report["duplicates"]), previous[3] + len(report["failed"]))
+
+    paths = scan(root, globs, extensions, after=report["resumed_from"])
+    # Switched rather than 'with database.profile(...)', which holds the write lock for the whole walk -> other threads
+    # sharing the database only wait for one batch's insert at a time
+    settings = database.set_profile("bulk-import")
+    try:
+        while True:
+            batch = [path for _, path in zip(range(batch_size), paths)]
+            if not batch:
+                break
+            known = database.read_entry([("files", "file_path", path) for path in batch])
+            new = [path for path, rows in zip(batch, known) if not rows]
+            report["existing"] += len(batch) - len(new)
+            collisions = []
+            for path, result in zip(new, database.create_entry("file", [{'file_path': p} for p in new], batch=True)):
+                if result[0]:
+                    report["imported"] += 1
+                elif len(result) == 3:      # (False, error, hash) -> content already in the database
+                    collisions.append((path, result[2]))
+                else:                       # (False, message) -> unreadable
+                    report["failed"].append(path)
+            # Look up what each duplicate duplicates in one pass, rather than failing one message at a time
+            for (path, file_hash), rows in zip(collisions, database.read_entry(
+                    [("files", "file_hash_name", file_hash) for _, file_hash in collisions])):
+                report["duplicates"].append((path, rows[0][1] if rows else None))
+            database.save_checkpoint(root, batch[-1], totals())
+            if progress is not None:
+                progress(report)
+    finally:
+        database.restore_settings(settings)
+    database.save_checkpoint(root)      # Complete
+    report["imported"], report["existing"] = totals()[:2]
+    import_logger.info(f"Imported {report['imported']} files from '{root}'. {report['existing']} already present, "
+                       f"{len(report['duplicates'])} duplicates, {len(report['failed'])} unreadable")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add all files under a directory to an Elory database.")
+    parser.add_argument("database", help="path of the .edb database file")
+    parser.add_argument("root", help="directory to import, including all subdirectories")
+    parser.add_argument("--ext", nargs="+", default=[], help="only import files with these extensions")
+    parser.add_argument("--glob", nargs="+", default=[], help="only import files with names matching these patterns")
+    parser.add_argument("--batch", type=int, default=500, help="files per transaction (default 500)")
+    parser.add_argument("--workers", type=int, default=None, help="files hashed in parallel")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint of an interrupted import")
+    parser.add_argument("--reconcile", action="store_true",
+                        help="first repair the paths of stored files that were moved or renamed under ROOT")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s")
+    database = Database(hash_workers=args.workers)
+    database.connect_db(args.database)
+    try:
+        if args.reconcile:
+            for _, old, new in reconcile(database, [args.root], args.glob, args.ext, args.workers):
+                print(f"moved\t{old}\t{new}")
+        report = import_tree(database, args.root, args.glob, args.ext, args.batch, args.restart,
+                             progress=lambda r: print(f"\r{r['imported']} imported, {r['existing']} present, "
+                                                      f"{len(r['duplicates'])} duplicates", end="", file=sys.stderr))
+    finally:
+        database._disconnect()
+    print(file=sys.stderr)
+    for path, original in report["duplicates"]:
+        print(f"duplicate\t{path}\t{original}")
+    for path in report["failed"]:
+        print(f"failed\t{path}")
+    return 0 if not report["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,10 @@
-from os.path import basename
-from operator import itemgetter
+from os import sep
+from os.path import basename, dirname
+from types import MappingProxyType
+from functools import reduce
+from operator import and_, or_
+
+from tagQuery import parse
 
 import logging
 object_logger = logging.getLogger(__name__)
@@ -11,8 +16,39 @@ object_logger = logging.getLogger(__name__)
 # object_logger.propagate = False
 
 
+class ModelEvents:
+    """
+    Change notifications of the loaded objects, for views to patch themselves rather than rebuild. Bound like Kivy
+    events, e.g. events.bind(on_tag_linked=handler):
+        on_file_added(file)     on_file_removed(file)       on_file_moved(file, old_path)
+        on_tag_linked(file, tag)        on_tag_unlinked(file, tag)
+    Fired after the objects (and the database) are changed, on the thread making the change.
+    """
+    EVENTS = ("on_file_added", "on_file_removed", "on_file_moved", "on_tag_linked", "on_tag_unlinked")
+
+    def __init__(self):
+        self.handlers = {event: [] for event in self.EVENTS}
+
+    def bind(self, **handlers):
+        for event, handler in handlers.items():
+            self.handlers[event].append(handler)
+
+    def unbind(self, **handlers):
+        for event, handler in handlers.items():
+            if handler in self.handlers[event]:
+                self.handlers[event].remove(handler)
+
+    def dispatch(self, event, *args):
+        for handler in tuple(self.handlers[event]):
+            handler(*args)
+
+
+events = ModelEvents()      # Of all loaded objects
+
+
 class DatabaseObject:
     """Abstract class for objects retrieved from database"""
+    __slots__ = ("db_id", )     # Loaded objects number in the millions -> no per-instance __dict__
 
     def __init__(self, db_id: int):
         self.db_id = db_id        # Primary key of object within database
@@ -27,36 +63,35 @@ class DatabaseObject:
 
 
 class TagGroup(DatabaseObject):
+    __slots__ = ("name", "tags", "file_count")
 
-    def __init__(self,  db_id: int, name: str):
+    def __init__(self,  db_id: int, name: str, file_count: int = 0):
         super().__init__(db_id)
         self.name = name
         self.tags = {}
+        self.file_count = file_count    # Distinct files linked to any tag of this group
 
     @classmethod
     def load_tag_collection(cls, database):
-        g_entries, t_entries = database.read_entry([("tag_groups", "all"), ("tags", "all")])
+        # Both scans are ordered on group id, so tags are attached to their group in a single merge pass
+        g_rows, t_rows = database.read_snapshot(["tag_groups", "tags_by_group"])
+        group_counts = database.file_counts()[1]
         groups = {}
         tags = {}
-        g_entries.sort()
-        t_entries.sort(key=itemgetter(2), reverse=True)
-        for g in g_entries:
-            new_g = cls(g[0], g[1])
+        t = next(t_rows, None)
+        for g in g_rows:
+            new_g = cls(g[0], g[1], group_counts.get(g[0], 0))
             groups[g[1]] = new_g          # store group items by name
-            while t_entries and t_entries[-1][2] == g[0]:
-                t = t_entries.pop()
-                new_t = Tag(t[0], t[1], new_g)
-                new_g.tags[t[0]] = new_t
-                tags[t[0]] = new_t
+            while t is not None and t[0] == g[0]:
+                new_t = Tag(t[1], t[2], new_g)
+                new_g.tags[t[1]] = new_t
+                tags[t[1]] = new_t
+                t = next(t_rows, None)
         object_logger.info("Group and Tag objects initialized")
         return groups, tags
 
-    # TODO this can be optimized with a memoization-like technique
     def has_files(self):
-        for tag in self.tags.values():
-            if tag.files:
-                return True
-        return False
+        return self.file_count > 0
 
     @classmethod
     def new_group(cls, database, name):
@@ -68,6 +103,18 @@ class TagGroup(DatabaseObject):
         object_logger.info(f"Created new group object '{name}'")
         return True, cls(group_id[1], name)
 
+    def rename(self, database, name, groups):
+        """Rename the group, re-keying it in groups (keyed by name)"""
+        success = database.update_entry("group", [{"group_id": self.db_id, "group_name": name}])[0]
+        if not success[0]:
+            object_logger.warning("Group object rename failed: " + str(success[1]))
+            return False
+        groups.pop(self.name, None)
+        self.name = name
+        groups[name] = self
+        object_logger.info(f"Renamed group object '{self.db_id}' to '{name}'")
+        return True
+
     def delete(self, database):
         success = database.delete_entry("group", [{"group_id": self.db_id}])[0]
         if not success[0]:
@@ -107,48 +154,411 @@ class TagGroup(DatabaseObject):
 
 
 class Tag(DatabaseObject):
+    __slots__ = ("name", "group", "files")
 
     def __init__(self,  db_id: int, name: str, group: TagGroup):
         super().__init__(db_id)
         self.name = name
         self.group = group
-        self.files = {}
+        self.files = {}     # File db_id: File
+
+    @property
+    def file_count(self):
+        return len(self.files)
+
+    def rename(self, database, name):
+        success = database.update_entry("tag", [{"tag_id": self.db_id, "tag_name": name}])[0]
+        if not success[0]:
+            object_logger.warning("Tag object rename failed: " + str(success[1]))
+            return False
+        self.name = name
+        object_logger.info(f"Renamed tag object '{self.db_id}' to '{name}'")
+        return True
+
+    def move(self, database, group):
+        """Reassign the tag, and its links, to another group"""
+        success = database.update_entry("tag", [{"tag_id": self.db_id, "group": group.db_id}])[0]
+        if not success[0]:
+            object_logger.warning("Tag object move failed: " + str(success[1]))
+            return False
+        previous, self.group = self.group, group
+        del previous.tags[self.db_id]
+        group.tags[self.db_id] = self
+        group_counts = database.file_counts()[1]    # Files can hold tags of both groups -> recount, don't add
+        for changed in (previous, group):
+            changed.file_count = group_counts.get(changed.db_id, 0)
+        object_logger.info(f"Moved tag object '{self.name}' to group '{group.name}'")
+        return True
 
     def __repr__(self):
         return f"{self.__class__} : {self.name} : id {self.db_id} : files {self.files}"
 
 
+class TagIndex:
+    """
+    Inverted index of tag -> bitmap of the files it is linked to, for set algebra over tags without touching the dicts.
+
+    Every indexed file gets a dense ordinal, which is its bit position in each bitmap. Bitmaps are python ints, so
+    AND / OR / NOT and counts are single bitwise operations over machine words, even for hundreds of thousands of files.
+    Ordinals of removed files are not reused.
+    """
+
+    def __init__(self):
+        self.ordinals = {}      # File db_id: ordinal
+        self.files = []         # ordinal: File -> None once removed
+        self.tags = {}          # Tag db_id: Tag, for every tag ever linked
+        self.bitmaps = {}       # Tag db_id: bitmap of linked files
+        self.universe = 0       # Bitmap of all indexed files
+
+    @staticmethod
+    def _bitmap(ordinals):
+        # Building through a buffer is linear, where OR-ing bit by bit re-copies the whole int every time
+        ordinals = list(ordinals)
+        buffer = bytearray((max(ordinals, default=0) >> 3) + 1)
+        for ordinal in ordinals:
+            buffer[ordinal >> 3] |= 1 << (ordinal & 7)
+        return int.from_bytes(buffer, "little")
+
+    def _ordinal(self, file):
+        # The file's ordinal, assigned if new -> universe is left to the caller
+        ordinal = self.ordinals.get(file.db_id)
+        if ordinal is None:
+            ordinal = self.ordinals[file.db_id] = len(self.files)
+            self.files.append(file)
+        return ordinal
+
+    def add(self, file):
+        """Index a file with no tags (yet). Returns its ordinal"""
+        ordinal = self._ordinal(file)
+        self.universe |= 1 << ordinal
+        return ordinal
+
+    def add_all(self, files):
+        """Index many files at once -> universe grows by one operation, rather than a copy of it per file"""
+        start = len(self.files)
+        for file in files:
+            self._ordinal(file)
+        self.universe |= (1 << len(self.files)) - (1 << start)
+
+    def extend(self, tag, files):
+        """Link a tag to many files at once"""
+        self.tags[tag.db_id] = tag
+        bitmap = self._bitmap(self._ordinal(file) for file in files)
+        self.bitmaps[tag.db_id] = self.bitmaps.get(tag.db_id, 0) | bitmap
+        self.universe |= bitmap
+
+    def remove(self, file):
+        ordinal = self.ordinals.pop(file.db_id, None)
+        if ordinal is None:
+            return
+        mask = ~(1 << ordinal)
+        for tag_id in file.tags:
+            if tag_id in self.bitmaps:
+                self.bitmaps[tag_id] &= mask
+        self.universe &= mask
+        self.files[ordinal] = None
+
+    def link(self, tag, file):
+        self.tags[tag.db_id] = tag
+        self.bitmaps[tag.db_id] = self.bitmaps.get(tag.db_id, 0) | (1 << self.add(file))
+
+    def unlink(self, tag, file):
+        if file.db_id in self.ordinals and tag.db_id in self.bitmaps:
+            self.bitmaps[tag.db_id] &= ~(1 << self.ordinals[file.db_id])
+
+    def file(self, db_id):
+        """Return the indexed File of a db_id -> None if not indexed"""
+        ordinal = self.ordinals.get(db_id)
+        return None if ordinal is None else self.files[ordinal]
+
+    def tagged(self, tag):
+        return self.bitmaps.get(tag.db_id, 0)
+
+    def all_of(self, *tags):
+        return reduce(and_, (self.tagged(tag) for tag in tags), self.universe)
+
+    def any_of(self, *tags):
+        return reduce(or_, (self.tagged(tag) for tag in tags), 0)
+
+    def none_of(self, *tags):
+        return self.universe & ~self.any_of(*tags)
+
+    @staticmethod
+    def count(bitmap):
+        return bitmap.bit_count()
+
+    def members(self, bitmap):
+        """Return the File objects of a bitmap, in ordinal order"""
+        found = []
+        for byte_no, byte in enumerate(bitmap.to_bytes((bitmap.bit_length() + 7) >> 3, "little")):
+            while byte:
+                low = byte & -byte
+                found.append(self.files[(byte_no << 3) + low.bit_length() - 1])
+                byte ^= low
+        return found
+
+    def query(self, expression):
+        """Evaluate a boolean tag query (see tagQuery) against the index. Returns a bitmap"""
+        return self._evaluate(parse(expression))
+
+    def _evaluate(self, node):
+        kind = node[0]
+        if kind == "all":
+            return self.universe
+        if kind == "not":
+            return self.universe & ~self._evaluate(node[1])
+        if kind == "and":
+            return reduce(and_, (self._evaluate(child) for child in node[1]))
+        if kind == "or":
+            return reduce(or_, (self._evaluate(child) for child in node[1]))
+        if kind == "group":
+            matches = [tag for tag in self.tags.values() if tag.group.name == node[1]]
+        elif kind == "tag":
+            matches = [tag for tag in self.tags.values() if tag.group.name == node[1] and tag.name == node[2]]
+        else:   # "name"
+            matches = [tag for tag in self.tags.values() if tag.name == node[1]]
+        return self.any_of(*matches)
+
+
+class Folder:
+    """A directory of a DirectoryTrie"""
+    __slots__ = ("name", "parent", "folders", "files", "file_count")
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent    # Kept once the folder is emptied and pruned from its trie
+        self.folders = {}       # name: Folder
+        self.files = {}         # name: File
+        self.file_count = 0     # Files in this folder and every folder below it
+
+    @property
+    def path(self):
+        """Directory path of the folder, ending with os.sep"""
+        names = []
+        folder = self
+        while folder.parent is not None:
+            names.append(folder.name)
+            folder = folder.parent
+        return sep.join(reversed(names)) + sep
+
+    def iterate_files(self):
+        """Yield every file in this folder and the folders below it, depth first"""
+        stack = [self]
+        while stack:
+            folder = stack.pop()
+            yield from folder.files.values()
+            stack.extend(reversed(folder.folders.values()))
+
+    def __repr__(self):
+        return f"Folder({self.path!r}, {self.file_count} files)"
+
+
+class DirectoryTrie:
+    """
+    The loaded files by directory, with the number of files below each directory. Paths are split once, when a file is
+    added, so views and folder-scoped queries walk folders rather than re-parse paths. Folders are removed as soon as
+    they hold no files.
+
+    The top folder of a path is the part before its first os.sep -> '' for every absolute path outside of Windows.
+    """
+
+    def __init__(self):
+        self.root = Folder(None)
+
+    def __len__(self):
+        return self.root.file_count
+
+    def add(self, file, path=None):
+        """File it under path (its own path by default). Returns its Folder"""
+        *directories, name = (file.path if path is None else path).split(sep)
+        folder = self.root
+        folder.file_count += 1
+        for directory in directories:
+            child = folder.folders.get(directory)
+            if child is None:
+                child = folder.folders[directory] = Folder(directory, folder)
+            child.file_count += 1
+            folder = child
+        folder.files[name] = file
+        return folder
+
+    def remove(self, file, path=None):
+        """Take it out of path (its own path by default), pruning emptied folders. Returns its former Folder"""
+        *directories, name = (file.path if path is None else path).split(sep)
+        folder = self.root
+        for directory in directories:
+            folder = folder.folders.get(directory)
+            if folder is None:
+                return None
+        if folder.files.get(name) is not file:
+            return None
+        del folder.files[name]
+        emptied = folder
+        while emptied is not None:
+            emptied.file_count -= 1
+            if not emptied.file_count and emptied.parent is not None:
+                del emptied.parent.folders[emptied.name]
+            emptied = emptied.parent
+        return folder
+
+    def move(self, file, old_path):
+        self.remove(file, old_path)
+        return self.add(file)
+
+    def folder(self, path):
+        """Return the Folder of a directory path (with or without a trailing os.sep) -> None if it holds no files"""
+        folder = self.root
+        for directory in path.rstrip(sep).split(sep):
+            folder = folder.folders.get(directory)
+            if folder is None:
+                return None
+        return folder
+
+
 class File(DatabaseObject):
+    __slots__ = ("path", "_hash", "_tags")
+    index = TagIndex()      # Tag index of the loaded files. Replaced by load_files
+    folders = DirectoryTrie()   # Directory trie of the loaded files. Replaced by load_files
 
     def __init__(self,  db_id: int, path: str, hash_id: str):
         super().__init__(db_id)
-        self.path = path
-        self.name = basename(self.path)
+        self.path = path        # The same string keys the files dict, so a path is only ever stored once
         self.hash_id = hash_id
-        self.tags = {}
+        self._tags = ()         # Linked tags. Most files have few or none -> a tuple costs a fraction of a dict
+
+    @property
+    def name(self):
+        return basename(self.path)
+
+    @property
+    def directory(self):
+        return dirname(self.path)
+
+    @property
+    def hash_id(self):
+        return self._hash.hex() if isinstance(self._hash, bytes) else self._hash
+
+    @hash_id.setter
+    def hash_id(self, hash_id):
+        # md5 hex digests are kept as their 16 raw bytes. Anything that doesn't round trip is kept as is
+        try:
+            raw = bytes.fromhex(hash_id)
+            self._hash = raw if raw.hex() == hash_id else hash_id
+        except (TypeError, ValueError):
+            self._hash = hash_id
+
+    def relocate(self, files, path):
+        """Point the file at the path it was moved to, re-keying it in files (keyed by path)"""
+        old_path = self.path
+        moved = files.pop(old_path, None) is self and old_path != path     # Not a file only now being loaded
+        self.path = path
+        files[path] = self
+        if moved:
+            self.folders.move(self, old_path)
+            events.dispatch("on_file_moved", self, old_path)
+
+    @staticmethod
+    def relocate_all(files, moves):
+        """Apply moves [(file_id, old path, new path), ...], as returned by reconciliation, to files (keyed by path)"""
+        for _, old, new in moves:
+            if old in files:
+                files[old].relocate(files, new)
+
+    @property
+    def tags(self):
+        """Read-only {Tag db_id: Tag} of linked tags -> change links through add_tags and remove_tags"""
+        return MappingProxyType({tag.db_id: tag for tag in self._tags})
+
+    def _link(self, tag):
+        if any(linked.db_id == tag.db_id for linked in self._tags):
+            return
+        if all(linked.group is not tag.group for linked in self._tags):
+            tag.group.file_count += 1   # First tag of this group on the file
+        self._tags += (tag, )
+
+    def _unlink(self, tag):
+        if all(linked.db_id != tag.db_id for linked in self._tags):
+            return
+        self._tags = tuple(linked for linked in self._tags if linked.db_id != tag.db_id)
+        if all(linked.group is not tag.group for linked in self._tags):
+            tag.group.file_count -= 1   # Last tag of this group on the file
 
     @classmethod
     def load_files(cls, database, tag_dict):
-        f_entries = database.read_entry([("files", "all")])[0]
+        # Both scans are ordered on file id, so links are attached to their file in a single merge pass
+        f_rows, l_rows = database.read_snapshot(["files", "tags_by_file"])
         files = {}
-        for f in f_entries:
+        tagged = {}         # tag_id: [files] -> bulk loaded into the tag index
+        index = TagIndex()
+        folders = DirectoryTrie()
+        link = next(l_rows, None)
+        for f in f_rows:
             new_f = cls(f[0], f[1], f[2])
             files[f[1]] = new_f         # Store by path string
-            for t in f[3]:              # Loop through tag ids
-                tag_obj = tag_dict[t]
-                tag_obj.files[f[1]] = new_f     # reference files by path
-                new_f.tags[tag_obj.db_id] = tag_obj
+            folders.add(new_f)
+            linked = []
+            while link is not None and link[0] == f[0]:
+                tag_obj = tag_dict[link[1]]
+                tag_obj.files[f[0]] = new_f
+                linked.append(tag_obj)
+                tagged.setdefault(tag_obj.db_id, []).append(new_f)
+                link = next(l_rows, None)
+            new_f._tags = tuple(linked)
+        index.add_all(files.values())
+        for tag_id, tag_files in tagged.items():
+            index.extend(tag_dict[tag_id], tag_files)
+        cls.index = index
+        cls.folders = folders
         object_logger.info("File objects initialized")
         return files
 
+    @staticmethod
+    def query(database, expression, files):
+        """Return the File objects (of files, keyed by path) matching a boolean tag query, in order of id"""
+        by_id = {file.db_id: file for file in files.values()}
+        return [by_id[file_id] for file_id in database.query_files(expression) if file_id in by_id]
+
+    @staticmethod
+    def move_directory(database, files, old_path, new_path):
+        """
+        Re-point every file below a directory that was moved or renamed on disk, in the database and in files (keyed
+        by path). returns (True, number of files moved) -> else (False, errmsg)
+        """
+        result = database.update_entry("directory", [{'old_path': old_path, 'new_path': new_path}])[0]
+        if not result[0]:
+            object_logger.warning("Directory move failed: " + str(result[1]))
+            return result
+        File.relocate_all(files, result[1])
+        return True, len(result[1])
+
     @classmethod
     def new_file(cls, path, database):
         file = database.create_entry("file", [{'file_path': path}])[0]  # Expect a list with 1 tuple
+        return cls._new_file(path, file, cls._collision(database, file))
+
+    @classmethod
+    async def new_file_async(cls, path, database):
+        """new_file over an AsyncDatabase -> hashing and writes are awaited, the object is built on return"""
+        def write(db):
+            file = db.create_entry("file", [{'file_path': path}])[0]
+            return file, cls._collision(db, file)
+        return cls._new_file(path, *await database.run(write, database.database))
+
+    @staticmethod
+    def _collision(database, file):
+        # Stored rows sharing the hash of a file that failed to be added -> None if added, or not a valid file
+        if file[0] or len(file) < 3:
+            return None
+        return database.read_entry([("files", "file_hash_name", file[2])])[0]
+
+    @classmethod
+    def _new_file(cls, path, file, check):
+        # Object side of new_file -> no database calls, so it is safe on the UI thread
         if not file[0]:
             object_logger.warning("Object creation failed: " + str(file[1]))
             # Check why:
-            file_hash = file[2]
-            check = database.read_entry([("files", "file_hash_name", file_hash)])[0]
+            if check is None:
+                return False, str(file[1])
             if not len(check):  # This empty
                 return False, f"The file at '{path}' exists but is not recognized. " \
                               f"Have you edited this file or renamed a different file to this name " \
@@ -159,7 +569,11 @@ class File(DatabaseObject):
             return False, f"This file is a duplicate of \n\n '{db_path}' \n\n " \
                           f"that has already been added to the database."
         object_logger.info(f"New File object '{file[0]}' created")
-        return True, cls(file[0], path, file[1])
+        new_f = cls(file[0], path, file[1])
+        cls.index.add(new_f)
+        cls.folders.add(new_f)
+        events.dispatch("on_file_added", new_f)
+        return True, new_f
 
     def delete(self, database):
         success = database.delete_entry("file", [{'file_id': self.db_id}])[0]       # Expect a return value?
@@ -169,16 +583,30 @@ class File(DatabaseObject):
             if str(success[1]) == "FOREIGN KEY constraint failed":
                 err_msg = "This file still has tags linked to it. Please unlink all tags and try again."
             return False, err_msg
+        self.index.remove(self)
+        self.folders.remove(self)
+        events.dispatch("on_file_removed", self)
         object_logger.info(f"Deleted File object '{self.db_id}'")
         return True,
 
+    def _pairs(self, tags):
+        return [{'file_id': self.db_id, 'tag_id': tag.db_id} for tag in tags]
+
     def add_tags(self, database, *tags):
+        return self._tags_added(tags, database.create_entry("tag-file", self._pairs(tags), batch=True))
+
+    async def add_tags_async(self, database, *tags):
+        """add_tags over an AsyncDatabase"""
+        return self._tags_added(tags, await database.create_entry("tag-file", self._pairs(tags), batch=True))
+
+    def _tags_added(self, tags, pairs):
         result = []
-        pairs = database.create_entry("tag-file", [{'file_id': self.db_id, 'tag_id': tag.db_id} for tag in tags])
         for i in range(len(tags)):
             if pairs[i][0]:
-                self.tags[tags[i].db_id] = tags[i]
-                tags[i].files[self.path] = self
+                self._link(tags[i])
+                tags[i].files[self.db_id] = self
+                self.index.link(tags[i], self)
+                events.dispatch("on_tag_linked", self, tags[i])
                 result.append((True, pairs[i][0]))
                 object_logger.info(f"File object '{self.db_id}' new tag '{tags[i].db_id}' linked")
                 continue
@@ -187,12 +615,20 @@ class File(DatabaseObject):
         return result
 
     def remove_tags(self, database, *tags):
+        return self._tags_removed(tags, database.delete_entry("tag-file", self._pairs(tags), batch=True))
+
+    async def remove_tags_async(self, database, *tags):
+        """remove_tags over an AsyncDatabase"""
+        return self._tags_removed(tags, await database.delete_entry("tag-file", self._pairs(tags), batch=True))
+
+    def _tags_removed(self, tags, status):
         # TODO since this is a compound operation, some might fail and others succeed
-        status = database.delete_entry("tag-file", [{'file_id': self.db_id, 'tag_id': tag.db_id} for tag in tags])
         for tag in range(len(tags)):
             if status[tag][0]:
-                del self.tags[tags[tag].db_id]
-                del tags[tag].files[self.path]
+                self._unlink(tags[tag])
+                del tags[tag].files[self.db_id]
+                self.index.unlink(tags[tag], self)
+                events.dispatch("on_tag_unlinked", self, tags[tag])
                 object_logger.info(f"File object '{self.db_id}' unlinked from tag '{tags[tag].db_id}' ")
             else:
                 object_logger.warning(f"Failed to unlink file object '{self.db_id}' from tag '{tags[tag].db_id}' ")
@@ -206,3 +642,121 @@ class File(DatabaseObject):
 
     def __repr__(self):
         return f"<{self.__class__} : {self.hash_id} : id {self.db_id}>"
+
+
+class ChangeTracker:
+    """
+    Keeps loaded groups, tags and files in step with changes committed to the database by any other connection.
+
+    Only the rows named in the database's change log since the last sync are read back (in one query per table) and
+    patched into the objects. Patching is idempotent, so changes this app made itself (and already applied) are
+    harmless to see again. Past RELOAD_AFTER changes, a full reload is cheaper than patching, and sync asks for one.
+    """
+    RELOAD_AFTER = 5000     # Changes patched in at most. See sync
+
+    def __init__(self, database):
+        self.database = database
+        self.last_change = database.last_change()
+
+    def poll(self, groups, tags, files):
+        """Sync if another connection has committed since the last poll. See sync"""
+        if not self.database.has_changed():
+            return set()
+        return self.sync(groups, tags, files)
+
+    def sync(self, groups, tags, files):
+        """
+        Apply all changes since the last sync to the dicts of loaded objects, as returned by
+        TagGroup.load_tag_collection and File.load_files
+        returns the set of changed tables -> None if too far behind (or too many changes, see RELOAD_AFTER), and the
+            objects must be reloaded in full
+        """
+        latest, changes = self.database.changes_since(self.last_change, self.RELOAD_AFTER)
+        self.last_change = latest
+        if changes is None:
+            object_logger.warning("Too many database changes to patch into the loaded objects, or the change log no "
+                                  "longer covers them. Full reload required")
+            return None
+
+        group_ids = {group.db_id: group for group in groups.values()}
+        removed_groups, removed_tags, removed_files = [], [], []    # Removed last, once nothing refers to them
+        for group_id, name in changes["tag_groups"]:
+            if name is None:
+                removed_groups.append(group_id)
+                continue
+            group = group_ids.get(group_id)
+            if group is None:
+                group = group_ids[group_id] = TagGroup(group_id, name)
+            elif group.name != name:
+                del groups[group.name]
+                group.name = name
+            groups[group.name] = group
+
+        for tag_id, name, group_id in changes["tags"]:
+            if name is None:
+                removed_tags.append(tag_id)
+                continue
+            tag = tags.get(tag_id)
+            if tag is None:
+                tag = tags[tag_id] = Tag(tag_id, name, group_ids[group_id])
+            elif tag.group.db_id != group_id:
+                del tag.group.tags[tag_id]
+                tag.group = group_ids[group_id]
+            tag.name = name
+            tag.group.tags[tag_id] = tag
+
+        for file_id, path, hash_id in changes["files"]:
+            file = File.index.file(file_id)
+            if path is None:
+                if file is not None:
+                    removed_files.append(file)
+                continue
+            added = file is None
+            if added:
+                file = File(file_id, path, hash_id)
+                File.index.add(file)
+            file.hash_id = hash_id
+            file.relocate(files, path)
+            if added:
+                File.folders.add(file)
+                events.dispatch("on_file_added", file)
+
+        for tag_id, file_id, linked in changes["tagged_files_m2m"]:
+            file = File.index.file(file_id)
+            tag = tags.get(tag_id)
+            if file is None or tag is None:
+                continue    # Removed as well
+            if linked and tag_id not in file.tags:
+                file._link(tag)
+                tag.files[file_id] = file
+                File.index.link(tag, file)
+                events.dispatch("on_tag_linked", file, tag)
+            elif not linked and tag_id in file.tags:
+                file._unlink(tag)
+                del tag.files[file_id]
+                File.index.unlink(tag, file)
+                events.dispatch("on_tag_unlinked", file, tag)
+
+        for file in removed_files:
+            for tag in file.tags.values():
+                tag.files.pop(file.db_id, None)
+            File.index.remove(file)
+            File.folders.remove(file)
+            files.pop(file.path, None)
+            events.dispatch("on_file_removed", file)
+        for tag_id in removed_tags:
+            if tag_id in tags:
+                tag = tags.pop(tag_id)
+                del tag.group.tags[tag_id]
+        for group_id in removed_groups:
+            if group_id in group_ids:
+                groups.pop(group_ids[group_id].name, None)
+
+        if changes["tags"]:     # A tag moved between groups changes both groups' counts
+            group_counts = self.database.file_counts()[1]
+            for group in groups.values():
+                group.file_count = group_counts.get(group.db_id, 0)
+
+        changed = {table for table, rows in changes.items() if rows}
+        object_logger.info(f"Applied {sum(len(rows) for rows in changes.values())} changed rows to loaded objects")
+        return changed
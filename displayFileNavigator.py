@@ -1,14 +1,13 @@
 import os
 
-from kivy.properties import ObjectProperty, StringProperty
-from kivy.uix.boxlayout import BoxLayout
+from kivy.properties import BooleanProperty, NumericProperty, ObjectProperty, StringProperty
 from kivy.uix.relativelayout import RelativeLayout
 from kivy.uix.screenmanager import NoTransition
-from kivy.uix.treeview import TreeViewLabel, TreeViewNode
 from kivy.uix.behaviors.togglebutton import ToggleButtonBehavior
 
-from databaseObjects import File
-from displayTagPane import RecycleTree
+from asyncDatabase import spawn
+from databaseObjects import File, events
+from recycleTree import BranchNode, RecycleTree, TreeLabel, TreeNode
 from modals import Notification
 
 import logging
@@ -23,6 +22,8 @@ filenav_logger = logging.getLogger(__name__)
 
 class FileNavigationPane(RelativeLayout):
     db = ObjectProperty()
+    adb = ObjectProperty()                              # AsyncDatabase of db -> for calls that may take a while
+    thumbnails = ObjectProperty()                       # ThumbnailService -> previews of the rows around a selection
     files = ObjectProperty()
     groups = ObjectProperty()
     tags = ObjectProperty()
@@ -32,9 +33,16 @@ class FileNavigationPane(RelativeLayout):
     system_view_path = StringProperty()
     default_sort = StringProperty()
     default_view = StringProperty()
+    lazy = BooleanProperty(False)           # Show branches with their file counts, and only fill them when opened
+    release_after = NumericProperty(60)     # Seconds before a collapsed branch is emptied again, in lazy mode
+    PREFETCH = 3                            # Rows above and below the selected file to prepare previews for
 
     def __init__(self, **kwargs):
         super(FileNavigationPane, self).__init__(**kwargs)
+        self.sort_mode = None       # "Folder" or "Tag" -> the layout of the database tree, for patching it
+        events.bind(on_file_added=self._file_added, on_file_removed=self._file_removed,
+                    on_file_moved=self._file_moved, on_tag_linked=self._tag_linked,
+                    on_tag_unlinked=self._tag_unlinked)
 
     def load_objects(self):
         if self.default_sort == "Folder":
@@ -67,54 +75,133 @@ class FileNavigationPane(RelativeLayout):
                 btn.dispatch("on_press")
 
     def sort_by_folder(self, *args):
+        self.sort_mode = "Folder"
         self.ids["db_tree"].clear_all_nodes()
         self.ids["db_tree"].indent_level = 18
-        for file in self.files.values():
-            self.ids["db_tree"].add_file_node(file.path, file)
+        self.ids["db_tree"].show_folder(File.folders.root)      # Paths are already split in the directory trie
         filenav_logger.info("Sort by folders...")
 
     def sort_by_tags(self, *args):
+        self.sort_mode = "Tag"
         self.ids["db_tree"].clear_all_nodes()
         self.ids["db_tree"].indent_level = 20
-        # TODO better method
-        untagged = TreeViewLabel(text="Untagged Files", no_selection=True)
-        self.ids["db_tree"].add_node(untagged)
-        self.ids["db_tree"].toggle_node(untagged)
+        if self.lazy:
+            self.ids["db_tree"].show_untagged(self.db.file_counts()[2])
+            for group in self.groups.values():
+                if group.has_files():
+                    self.ids["db_tree"].add_branch(group.name, ("group", group.db_id), group.file_count)
+            filenav_logger.info("Sort by tags...")
+            return
+        self.ids["db_tree"].show_untagged()
         for file in self.files.values():
             if not file.tags:
-                file_node = FileNode(file, no_selection=False)
-                self.ids["db_tree"].add_node(file_node, parent=untagged)
+                self.ids["db_tree"].add_untagged_file_node(file)
         # Only add Groups and Tags of tagged files - avoid adding empty tags
         for group in self.groups.values():
             if group.has_files():
-                g_node = TreeViewLabel(text=group.name, no_selection=True)
-                self.ids["db_tree"].add_node(g_node)
-                self.ids["db_tree"].toggle_node(g_node)                                 # Toggle Groups open
                 for tag in group.tags.values():
-                    if tag.files:
-                        t_node = TreeViewLabel(text=tag.name, no_selection=True)
-                        self.ids["db_tree"].add_node(t_node, parent=g_node)
-                        # self.ids["db_tree"].toggle_node(t_node)                         # Toggle Tags open
-                        for file in tag.files:
-                            f_node = FileNode(self.files[file], no_selection=False)
-                            self.ids["db_tree"].add_node(f_node, parent=t_node)
+                    for file in tag.files.values():
+                        self.ids["db_tree"].add_tagged_file_node(file, tag)
         filenav_logger.info("Sort by tags...")
 
+    # Lazy mode -> a branch is filled when first opened (see recycleTree.BranchNode)
+    def load_branch(self, tree, node):
+        if self.sort_mode == "Folder":
+            folder = File.folders.folder(node.key)
+            if folder is not None:
+                tree.show_folder(folder, node.key, node)
+            return
+        kind, db_id = node.key
+        if kind == "untagged":
+            for file in self.files.values():
+                if not file.tags:
+                    tree.add_leaf(file, (None, file.db_id), node)
+        elif kind == "group":
+            group = next(group for group in self.groups.values() if group.db_id == db_id)
+            for tag in group.tags.values():
+                if tag.file_count:
+                    tree.add_branch(tag.name, ("tag", tag.db_id), tag.file_count, node)
+        else:   # "tag"
+            for file in self.tags[db_id].files.values():
+                tree.add_leaf(file, (db_id, file.db_id), node)
+
+    # Model changes -> patch only the branches they touch, so open branches and the scroll position are kept
+    def _file_added(self, file):
+        if self.sort_mode == "Folder":
+            self.ids["db_tree"].sync_file_path(file.path, file)
+        elif self.sort_mode == "Tag":
+            for tag in file.tags.values():
+                self._show_tagged(file, tag)
+            if not file.tags:
+                self._show_untagged(file, 1)
+
+    def _file_removed(self, file):
+        if self.sort_mode == "Folder":
+            self.ids["db_tree"].sync_file_path(file.path)
+        elif self.sort_mode == "Tag":
+            for tag in file.tags.values():
+                self._hide_tagged(file, tag)
+            if not file.tags:
+                self._show_untagged(file, -1)
+
+    def _file_moved(self, file, old_path):
+        if self.sort_mode == "Folder":
+            self.ids["db_tree"].sync_file_path(old_path)
+            self.ids["db_tree"].sync_file_path(file.path, file)
+        elif self.sort_mode == "Tag":
+            self.ids["db_tree"].rename_file_nodes(file)
+
+    def _tag_linked(self, file, tag):
+        if self.sort_mode == "Tag":
+            if len(file.tags) == 1:     # Was untagged
+                self._show_untagged(file, -1)
+            self._show_tagged(file, tag)
+
+    def _tag_unlinked(self, file, tag):
+        if self.sort_mode == "Tag":
+            self._hide_tagged(file, tag)
+            if not file.tags:
+                self._show_untagged(file, 1)
+
+    def _show_tagged(self, file, tag):
+        if not self.lazy:
+            self.ids["db_tree"].add_tagged_file_node(file, tag)
+            return
+        tag_node = self.ids["db_tree"].count_tag_branches(tag)
+        if tag_node is not None:
+            self.ids["db_tree"].add_leaf(file, (tag.db_id, file.db_id), tag_node)
+
+    def _hide_tagged(self, file, tag):
+        if not self.lazy:
+            self.ids["db_tree"].remove_tag_file_node(file, tag)
+            return
+        self.ids["db_tree"].remove_leaf((tag.db_id, file.db_id))
+        self.ids["db_tree"].count_tag_branches(tag)
+
+    def _show_untagged(self, file, step):
+        if self.lazy:
+            self.ids["db_tree"].count_untagged(file, step)
+        elif step > 0:
+            self.ids["db_tree"].add_untagged_file_node(file)
+        else:
+            self.ids["db_tree"].remove_tag_file_node(file)
+
     def add_system_file_to_db(self, *args):
         # with dir_select to False, this should always only pass in files
         # Execute on System File View, doubleclick on file
         if not len(args[0]):       # Doubleclick on folder will return empty list of args
             return
-        success, new_file = File.new_file(args[0][0], self.db)
+        spawn(self._add_system_file_to_db(args[0][0]))
+
+    async def _add_system_file_to_db(self, path):
+        success, new_file = await File.new_file_async(path, self.adb)     # Hashing doesn't hold up the UI
         if not success:
             filenav_logger.warning(new_file)
             n = Notification(heading="Error", info=str(new_file))
             n.open()
             return
-        # Update Model
+        # Update Model -> the view patches itself (see _file_added)
         self.files[new_file.path] = new_file
-        # Update View
-        self.refresh_view()
         filenav_logger.info("New file node created")
 
     def remove_file_from_db(self, *args):
@@ -128,70 +215,203 @@ class FileNavigationPane(RelativeLayout):
             n.open()
             filenav_logger.warning("Failed file node deletion")
             return
-        # Remove from Model
+        # Remove from Model -> the view patches itself (see _file_removed)
         del self.files[args[0].db_object.path]
-        # Remove from View
-        self.ids["db_tree"].remove_node(args[0])
         filenav_logger.info("Successfully deleted file node")
 
     def set_active_file_object(self, selection):
+        if selection is None:       # Selected node removed
+            return
         if type(selection) == FileNode:
             self.active_selected_file = selection.db_object.path
+            self.prefetch_previews(selection)
             return
         if selection == []:
             return
         self.active_selected_file = selection[0]
 
+    def prefetch_previews(self, node):
+        # Nearest rows first, so the next file either way is ready soonest
+        if self.thumbnails is None:
+            return
+        near = self.ids["db_tree"].neighbours(node, self.PREFETCH)
+        self.thumbnails.prefetch((n.db_object.path, n.db_object.hash_id) for n in near if type(n) == FileNode)
 
-class FileNode(TreeViewNode, BoxLayout):
-    display_name = StringProperty()
 
-    def __init__(self, db_object, **kwargs):
-        super(FileNode, self).__init__(**kwargs)
+class FileNode(TreeNode):
+    __slots__ = ("db_object", "key")
+
+    def __init__(self, db_object, key=None, **kwargs):
+        super(FileNode, self).__init__(text=db_object.name, **kwargs)
         self.db_object = db_object
-        self.display_name = self.db_object.name
+        self.key = key      # Of the node in its layout, see DatabaseTree
 
 
 class DatabaseTree(RecycleTree):
+    lazy = BooleanProperty(False)       # Branches are only filled when opened (see FileNavigationPane.load_branch)
 
     def __init__(self, **kwargs):
         super(DatabaseTree, self).__init__(**kwargs)
-        self.directory_layout = {}    # Flat dict -> key: file_path (incl directories), value: node
+        self.directory_layout = {}    # Directory path (ending with os.sep) or file path: node
+        self.tag_layout = {}          # ("group", id) / ("tag", id) / (tag id, file id) -> node. tag id None: untagged
+        self.untagged = None
 
     def clear_all_nodes(self):
         super(DatabaseTree, self).clear_all_nodes()
         self.directory_layout.clear()
+        self.tag_layout.clear()
+        self.untagged = None
         filenav_logger.info("Cleared all database nodes...")
 
-    def add_file_node(self, file_path, file_obj):
-        # A function that auto creates folder labels by from a given path
-        path = file_path.split(os.sep)
-        file_name = path.pop()
+    # Nodes carry their layout key: a path in the folder layout, a tuple in the tag layout
+    def _layout(self, key):
+        return self.directory_layout if isinstance(key, str) else self.tag_layout
+
+    def add_branch(self, name, key, count, parent=None, loaded=False):
+        branch = BranchNode(name, key, count, is_open=loaded)
+        branch.loaded = loaded
+        self._layout(key)[key] = branch
+        return self.add_node(branch, parent=parent)
+
+    def add_leaf(self, file, key, parent):
+        if key not in self._layout(key):
+            self._layout(key)[key] = self.add_node(FileNode(file, key), parent=parent)
+
+    def remove_leaf(self, key):
+        file_node = self._layout(key).pop(key, None)
+        if file_node is not None:
+            self.remove_node(file_node)
+
+    def remove_branch(self, branch):
+        self._forget(branch)
+        self.remove_node(branch)
+
+    def release_node(self, branch):
+        for child in branch.nodes:
+            self._forget(child)
+        super(DatabaseTree, self).release_node(branch)
+        filenav_logger.debug(f"Released idle branch '{branch.name}'")
+
+    def _forget(self, node):
+        for released in self.iterate_all_nodes(node):
+            key = getattr(released, "key", None)
+            self._layout(key).pop(key, None)
+
+    # Folder layout -> built from the directory trie of the loaded files (File.folders)
+    def show_folder(self, folder, full_dir="", parent=None):
+        # Add a branch for every folder in folder, then its files. Unless lazy, all the way down
+        for name, child in folder.folders.items():
+            key = full_dir + name + os.sep
+            branch = self.add_branch(name or os.sep, key, child.file_count, parent, loaded=not self.lazy)
+            if not self.lazy:
+                self.show_folder(child, key, branch)
+        for file in folder.files.values():
+            self.add_leaf(file, file.path, parent)
+
+    def sync_file_path(self, file_path, file=None):
+        # After file was filed under file_path (None: a file was taken out of it), bring the branches above it in
+        # line with the directory trie, down to the first branch not loaded
+        parent = self.root
+        folder = File.folders.root
         full_dir = ''
-        parent = None
-        for directory in path:
-            full_dir += (directory + os.sep)
-            if full_dir not in self.directory_layout:                           # Directory does not exist
-                dir_node = TreeViewLabel(text=directory, no_selection=True)     # Create node for directory
-                self.directory_layout[full_dir] = dir_node              # Set reference between directory path and node
-                super(DatabaseTree, self).add_node(dir_node, parent=parent)     # Add to tree
-                self.toggle_node(dir_node)
-                parent = dir_node                                   # Set node as parent for next folder in hierarchy
-            else:                                                   # Directory already exists
-                parent = self.directory_layout[full_dir]            # Set node as parent for next folder in hierarchy
-        full_dir += file_name                                       # Get path for file
-        file_node = FileNode(file_obj)                              # Create node for File
-        self.directory_layout[full_dir] = file_node                 # Set reference between path and file
-        super(DatabaseTree, self).add_node(file_node, parent=parent)    # Add to Tree
-
-    def remove_file_node(self, file_node):
-        if len(file_node.parent_node.nodes) > 1:
-            del self.directory_layout[file_node.db_object.path]
-            super(DatabaseTree, self).remove_node(file_node)
+        for directory in file_path.split(os.sep)[:-1]:
+            full_dir += directory + os.sep
+            folder = folder.folders.get(directory)
+            branch = self.directory_layout.get(full_dir)
+            if folder is None:          # Emptied and pruned
+                if branch is not None:
+                    self.remove_branch(branch)
+                return
+            if branch is None:
+                branch = self.add_branch(directory or os.sep, full_dir, folder.file_count, parent,
+                                         loaded=not self.lazy)
+            else:
+                self.set_count(branch, folder.file_count)
+            if not branch.loaded:
+                return
+            parent = branch
+        if file is None:
+            self.remove_leaf(file_path)
         else:
-            parent_path = file_node.db_object.path.rpartition(os.sep)   # TODO - very messy. Make better
-            parent_path = parent_path[0] + parent_path[1]
-            del self.directory_layout[parent_path]
-            del self.directory_layout[file_node.db_object.path]
-            super(DatabaseTree, self).remove_node(file_node.parent_node)
-            super(DatabaseTree, self).remove_node(file_node)
+            self.add_leaf(file, file_path, parent)
+
+    # Tag layout
+    def show_untagged(self, count=None):
+        if count is None:
+            self.untagged = self.add_node(TreeLabel(text="Untagged Files", no_selection=True, is_open=True))
+        else:   # Lazy
+            self.untagged = self.add_branch("Untagged Files", ("untagged", None), count)
+
+    def add_untagged_file_node(self, file):
+        if (None, file.db_id) not in self.tag_layout:
+            self.tag_layout[(None, file.db_id)] = self.add_node(FileNode(file), parent=self.untagged)
+
+    def add_tagged_file_node(self, file, tag):
+        # Group and Tag branches are created with their first file
+        if (tag.db_id, file.db_id) in self.tag_layout:
+            return
+        group_node = self.tag_layout.get(("group", tag.group.db_id))
+        if group_node is None:
+            group_node = self.add_node(TreeLabel(text=tag.group.name, no_selection=True, is_open=True))
+            self.tag_layout[("group", tag.group.db_id)] = group_node
+        tag_node = self.tag_layout.get(("tag", tag.db_id))
+        if tag_node is None:
+            tag_node = self.add_node(TreeLabel(text=tag.name, no_selection=True), parent=group_node)
+            self.tag_layout[("tag", tag.db_id)] = tag_node
+        self.tag_layout[(tag.db_id, file.db_id)] = self.add_node(FileNode(file), parent=tag_node)
+
+    def remove_tag_file_node(self, file, tag=None):
+        # From the Untagged branch if tag is None. Tag and Group branches left empty are removed with the file
+        file_node = self.tag_layout.pop((None if tag is None else tag.db_id, file.db_id), None)
+        if file_node is None:
+            return
+        tag_node = file_node.parent_node
+        self.remove_node(file_node)
+        if tag is None or tag_node.nodes:
+            return
+        group_node = tag_node.parent_node
+        del self.tag_layout[("tag", tag.db_id)]
+        self.remove_node(tag_node)
+        if not group_node.nodes:
+            del self.tag_layout[("group", tag.group.db_id)]
+            self.remove_node(group_node)
+
+    def count_tag_branches(self, tag):
+        # Lazy tag layout: show the file counts of tag and its group, adding or removing their branches as they fill
+        # or empty. Returns the branch of tag, if loaded
+        group = tag.group
+        group_node = self.tag_layout.get(("group", group.db_id))
+        if group_node is None:
+            if group.has_files():
+                self.add_branch(group.name, ("group", group.db_id), group.file_count)
+            return None
+        if not group.has_files():
+            self.remove_branch(group_node)
+            return None
+        self.set_count(group_node, group.file_count)
+        if not group_node.loaded:
+            return None
+        tag_node = self.tag_layout.get(("tag", tag.db_id))
+        if tag_node is None:
+            if tag.file_count:
+                self.add_branch(tag.name, ("tag", tag.db_id), tag.file_count, group_node)
+            return None
+        if not tag.file_count:
+            self.remove_branch(tag_node)
+            return None
+        self.set_count(tag_node, tag.file_count)
+        return tag_node if tag_node.loaded else None
+
+    def count_untagged(self, file, step):
+        self.set_count(self.untagged, self.untagged.count + step)
+        if self.untagged.loaded and step > 0:
+            self.add_leaf(file, (None, file.db_id), self.untagged)
+        elif step < 0:
+            self.remove_leaf((None, file.db_id))
+
+    def rename_file_nodes(self, file):
+        for tag_id in (None, *file.tags):
+            file_node = self.tag_layout.get((tag_id, file.db_id))
+            if file_node is not None:
+                file_node.text = file.name
+                self.refresh_node(file_node)
@@ -2,6 +2,7 @@ from kivy.properties import ObjectProperty, DictProperty, NumericProperty
 from kivy.uix.button import Button
 from kivy.uix.relativelayout import RelativeLayout
 
+from asyncDatabase import spawn
 from databaseObjects import File
 from modals import Notification
 
@@ -20,12 +21,12 @@ class FileDisplayPane(RelativeLayout):
     active_tags = DictProperty()
 
     db = ObjectProperty()
+    adb = ObjectProperty()                              # AsyncDatabase of db -> for calls that may take a while
+    thumbnails = ObjectProperty()                       # ThumbnailService -> previews decoded off the Kivy thread
     files = ObjectProperty()
     groups = ObjectProperty()
     tags = ObjectProperty()
 
-    refresh_database = ObjectProperty()
-
     def __init__(self, **kwargs):
         super(FileDisplayPane, self).__init__(**kwargs)
         self.backup_images = {
@@ -54,20 +55,8 @@ class FileDisplayPane(RelativeLayout):
 
     def on_active_file(self, *args):
         # Display the selected file - gets update from File Manager
-        self.ids["file_display"].source = self.active_file
-        if not self.ids["file_display"]._coreimage:     # No convenient exposed property to see if image failed to load
-            split = self.active_file.split(".")
-            if len(split) == 1:
-                self.ids["file_display"].source = "resources/images/No-Image-Placeholder.svg.png"
-                display_logger.info(f"No default img selected for file without extension.")
-            else:
-                ext = split[-1]
-                if ext not in self.backup_images:
-                    self.ids["file_display"].source = "resources/images/No-Image-Placeholder.svg.png"
-                    display_logger.info(f"No default img found for '{ext}' file")
-                else:
-                    self.ids["file_display"].source = self.backup_images[ext]
-                    display_logger.info(f"Set default img for '{ext}' file")
+        file = self.files.get(self.active_file)
+        spawn(self._show_preview(self.active_file, None if file is None else file.hash_id))
 
         # Load tags of selected file
         self.ids["tag_display"].clear_widgets()         # Clear the display widget
@@ -78,6 +67,27 @@ class FileDisplayPane(RelativeLayout):
                 self.active_tags[tag.db_id] = display_tag      # Loaded tags status = 0 (no change)
                 self.ids["tag_display"].add_widget(display_tag)
 
+    async def _show_preview(self, path, hash_name):
+        texture = await self.thumbnails.preview(path, hash_name)    # Instant if cached or prefetched
+        if path != self.active_file:        # Another file was selected meanwhile
+            return
+        if texture is not None:
+            self.ids["file_display"].source = ""
+            self.ids["file_display"].texture = texture
+            return
+        split = path.split(".")
+        if len(split) == 1:
+            self.ids["file_display"].source = "resources/images/No-Image-Placeholder.svg.png"
+            display_logger.info(f"No default img selected for file without extension.")
+        else:
+            ext = split[-1]
+            if ext not in self.backup_images:
+                self.ids["file_display"].source = "resources/images/No-Image-Placeholder.svg.png"
+                display_logger.info(f"No default img found for '{ext}' file")
+            else:
+                self.ids["file_display"].source = self.backup_images[ext]
+                display_logger.info(f"Set default img for '{ext}' file")
+
     def toggle_tag_status(self, tag_button):
         """
         -1 - Delete         (Remove this tag from file)
@@ -125,10 +135,21 @@ class FileDisplayPane(RelativeLayout):
 
         if (not len(add_list)) and (not len(del_list)):     # If no changes, do nothing
             return
-
+        # Until this save is done, another press would spawn the same changes again -> a spurious duplicate error
+        self.ids["save_btn"].disabled = True
+        spawn(self._save_changes(self.active_file, add_list, del_list))
+
+    async def _save_changes(self, active_file, add_list, del_list):
+        try:
+            await self._apply_changes(active_file, add_list, del_list)
+        finally:
+            self.ids["save_btn"].disabled = False
+
+    async def _apply_changes(self, active_file, add_list, del_list):
+        # Hashing a new file and the writes are awaited -> the UI keeps running, and resumes here when they're done
         # Add the file if not in db
-        if self.active_file not in self.files:
-            success, new_file = File.new_file(self.active_file, self.db)
+        if active_file not in self.files:
+            success, new_file = await File.new_file_async(active_file, self.adb)
             if not success:
                 display_logger.warning("Failed to create File node")
                 n = Notification(heading="Error", info=str(new_file))
@@ -140,10 +161,10 @@ class FileDisplayPane(RelativeLayout):
             # Update View ?
             display_logger.info("Created new File node")
         else:
-            mod_file = self.files[self.active_file]
+            mod_file = self.files[active_file]
 
         # Add tags
-        result = mod_file.add_tags(self.db, *[x.tag for x in add_list])
+        result = await mod_file.add_tags_async(self.adb, *[x.tag for x in add_list])
         # Checks if tag operation succeeded
         # for tag in result:
         #     if not tag[0]:
@@ -154,13 +175,12 @@ class FileDisplayPane(RelativeLayout):
             i.status = 0                # Update Model
 
         # Delete tags
-        mod_file.remove_tags(self.db, *[x.tag for x in del_list])
+        await mod_file.remove_tags_async(self.adb, *[x.tag for x in del_list])
         # Update tag display
         for i in del_list:
             self.ids["tag_display"].remove_widget(i)    # Update View
-            del self.active_tags[i.tag.db_id]           # Update Model
+            self.active_tags.pop(i.tag.db_id, None)     # Update Model -> unless another file was selected meanwhile
         display_logger.info(f"Tags updated for File node {mod_file.db_id}")
-        self.refresh_database()
 
 
 class TagButton(Button):
@@ -1,10 +1,9 @@
-from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.relativelayout import RelativeLayout
-from kivy.properties import ObjectProperty, StringProperty
-from kivy.uix.treeview import TreeView, TreeViewNode
+from kivy.properties import ObjectProperty
 
 from modals import UserInputBox, SelectFromList, Notification
 from databaseObjects import TagGroup
+from recycleTree import TreeNode
 
 import logging
 tagpane_logger = logging.getLogger(__name__)
@@ -154,48 +153,26 @@ class TagPane(RelativeLayout):
         tagpane_logger.info("Successfully deleted tag node")
 
 
-class GroupNode(TreeViewNode, BoxLayout):
-    text = StringProperty()
+class GroupNode(TreeNode):
+    __slots__ = ("db_object", "add_tag_func", "del_tag_func")
+    viewclass = "GroupRow"
+    row_height = 36
 
     def __init__(self, db_object, add_tag_func, del_tag_func, **kwargs):
-        super(GroupNode, self).__init__(**kwargs)
+        super(GroupNode, self).__init__(text=db_object.name, no_selection=True, **kwargs)
         self.db_object = db_object
         self.add_tag_func = add_tag_func
         self.del_tag_func = del_tag_func
-        self.text = self.db_object.name
 
 
-class TagNode(TreeViewNode, BoxLayout):
-    text = StringProperty()
-
-    def __init__(self, db_object, **kwargs):
-        super(TagNode, self).__init__(**kwargs)
-        # Implement Double Click functionality
-        self.register_event_type('on_double_press')
-        if kwargs.get("on_double_press") is not None:
-            self.bind(on_double_press=kwargs.get("on_double_press"))
+class TagNode(TreeNode):
+    __slots__ = ("db_object", "double_press")
 
+    def __init__(self, db_object, on_double_press=None, **kwargs):
+        super(TagNode, self).__init__(text=db_object.name, **kwargs)
         self.db_object = db_object
-        self.text = self.db_object.name
-
-    # Implement Double Click functionality
-    def on_touch_down(self, touch):
-        if touch.is_double_tap:
-            self.dispatch('on_double_press', touch)
-            return True     # return True to stop dispatching, False to propagate
-        return BoxLayout.on_touch_down(self, touch)
-
-    # Implement Double Click functionality
-    def on_double_press(self, *args):
-        pass
-
-
-class RecycleTree(TreeView):
-
-    def __init__(self, **kwargs):
-        super(RecycleTree, self).__init__(**kwargs)
+        self.double_press = on_double_press
 
-    def clear_all_nodes(self):
-        for node in [x for x in self.iterate_all_nodes()]:
-            self.remove_node(node)
-        tagpane_logger.info("All nodes cleared..")
+    def on_double_press(self, touch):
+        if self.double_press is not None:
+            self.double_press(self, touch)
@@ -0,0 +1,156 @@
+"""Duplicate content report over directory trees and the database -> files are grouped by size, then by sampled
+fingerprint, and only files that still collide are read in full
+
+Headless use:
+    python duplicateReport.py DATABASE ROOT [ROOT ...] [--ext jpg png ...] [--glob "IMG_*" ...] [--candidates-only]
+                              [--workers 4]
+"""
+import argparse
+import os
+import sys
+from itertools import chain
+from operator import itemgetter
+
+from bulkImport import scan
+from elorydb import Database
+
+import logging
+report_logger = logging.getLogger(__name__)
+
+
+def _size_groups(database, roots, globs, extensions, library, min_size):
+    # Every candidate path by size -> stored files by their stored identity, anything else by a stat
+    stored = {}     # path: (file_id, size, fingerprint, digest or None if only known by fingerprint)
+    with database.reader() as conn:
+        for file_id, path, file_hash, size, fingerprint in conn.execute(
+                "SELECT file_id, file_path, file_hash_name, file_size, file_fingerprint FROM files"):
+            stored[path] = (file_id, size, fingerprint, file_hash if file_hash != fingerprint else None)
+    by_size = {}
+    if library:
+        for path, (_, size, _, _) in stored.items():
+            if size is not None:
+                by_size.setdefault(size, []).append(path)
+    for path in chain.from_iterable(scan(root, globs, extensions) for root in roots):
+        if library and path in stored and stored[path][1] is not None:
+            continue    # Already a candidate
+        size = stored[path][1] if path in stored else None
+        if size is None:
+            signature = database.stat_signature(path)
+            size = signature[0] if signature else None
+        if size is not None:
+            by_size.setdefault(size, []).append(path)
+    groups = sorted(((size, paths) for size, paths in by_size.items() if size >= min_size and len(paths) > 1),
+                    key=itemgetter(0), reverse=True)
+    return groups, stored
+
+
+def find_duplicates(database, roots, globs=None, extensions=None, library=True, workers=None, min_size=1):
+    """
+    Yield every group of files with identical content under roots (see scan), largest files first, as they are found.
+    library -> also compare against every file in the database, wherever it is. Otherwise only stored files under
+        roots are included
+    workers -> number of files read concurrently. Defaults to Database.HASH_WORKERS
+    min_size -> ignore smaller files, e.g. the many empty files every tree holds
+    yields (size, [(path, file_id or None if not in the database, ("Group:Tag", ...)), ...]) -> tagged copies first
+
+    Stored files are compared by their stored size and fingerprint, and only read if a full digest must decide. A
+    stored copy is reported only if its stat signature still matches the hash cache, or it is read again and matches.
+    """
+    roots = [os.path.abspath(root) for root in roots]
+    groups, stored = _size_groups(database, roots, globs, extensions, library, min_size)
+    report_logger.info(f"{sum(len(paths) for _, paths in groups)} files share their size with another")
+
+    def known(path, column):
+        return stored[path][column] if path in stored else None
+
+    # One stream of fingerprints for all groups, so reads overlap across groups of only two or three files
+    fingerprints = database.fingerprint_all((path for _, paths in groups for path in paths
+                                             if known(path, 2) is None), workers)
+    tag_names = None
+    for size, paths in groups:
+        by_fingerprint = {}
+        for path in paths:
+            fingerprint = known(path, 2) or next(fingerprints)
+            if fingerprint:
+                by_fingerprint.setdefault(fingerprint, []).append(path)
+        for candidates in by_fingerprint.values():
+            if len(candidates) < 2:
+                continue
+            unread = [path for path in candidates if known(path, 3) is None]
+            digests = dict(zip(unread, database.digest_all(unread, workers)))
+            by_digest = {}
+            for path in candidates:
+                digest = known(path, 3) or digests[path]
+                if digest:
+                    by_digest.setdefault(digest, []).append(path)
+            for digest, copies in by_digest.items():
+                # Stored identities are only trusted while the file is unchanged since -> read any other again
+                changed = [path for path in copies if path in stored and not _unchanged(database, path, stored[path])]
+                current = dict(zip(changed, database.digest_all(changed, workers)))     # False if stored but gone
+                copies = [path for path in copies if current.get(path, digest) == digest]
+                if len(copies) < 2:
+                    continue
+                if tag_names is None:
+                    tag_names = _tag_names(database)
+                yield size, _describe(database, copies, stored, tag_names)
+
+
+def _unchanged(database, path, identity):
+    # Is the stored file still what it was identified as -> its stat signature is the one cached with its fingerprint
+    signature = database.stat_signature(path)
+    if signature is None:
+        return False
+    with database.reader() as conn:
+        cached = conn.execute("SELECT file_fingerprint FROM hash_cache WHERE file_path=? AND file_size=? AND "
+                              "mtime_ns=? AND inode=? AND device=?", (path, *signature)).fetchone()
+    return cached is not None and cached[0] == identity[2]
+
+
+def _tag_names(database):
+    with database.reader() as conn:
+        return {tag_id: f"{group_name}:{tag_name}" for tag_id, tag_name, group_name in conn.execute(
+            "SELECT tag_id, tag_name, group_name FROM tags JOIN tag_groups ON tag_group=group_id")}
+
+
+def _describe(database, copies, stored, tag_names):
+    file_ids = [stored[path][0] if path in stored else None for path in copies]
+    links = database.read_entry([("tags", "file_id", file_id) for file_id in file_ids if file_id is not None])
+    links = iter(links)
+    described = []
+    for path, file_id in zip(copies, file_ids):
+        tags = () if file_id is None else tuple(sorted(tag_names[row[0]] for row in next(links)))
+        described.append((path, file_id, tags))
+    return sorted(described, key=lambda copy: (not copy[2], copy[1] is None, copy[0]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report files with identical content under directories, "
+                                                 "and in an Elory database.")
+    parser.add_argument("database", help="path of the .edb database file")
+    parser.add_argument("roots", nargs="+", help="directories to search, including all subdirectories")
+    parser.add_argument("--ext", nargs="+", default=[], help="only compare files with these extensions")
+    parser.add_argument("--glob", nargs="+", default=[], help="only compare files with names matching these patterns")
+    parser.add_argument("--candidates-only", action="store_true",
+                        help="ignore stored files outside the directories searched")
+    parser.add_argument("--workers", type=int, default=None, help="files read in parallel")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s")
+    database = Database(hash_workers=args.workers)
+    database.connect_db(args.database)
+    groups = reclaimable = 0
+    try:
+        for size, copies in find_duplicates(database, args.roots, args.glob, args.ext,
+                                            library=not args.candidates_only):
+            groups += 1
+            reclaimable += size * (len(copies) - 1)
+            for path, file_id, tags in copies:
+                print(f"{groups}\t{size}\t{path}\t{'' if file_id is None else file_id}\t{', '.join(tags)}")
+    finally:
+        database._disconnect()
+    print(f"{groups} groups of duplicates, {reclaimable} bytes reclaimable", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
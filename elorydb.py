@@ -1,7 +1,16 @@
 from sqlite3 import DatabaseError, IntegrityError, connect
 import os.path
 import hashlib
-from pathlib import PurePath
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial, wraps
+from pathlib import Path, PurePath
+from queue import Empty, LifoQueue
+
+from librarySnapshot import LibrarySnapshot
+from tagQuery import compile_query
 
 import logging
 db_logger = logging.getLogger(__name__)
@@ -13,13 +22,84 @@ db_logger = logging.getLogger(__name__)
 # db_logger.propagate = False
 
 
+def _writer(method):
+    # Serialize a method on the single writer connection, so that it can be called from any thread
+    @wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._write_lock:
+            return method(self, *args, **kwargs)
+    return locked
+
+
+class ReaderPool:
+    """A bounded pool of read-only connections to a database file, shared between threads.
+
+    Under WAL, reads on these connections run alongside the writer connection and see the last committed state.
+    """
+    _SETTINGS = ("cache_size", "mmap_size", "temp_store", "busy_timeout")  # Profile pragmas that apply to readers
+
+    def __init__(self, path, size, settings):
+        self.uri = Path(path).resolve().as_uri() + "?mode=ro"
+        self.size = size
+        self.settings = settings
+        self._idle = LifoQueue()    # Most recently used first -> warmest page cache
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+
+    def _open(self):
+        conn = connect(self.uri, uri=True, check_same_thread=False)
+        for pragma in self._SETTINGS:
+            conn.execute(f"PRAGMA {pragma} = {self.settings[pragma]}")
+        return conn
+
+    def checkout(self):
+        if self._closed:
+            raise DatabaseError("Database connection is closed")
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+        with self._lock:
+            opening = self._opened < self.size
+            if opening:
+                self._opened += 1
+        if not opening:
+            return self._idle.get()     # Wait for another thread to hand one back
+        try:
+            return self._open()
+        except DatabaseError:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def checkin(self, conn):
+        with self._lock:
+            if not self._closed:
+                self._idle.put(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                break
+
+
 class Database:
     _DEFINITION = {  # {
         "files": (  # table_name: (
             {"file_id": "INTEGER PRIMARY KEY",  # {column_name: column_definition},
              "file_path": "TEXT UNIQUE NOT NULL",  # {constraint: constraint_definition}
-             "file_hash_name": "TEXT UNIQUE NOT NULL"},  # ),
-            {}  # }
+             "file_hash_name": "TEXT UNIQUE NOT NULL",  # ),
+             "file_size": "INTEGER",  # }
+             "file_fingerprint": "TEXT",
+             "file_mtime": "INTEGER"},  # Modification time (ns) when last identified
+            {}
         ),
         "tag_groups": (
             {"group_id": "INTEGER PRIMARY KEY",
@@ -41,22 +121,222 @@ class Database:
              "UNIQUE(tag, file)": "ON CONFLICT FAIL"}
         )
     }
+    _AUXILIARY_DEFINITION = {  # Same format as _DEFINITION. Derived data only: added to existing databases on connect
+        "hash_cache": (
+            {"file_path": "TEXT PRIMARY KEY",  # Absolute path of the hashed file
+             "file_size": "INTEGER NOT NULL",  # Stat signature at the time of hashing ->
+             "mtime_ns": "INTEGER NOT NULL",
+             "inode": "INTEGER NOT NULL",
+             "device": "INTEGER NOT NULL",  # <-
+             "file_hash_name": "TEXT",  # NULL if only the fingerprint is known
+             "file_fingerprint": "TEXT NOT NULL"},
+            {}
+        ),
+        "change_log": (
+            {"change_id": "INTEGER PRIMARY KEY",  # Increases with every change, across connections
+             "entity": "TEXT NOT NULL",  # Name of the changed table
+             "entity_id": "INTEGER NOT NULL",  # Primary key of the changed row -> tag id of a tag-file link
+             "other_id": "INTEGER"},  # File id of a tag-file link
+            {}
+        ),
+        "file_counts": (
+            {"scope": "TEXT NOT NULL",  # 'tag', 'group' or 'untagged'
+             "scope_id": "INTEGER NOT NULL",  # tag_id or group_id -> 0 for 'untagged'
+             "file_count": "INTEGER NOT NULL"},  # Distinct files linked to the tag, or any tag of the group
+            {"PRIMARY KEY(scope, scope_id)": ""}
+        ),
+        "import_checkpoints": (
+            {"root": "TEXT PRIMARY KEY",  # Absolute path of the imported directory tree
+             "last_path": "TEXT NOT NULL",  # Last file of the last committed batch, in walk order
+             "imported": "INTEGER NOT NULL",  # Running totals of the import so far ->
+             "existing": "INTEGER NOT NULL",
+             "duplicates": "INTEGER NOT NULL",
+             "failed": "INTEGER NOT NULL"},  # <-
+            {}
+        ),
+    }
+    _AUXILIARY_FILL = {  # table: statements that fill it whenever it is (re)built -> triggers keep it current after
+        "file_counts": "INSERT INTO file_counts SELECT 'tag', tag, COUNT(*) FROM tagged_files_m2m GROUP BY tag;\n"
+                       "INSERT INTO file_counts SELECT 'group', tag_group, COUNT(DISTINCT file) "
+                       "FROM tagged_files_m2m JOIN tags ON tag=tag_id GROUP BY tag_group;\n"
+                       "INSERT INTO file_counts SELECT 'untagged', 0, COUNT(*) FROM files "
+                       "WHERE file_id NOT IN (SELECT file FROM tagged_files_m2m);\n",
+    }
+    _COUNT_UP = "ON CONFLICT(scope, scope_id) DO UPDATE SET file_count = file_count + 1"
+    _TRIGGERS = {  # trigger_name: definition -> added to existing databases on connect
+        "count_link_insert": "AFTER INSERT ON tagged_files_m2m BEGIN "
+            f"INSERT INTO file_counts VALUES ('tag', NEW.tag, 1) {_COUNT_UP}; "
+            "INSERT INTO file_counts SELECT 'group', tag_group, 1 FROM tags AS t WHERE tag_id=NEW.tag AND NOT EXISTS "
+            "(SELECT 1 FROM tagged_files_m2m JOIN tags ON tag=tag_id WHERE file=NEW.file AND tag!=NEW.tag "
+            f"AND tag_group=t.tag_group) {_COUNT_UP}; "
+            "UPDATE file_counts SET file_count = file_count - 1 WHERE scope='untagged' AND NOT EXISTS "
+            "(SELECT 1 FROM tagged_files_m2m WHERE file=NEW.file AND tag!=NEW.tag); END",
+        "count_link_delete": "AFTER DELETE ON tagged_files_m2m BEGIN "
+            "UPDATE file_counts SET file_count = file_count - 1 WHERE scope='tag' AND scope_id=OLD.tag; "
+            "UPDATE file_counts SET file_count = file_count - 1 WHERE scope='group' AND scope_id="
+            "(SELECT tag_group FROM tags WHERE tag_id=OLD.tag) AND NOT EXISTS (SELECT 1 FROM tagged_files_m2m "
+            "JOIN tags ON tag=tag_id WHERE file=OLD.file AND tag_group=file_counts.scope_id); "
+            "UPDATE file_counts SET file_count = file_count + 1 WHERE scope='untagged' AND NOT EXISTS "
+            "(SELECT 1 FROM tagged_files_m2m WHERE file=OLD.file); END",
+        "count_file_insert": "AFTER INSERT ON files BEGIN "
+            "UPDATE file_counts SET file_count = file_count + 1 WHERE scope='untagged'; END",
+        "count_file_delete": "AFTER DELETE ON files BEGIN "   # Tagged files can't be deleted
+            "UPDATE file_counts SET file_count = file_count - 1 WHERE scope='untagged'; END",
+        "count_tag_move": "AFTER UPDATE OF tag_group ON tags BEGIN "
+            "INSERT OR IGNORE INTO file_counts VALUES ('group', NEW.tag_group, 0); "
+            "UPDATE file_counts SET file_count = (SELECT COUNT(DISTINCT file) FROM tagged_files_m2m JOIN tags "
+            "ON tag=tag_id WHERE tag_group=file_counts.scope_id) "
+            "WHERE scope='group' AND scope_id IN (OLD.tag_group, NEW.tag_group); END",
+        "count_tag_delete": "AFTER DELETE ON tags BEGIN "
+            "DELETE FROM file_counts WHERE scope='tag' AND scope_id=OLD.tag_id; END",
+        "count_group_delete": "AFTER DELETE ON tag_groups BEGIN "
+            "DELETE FROM file_counts WHERE scope='group' AND scope_id=OLD.group_id; END",
+        "move_hash_cache": "AFTER UPDATE OF file_path ON files BEGIN "  # A moved file keeps its cached identity
+            "UPDATE OR REPLACE hash_cache SET file_path=NEW.file_path WHERE file_path=OLD.file_path; END",
+    }
+    _LOGGED_TABLES = {  # table: (entity_id, other_id, updated columns) -> triggers record every change in change_log
+        "tag_groups": ("group_id", None, None),
+        "tags": ("tag_id", None, None),
+        "files": ("file_id", None, "file_path, file_hash_name"),
+        "tagged_files_m2m": ("tag", "file", None),
+    }
+    _CHANGE_LOG_SIZE = 100000  # Changes kept on connect. A client further behind than this has to reload in full
+    _INDEXES = {  # index_name: (table(columns), a lookup the index serves) -> added to existing databases on connect
+        "idx_tagged_files_file": ("tagged_files_m2m(file, tag)",    # Covering: the UNIQUE(tag, file) index serves tags
+                                  "SELECT tag FROM tagged_files_m2m WHERE file=?"),
+        "idx_tags_group": ("tags(tag_group, tag_id, tag_name)",     # Covering
+                           "SELECT tag_id, tag_name FROM tags WHERE tag_group=?"),
+        "idx_files_identity": ("files(file_size, file_fingerprint)",  # file_hash_name has its own UNIQUE index
+                               "SELECT file_id, file_path, file_hash_name, file_fingerprint FROM files "
+                               "WHERE file_size=? AND file_fingerprint=?"),
+    }
+    _LATE_COLUMNS = {  # Columns of _DEFINITION added after release -> added to older databases on connect
+        "files": ("file_size", "file_fingerprint", "file_mtime"),
+    }
     _DEFAULT_VALUES = {  # groups: [tags]
         "People": ["Jack Pembleton", "Benoit Blanc", "Kimberly Mathis"],
         "Places": ["New York", "Livingstone Beach", "Frontier National Park", "Modena Vacation Home"],
         "Pets": ["Leah -Dog", "Luna -Cat", "Jack -Bird"]
     }
+    _PROFILES = {  # profile_name: {pragma: value} -> connection performance settings
+        "desktop": {  # Interactive use. WAL lets readers carry on while a write commits
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",    # With WAL, a crash can only lose the last commits, never corrupt the database
+            "cache_size": -64000,       # Negative -> KiB. ~64 MB page cache
+            "mmap_size": 268435456,     # 256 MB memory mapped reads
+            "temp_store": "MEMORY",
+            "busy_timeout": 5000,       # ms to wait on a lock held by another connection/process
+            "wal_autocheckpoint": 1000,
+            "query_only": "OFF",
+        },
+        "bulk-import": {  # Long write jobs - large cache, checkpoint the WAL less often
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -256000,
+            "mmap_size": 1073741824,
+            "temp_store": "MEMORY",
+            "busy_timeout": 30000,
+            "wal_autocheckpoint": 10000,
+            "query_only": "OFF",
+        },
+        "read-only": {  # Browsing and reports - reject writes, map as much of the file as possible
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -64000,
+            "mmap_size": 1073741824,
+            "temp_store": "MEMORY",
+            "busy_timeout": 5000,
+            "wal_autocheckpoint": 1000,
+            "query_only": "ON",
+        },
+    }
     _FILE_IDENTIFIER = ".edb"  # elory database
+    _SAMPLE_SIZE = 64 * 1024  # Bytes read from each of the head, middle and tail of a file to fingerprint it
+    _CACHE_CHUNK = 64  # Newly read files written to the hash cache per transaction
+    _READ_STATEMENTS = {  # (item, property): (statement, key type) -> the fixed statements read_entry dispatches to
+        # Statement texts never change, so every lookup hits the connection's prepared statement cache,
+        # and keys are bound with the column's own type so they compare (and use indexes) as stored
+        ("files", "file_id"): ("SELECT * FROM files WHERE file_id=?", int),
+        ("files", "file_path"): ("SELECT * FROM files WHERE file_path=?", str),
+        ("files", "file_hash_name"): ("SELECT * FROM files WHERE file_hash_name=?", str),
+        ("files", "file_size"): ("SELECT * FROM files WHERE file_size=?", int),
+        ("files", "file_fingerprint"): ("SELECT * FROM files WHERE file_fingerprint=?", str),
+        ("files", "tag_id"): ("SELECT file, tag FROM tagged_files_m2m WHERE tag=?", int),
+        ("tag_groups", "group_id"): ("SELECT * FROM tag_groups WHERE group_id=?", int),
+        ("tag_groups", "group_name"): ("SELECT * FROM tag_groups WHERE group_name=?", str),
+        ("tag_groups", "tag_id"): ("SELECT * FROM tag_groups WHERE group_id=(SELECT tag_group FROM tags WHERE tag_id=?)",
+                                   int),
+        ("tag_groups", "tag_name"): ("SELECT * FROM tag_groups WHERE group_id IN "
+                                     "(SELECT tag_group FROM tags WHERE tag_name=?)", str),
+        ("tags", "tag_id"): ("SELECT * FROM tags WHERE tag_id=?", int),
+        ("tags", "tag_name"): ("SELECT * FROM tags WHERE tag_name=?", str),
+        ("tags", "tag_group"): ("SELECT * FROM tags WHERE tag_group=?", int),
+        ("tags", "group_id"): ("SELECT * FROM tags WHERE tag_group=?", int),
+        ("tags", "group_name"): ("SELECT * FROM tags WHERE tag_group=(SELECT group_id FROM tag_groups WHERE group_name=?)",
+                                 str),
+        ("tags", "file"): ("SELECT tag, file FROM tagged_files_m2m WHERE file=?", int),
+        ("tags", "file_id"): ("SELECT tag, file FROM tagged_files_m2m WHERE file=?", int),
+        ("tags", "file_path"): ("SELECT tag, file FROM tagged_files_m2m WHERE file="
+                                "(SELECT file_id FROM files WHERE file_path=?)", str),
+        ("tags", "file_hash_name"): ("SELECT tag, file FROM tagged_files_m2m WHERE file="
+                                     "(SELECT file_id FROM files WHERE file_hash_name=?)", str),
+    }
+    _SNAPSHOT_QUERIES = {  # snapshot_name: ordered set-based scan
+        "tag_groups": "SELECT * FROM tag_groups ORDER BY group_id",
+        "tags": "SELECT * FROM tags ORDER BY tag_id",
+        "files": "SELECT file_id, file_path, file_hash_name FROM files ORDER BY file_id",
+        "tags_by_group": "SELECT tag_group, tag_id, tag_name FROM tags ORDER BY tag_group, tag_id",
+        "tags_by_file": "SELECT file, tag FROM tagged_files_m2m ORDER BY file, tag",
+        "files_by_tag": "SELECT tag, file FROM tagged_files_m2m ORDER BY tag, file",
+    }
+    _CHANGE_QUERIES = {  # table_name: its rows named in change_log after a change id -> NULL columns once removed
+        # One join per table, so a sync costs four queries however many rows another connection changed
+        "tag_groups": "SELECT DISTINCT c.entity_id, g.group_name FROM change_log AS c "
+                      "LEFT JOIN tag_groups AS g ON g.group_id=c.entity_id "
+                      "WHERE c.change_id > ? AND c.entity='tag_groups'",
+        "tags": "SELECT DISTINCT c.entity_id, t.tag_name, t.tag_group FROM change_log AS c "
+                "LEFT JOIN tags AS t ON t.tag_id=c.entity_id WHERE c.change_id > ? AND c.entity='tags'",
+        "files": "SELECT DISTINCT c.entity_id, f.file_path, f.file_hash_name FROM change_log AS c "
+                 "LEFT JOIN files AS f ON f.file_id=c.entity_id WHERE c.change_id > ? AND c.entity='files'",
+        "tagged_files_m2m": "SELECT DISTINCT c.entity_id, c.other_id, m.file IS NOT NULL FROM change_log AS c "
+                            "LEFT JOIN tagged_files_m2m AS m ON m.tag=c.entity_id AND m.file=c.other_id "
+                            "WHERE c.change_id > ? AND c.entity='tagged_files_m2m'",
+    }
+    _SNAPSHOT_CHILDREN = {  # table_name: snapshot of its linked ids, keyed on the table's primary key
+        "tag_groups": "tags_by_group",
+        "tags": "files_by_tag",
+        "files": "tags_by_file",
+    }
 
     DATA_DIR = ''
-    CONN = None
+    CONN = None     # The writer connection. Shared by all threads, behind _write_lock
     CURS = None
+    READERS = 4     # Maximum read-only connections open at once. See ReaderPool
+    HASH_WORKERS = 4    # Files hashed concurrently. Raise for fast SSD/NVMe storage, use 1 for slow USB/network disks
+    PROFILE = "desktop"     # Performance profile applied on every connect. See _PROFILES
 
-    def __init__(self, path=None, create_new=None, data_dir=None):
+    def __init__(self, path=None, create_new=None, data_dir=None, hash_workers=None, profile=None, readers=None):
         # Data directory -> The database storage location. Defaults to cwd
         # Path -> shorthand for "connect to db"
         # Create new -> Shorthand for "create new db" at "path"
+        # Hash workers -> Number of files hashed concurrently during file ingestion. Defaults to HASH_WORKERS
+        # Profile -> Name of the performance profile to connect with. Defaults to PROFILE
+        # Readers -> Maximum number of read-only connections, for reads from other threads. Defaults to READERS
         self.DATA_DIR = os.getcwd() if (data_dir is None or not os.path.isdir(data_dir)) else data_dir
+        if hash_workers is not None:
+            self.HASH_WORKERS = max(1, hash_workers)
+        if profile is not None:
+            if profile not in self._PROFILES:
+                raise DatabaseError(f"'{profile}' is not a valid performance profile")
+            self.PROFILE = profile
+        if readers is not None:
+            self.READERS = max(1, readers)
+        self.CONN = None
+        self.CURS = None
+        self._pool = None
+        self._write_lock = threading.RLock()
+        self._local = threading.local()     # Reader connection held by each thread
+        self._data_version = None
         # self.PATH = path
 
     def _prepare_path(self, path):
@@ -71,34 +351,93 @@ class Database:
         path = self.DATA_DIR + os.sep + path + self._FILE_IDENTIFIER  # Take
         return path
 
+    @staticmethod
+    def _table_definition(table, definition, if_not_exists=False):
+        table_template = f"CREATE TABLE {'IF NOT EXISTS ' if if_not_exists else ''}{table}("  # Open Table definition
+        for column in definition[0].keys():
+            table_template += f"{column} {definition[0][column]}, "  # Add columns
+        for constn in definition[1].keys():
+            table_template += f"{constn} {definition[1][constn]}, "  # Add constraints
+        return table_template.rstrip(", ") + ");\n"  # close table definition
+
     def _build_tables(self, default_values=True):
         table_template = "BEGIN;\n"  # SQL script start
         for table in self._DEFINITION.keys():
-            table_template += f"CREATE TABLE {table}("  # Open Table definition
-            for column in self._DEFINITION[table][0].keys():
-                table_template += f"{column} {self._DEFINITION[table][0][column]}, "  # Add columns
-            for constn in self._DEFINITION[table][1].keys():
-                table_template += f"{constn} {self._DEFINITION[table][1][constn]}, "  # Add constraints
-            table_template = table_template.rstrip(", ") + ");\n"  # close table definition
+            table_template += self._table_definition(table, self._DEFINITION[table])
         table_template += "COMMIT;\n"  # SQL script end
         self.CURS.executescript(table_template)
         db_logger.info(f"Initialized tables for database '{self.PATH}'")
+        self._build_auxiliary()
         if default_values:
             groups = []
             tags = []
             for key in self._DEFAULT_VALUES.keys():
                 groups.append({"group_name": key})
-            group_ids = self.create_entry("group", groups)
+            group_ids = self.create_entry("group", groups, batch=True)
             groups = [[y for y in x.values()][0] for x in groups]       # FIXME a consequence of the unintuitive DB API
             for g in zip(groups, group_ids):
                 for tag in self._DEFAULT_VALUES[g[0]]:
                     tags.append({'tag_name': tag, 'group': g[1][1]})
-            self.create_entry("tag", tags)
+            self.create_entry("tag", tags, batch=True)
             db_logger.info(f"Initialized default values for database '{self.PATH}'")
 
+    def _build_auxiliary(self):
+        # Auxiliary tables only hold derived data, so they can be (re)created on any database at any time
+        table_template = "BEGIN;\n"
+        for table in self._AUXILIARY_DEFINITION.keys():
+            self.CURS.execute(f"PRAGMA table_info({table});")
+            columns = {x[1] for x in self.CURS.fetchall()}
+            if columns and columns != self._AUXILIARY_DEFINITION[table][0].keys():     # Outdated format -> rebuild
+                db_logger.warning(f"Rebuilding outdated table '{table}' in database '{self.PATH}'")
+                table_template += f"DROP TABLE {table};\n"
+            table_template += self._table_definition(table, self._AUXILIARY_DEFINITION[table], if_not_exists=True)
+            if columns != self._AUXILIARY_DEFINITION[table][0].keys():     # New or rebuilt -> fill from main tables
+                table_template += self._AUXILIARY_FILL.get(table, "")
+        for index in self._INDEXES.keys():
+            table_template += f"CREATE INDEX IF NOT EXISTS {index} ON {self._INDEXES[index][0]};\n"
+        for trigger in self._TRIGGERS.keys():
+            table_template += f"CREATE TRIGGER IF NOT EXISTS {trigger} {self._TRIGGERS[trigger]};\n"
+        for table, (entity_id, other_id, updated) in self._LOGGED_TABLES.items():
+            for event, row in (("INSERT", "NEW"), ("DELETE", "OLD"), ("UPDATE", "NEW")):
+                if event == "UPDATE" and updated:
+                    event = f"UPDATE OF {updated}"
+                other = f"{row}.{other_id}" if other_id else "NULL"
+                table_template += f"CREATE TRIGGER IF NOT EXISTS log_{table}_{event.split()[0].lower()} " \
+                                  f"AFTER {event} ON {table} BEGIN INSERT INTO change_log (entity, entity_id, " \
+                                  f"other_id) VALUES ('{table}', {row}.{entity_id}, {other}); END;\n"
+        table_template += "COMMIT;\n"
+        self.CURS.executescript(table_template)
+        db_logger.info(f"Initialized auxiliary tables and indexes for database '{self.PATH}'")
+
+    def _upgrade_tables(self):
+        # Add any late columns this database predates
+        for table in self._LATE_COLUMNS.keys():
+            self.CURS.execute(f"PRAGMA table_info({table});")
+            columns = {x[1] for x in self.CURS.fetchall()}
+            for column in self._LATE_COLUMNS[table]:
+                if column not in columns:
+                    self.CURS.execute(f"ALTER TABLE {table} ADD COLUMN {column} {self._DEFINITION[table][0][column]}")
+                    db_logger.warning(f"Added column '{table}.{column}' to database '{self.PATH}'")
+        # Sizes and times only cost a stat to fill in. Fingerprints are read later, off the connect path -> see
+        # fill_fingerprints. Rows of missing files stay NULL, and are left to reconciliation
+        self.CURS.execute("SELECT file_id, file_path FROM files WHERE file_size IS NULL OR file_mtime IS NULL")
+        stats = [(sig[0], sig[1], file_id) for file_id, path in self.CURS.fetchall() if (sig := self.stat_signature(path))]
+        self.CURS.executemany("UPDATE files SET file_size=?, file_mtime=? WHERE file_id=?", stats)
+        self.CONN.commit()
+
+    @_writer
     def _disconnect(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
         if self.CONN is not None:
+            if not self.CONN.execute("PRAGMA query_only").fetchone()[0]:   # optimize writes -> not when read-only
+                try:
+                    self.CONN.execute("PRAGMA optimize")    # Refresh planner statistics where sqlite thinks they're stale
+                except DatabaseError as errmsg:             # Locked by another writer... -> still close
+                    db_logger.warning(f"Skipped optimizing database '{self.PATH}' - {errmsg}")
             self.CONN.close()
+            self.CONN = None
             db_logger.info(f"Database '{self.PATH}' closed.")
 
     def _definition_exists(self):
@@ -111,7 +450,7 @@ class Database:
             errmsg = "Required tables not present in database"
             db_logger.warning(f"{errmsg} '{self.PATH}'")
             return False
-        if len(db_tables) > len(fmt_tables):  # Warn if foreign tables are present
+        if db_tables - fmt_tables - self._AUXILIARY_DEFINITION.keys():  # Warn if foreign tables are present
             db_logger.warning(f"Unrecognized tables detected in database '{self.PATH}'")
 
         # Check for column format mismatch
@@ -121,7 +460,7 @@ class Database:
             # TODO find better way to filter FOREIGN and UNIQUE constraint definitions -> the below method is fragile
             expected = {x for x in self._DEFINITION[i][0].keys()}
             # expected = {x for x in self._DEFINITION[i].keys() if 'FOREIGN' not in x and 'UNIQUE' not in x}
-            if not columns == expected:
+            if not expected - set(self._LATE_COLUMNS.get(i, ())) <= columns <= expected:     # Late columns optional
                 errmsg = "Tables exist but do not match the required column formats in database"
                 db_logger.warning(f"{errmsg} '{self.PATH}'")
                 return False
@@ -154,7 +493,221 @@ class Database:
                 h.update(mv[:n])
         return h.hexdigest()
 
+    @staticmethod
+    def _ordered_pool(func, items, workers):
+        # Yield func(item) for every item in input order, while up to 2x 'workers' items are processed ahead in a
+        # bounded thread pool. hashlib and file reads release the GIL, so the workers genuinely overlap.
+        if workers <= 1:
+            yield from map(func, items)
+            return
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="elory_hash") as pool:
+            pending = deque()
+            for item in items:
+                pending.append(pool.submit(func, item))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    @classmethod
+    def fingerprint(cls, file):
+        """Return a fast fingerprint of a given file, hashed from its size and samples of its head, middle and tail.
+
+        Files with equal content always have equal fingerprints, but equal fingerprints only make equal content likely.
+        Use digest to confirm. Files small enough to be sampled whole are simply digested.
+        """
+        if not os.path.isfile(file):
+            db_logger.warning(f"{file} is not a valid file")
+            return False
+        size = os.path.getsize(file)
+        if size <= 3 * cls._SAMPLE_SIZE:
+            return cls.digest(file)
+        h = hashlib.md5(size.to_bytes(8, "little"))     # Files of different sizes never share a fingerprint
+        with open(file, 'rb') as file_obj:
+            for offset in (0, (size - cls._SAMPLE_SIZE) // 2, size - cls._SAMPLE_SIZE):
+                file_obj.seek(offset)
+                h.update(file_obj.read(cls._SAMPLE_SIZE))
+        return h.hexdigest()
+
+    @staticmethod
+    def stat_signature(file):
+        """Return the (size, mtime_ns, inode, device) of a file, or None if it cannot be read.
+
+        A file whose signature has not changed is assumed to still have the same content, so its digest can be reused.
+        """
+        try:
+            stat = os.stat(file)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_dev
+
+    @_writer
+    def _cache_lookup(self, file, refresh=False):
+        # (path, signature, fingerprint, digest) -> one stat and one primary key lookup, no file reads.
+        # fingerprint and digest are None where the cache doesn't know them
+        path = os.path.abspath(file)
+        signature = self.stat_signature(path)
+        if signature is None or refresh:
+            return path, signature, None, None
+        cached = self.CONN.execute("SELECT file_fingerprint, file_hash_name FROM hash_cache WHERE file_path=? "
+                                   "AND file_size=? AND mtime_ns=? AND inode=? AND device=?",
+                                   (path, *signature)).fetchone()
+        return (path, signature, *cached) if cached else (path, signature, None, None)
+
+    def _identify(self, full, cached):
+        # Runs on the worker pool -> only read what the cache could not provide
+        path, signature, fingerprint, file_hash = cached
+        if signature is None:
+            db_logger.warning(f"{path} is not a valid file")
+            return cached, (path, signature, False, None)
+        if fingerprint is None:
+            fingerprint = self.fingerprint(path)
+        if file_hash is None and fingerprint and signature[0] <= 3 * self._SAMPLE_SIZE:
+            file_hash = fingerprint                     # Small files are fingerprinted whole
+        if file_hash is None and fingerprint and full:
+            file_hash = self.digest(path)
+        return cached, (path, signature, fingerprint, file_hash)
+
+    def _identify_all(self, files, full=False, workers=None, refresh=False):
+        """
+        files -> an iterable of file paths to identify
+        full -> also compute the full digest of every file, not only its fingerprint
+        workers -> number of files read concurrently. Defaults to HASH_WORKERS
+        refresh -> ignore the hash cache and re-read every file (the cache is still updated)
+        returns an iterator of (absolute path, stat signature, fingerprint, digest or None) in the same order as files.
+            fingerprint is False for an invalid file
+
+        Files whose stat signature still matches the hash cache are not read again. Anything that had to be read is
+        written back to the cache.
+        """
+        workers = self.HASH_WORKERS if workers is None else workers
+        lookups = (self._cache_lookup(file, refresh) for file in files)
+        unsaved = []        # Identities read from disk, written to the cache a chunk at a time
+        try:
+            for cached, identity in self._ordered_pool(partial(self._identify, full), lookups, workers):
+                if identity[2] and identity != cached:
+                    unsaved.append(identity)
+                    if len(unsaved) >= self._CACHE_CHUNK:
+                        self._cache_store(unsaved)
+                        unsaved = []
+                yield identity
+        finally:    # Also when the caller stops early
+            if unsaved:
+                self._cache_store(unsaved)
+
+    @_writer
+    def _cache_store(self, identities):
+        # One short transaction per chunk -> the writer never holds a transaction open while files are being read
+        own_transaction = not self.CONN.in_transaction      # Don't commit a transaction the caller has already opened
+        self.CONN.executemany("INSERT OR REPLACE INTO hash_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              ((path, *signature, file_hash, fingerprint)
+                               for path, signature, fingerprint, file_hash in identities))
+        if own_transaction:
+            self.CONN.commit()
+
+    def digest_all(self, files, workers=None, refresh=False):
+        """
+        files -> an iterable of file paths to hash
+        workers -> number of files hashed concurrently. Defaults to HASH_WORKERS
+        refresh -> ignore cached digests and re-read every file (the cache is still updated)
+        returns an iterator of digests (or False for an invalid file), in the same order as files
+
+        Files whose stat signature still matches the hash cache are not read again.
+        """
+        for identity in self._identify_all(files, True, workers, refresh):
+            yield identity[3] if identity[2] else False
+
+    def fingerprint_all(self, files, workers=None, refresh=False):
+        """
+        files -> an iterable of file paths to fingerprint
+        workers -> number of files read concurrently. Defaults to HASH_WORKERS
+        refresh -> ignore cached fingerprints and re-read every file (the cache is still updated)
+        returns an iterator of fingerprints (or False for an invalid file), in the same order as files
+        """
+        for identity in self._identify_all(files, False, workers, refresh):
+            yield identity[2]
+
+    def _resolve_identity(self, identity):
+        """
+        Return the file_hash_name to store for a new file -> its digest if known or needed, else its fingerprint.
+
+        A fingerprint alone is enough while no stored file could share the new file's size and fingerprint. Otherwise
+        the new file is digested, and so is every colliding file that was only stored by fingerprint, so that the
+        UNIQUE file_hash_name constraint still decides what counts as a duplicate.
+        """
+        path, signature, fingerprint, file_hash = identity
+        with self.reader() as conn:     # Both served by idx_files_identity
+            collisions = conn.execute("SELECT file_id, file_path, file_hash_name, file_fingerprint FROM files "
+                                      "WHERE file_size=? AND file_fingerprint=?",
+                                      (signature[0], fingerprint)).fetchall()
+            # Rows not fingerprinted yet (see fill_fingerprints) were stored by their full digest
+            legacy = conn.execute("SELECT 1 FROM files WHERE file_size=? AND file_fingerprint IS NULL LIMIT 1",
+                                  (signature[0], )).fetchone()
+        for file_id, other_path, other_hash, other_fingerprint in collisions:
+            if other_path == path:      # Already stored -> let the INSERT report it
+                return other_hash
+        if legacy and file_hash is None:    # Only a digest of the new file compares with them
+            file_hash = next(self.digest_all([path]))
+
+        digests = []        # (digest, file_id, path) of colliding rows only stored by fingerprint
+        if collisions:
+            fingerprinted = [(file_id, other_path) for file_id, other_path, other_hash, other_fingerprint in collisions
+                             if other_hash == other_fingerprint and signature[0] > 3 * self._SAMPLE_SIZE]
+            other_digests = self.digest_all(other_path for _, other_path in fingerprinted)
+            for (file_id, other_path), other_digest in zip(fingerprinted, other_digests):
+                if other_digest:    # Missing file otherwise - its fingerprint stays its identity
+                    digests.append((other_digest, file_id, other_path))
+            if file_hash is None:
+                file_hash = next(self.digest_all([path]))
+
+        if digests:     # Every file is read by now -> the write transaction is short
+            with self._write_lock:
+                for other_digest, file_id, other_path in digests:
+                    try:
+                        self.CONN.execute("UPDATE files SET file_hash_name=? WHERE file_id=?", (other_digest, file_id))
+                    except IntegrityError as errmsg:
+                        db_logger.error(errmsg)
+                        continue
+                    db_logger.info(f"Stored digest of '{other_path}' after fingerprint collision")
+                self.CONN.commit()
+        return file_hash if file_hash is not None else fingerprint
+
+    def fill_fingerprints(self, workers=None):
+        """
+        Fingerprint the stored files that predate fingerprints -> returns how many were filled in
+        workers -> number of files read concurrently. Defaults to HASH_WORKERS
+
+        Files are read without the write lock, and written in one short transaction. Rows of missing files stay NULL.
+        Slow on a large library stored by an older version, so best run on a worker thread with its own Database.
+        """
+        with self.reader() as conn:
+            legacy = conn.execute("SELECT file_id, file_path FROM files WHERE file_fingerprint IS NULL").fetchall()
+        if not legacy:
+            return 0
+        filled = [(signature[0], signature[1], fingerprint, file_id) for (file_id, _), (_, signature, fingerprint, _)
+                  in zip(legacy, self._identify_all((path for _, path in legacy), workers=workers)) if fingerprint]
+        with self._write_lock:
+            self.CONN.executemany("UPDATE files SET file_size=?, file_mtime=?, file_fingerprint=? "
+                                  "WHERE file_id=? AND file_fingerprint IS NULL", filled)
+            self.CONN.commit()
+        db_logger.info(f"Fingerprinted {len(filled)} of {len(legacy)} files stored by an older version")
+        return len(filled)
+
+    def _identify_new(self, paths, verify=False):
+        # [(identity, file_hash_name to store or False), ...] for files about to be inserted. Everything is read here,
+        # before the insert takes the write lock. New files sharing a fingerprint can't see each other in the
+        # database yet, so they are digested up front.
+        identities = list(self._identify_all(paths, full=verify))
+        shared = Counter((identity[1][0], identity[2]) for identity in identities
+                         if identity[2] and identity[3] is None)
+        ambiguous = [i for i, identity in enumerate(identities)
+                     if identity[2] and identity[3] is None and shared[identity[1][0], identity[2]] > 1]
+        for i, file_hash in zip(ambiguous, self.digest_all([identities[i][0] for i in ambiguous])):
+            identities[i] = (*identities[i][:3], file_hash or None)
+        return [(identity, identity[2] and self._resolve_identity(identity)) for identity in identities]
+
     # Database management
+    @_writer
     def create_new_db(self, path, default_values=True):
         db_logger.info(f"Creating new database '{path}'...")
         # TODO reject names with special characters
@@ -165,7 +718,7 @@ class Database:
 
         self.PATH = self._prepare_path(path)  # Set path, and new file name
 
-        self.CONN = connect(self.PATH)  # Create (connect) new sqlite3 database
+        self.CONN = connect(self.PATH, check_same_thread=False)  # Create (connect) new sqlite3 database
         self.CURS = self.CONN.cursor()
 
         self._build_tables(default_values)  # Build database
@@ -173,9 +726,13 @@ class Database:
         # Necessary settings for database
         self.CURS.execute("PRAGMA foreign_keys = ON")  # Enforce Foreign Key constraints
         self.CONN.commit()
+        self._apply_settings(self._PROFILES[self.PROFILE])
+        self._pool = ReaderPool(self.PATH, self.READERS, self._PROFILES[self.PROFILE])
+        self._data_version = self.CONN.execute("PRAGMA data_version").fetchone()[0]
         db_logger.info(f"Database '{self.PATH}' creation complete and ready for operation")
         return self.PATH
 
+    @_writer
     def connect_db(self, path):
 
         if not os.path.isfile(path):  # Reject non-files
@@ -184,7 +741,7 @@ class Database:
 
         self._disconnect()
         self.PATH = path
-        self.CONN = connect(self.PATH)  # Connect to existing file
+        self.CONN = connect(self.PATH, check_same_thread=False)  # Connect to existing file
         self.CURS = self.CONN.cursor()
 
         # Check if file is valid sqlite3 database
@@ -203,12 +760,25 @@ class Database:
             db_logger.error(errmsg)
             self._disconnect()
             raise DatabaseError(errmsg)
+        try:
+            self._upgrade_tables()      # Add any columns this database predates
+            self._build_auxiliary()     # Add any auxiliary tables and indexes this database predates
+        except DatabaseError as errmsg:     # Don't leave a half open connection behind
+            db_logger.error(f"Failed to upgrade database '{self.PATH}' - {errmsg}")
+            self._disconnect()
+            raise
+        self.CURS.execute("DELETE FROM change_log WHERE change_id <= (SELECT MAX(change_id) FROM change_log) - ?",
+                          (self._CHANGE_LOG_SIZE, ))
 
         # Necessary settings for database
         self.CURS.execute("PRAGMA foreign_keys = ON")  # Enforce Foreign Key constraints
         self.CONN.commit()
+        self._apply_settings(self._PROFILES[self.PROFILE])
+        self._pool = ReaderPool(self.PATH, self.READERS, self._PROFILES[self.PROFILE])
+        self._data_version = self.CONN.execute("PRAGMA data_version").fetchone()[0]
         db_logger.info(f"Database '{self.PATH}' connected and ready for operation.")
 
+    @_writer
     def extend_db(self, path, default_values=True):
 
         if not os.path.isfile(path):  # Reject non-files
@@ -217,7 +787,7 @@ class Database:
 
         self._disconnect()
         self.PATH = path
-        self.CONN = connect(self.PATH)  # Connect to existing file
+        self.CONN = connect(self.PATH, check_same_thread=False)  # Connect to existing file
         self.CURS = self.CONN.cursor()
 
         # Check if file is valid sqlite3 database
@@ -235,12 +805,234 @@ class Database:
         # Necessary settings for database
         self.CURS.execute("PRAGMA foreign_keys = ON")  # Enforce Foreign Key constraints
         self.CONN.commit()
+        self._apply_settings(self._PROFILES[self.PROFILE])
+        self._pool = ReaderPool(self.PATH, self.READERS, self._PROFILES[self.PROFILE])
+        self._data_version = self.CONN.execute("PRAGMA data_version").fetchone()[0]
         db_logger.info(f"Extension of database '{self.PATH}' successful and ready for operation")
 
+    # Connections
+    @contextmanager
+    def reader(self):
+        """
+        Check out a read-only connection for the calling thread, e.g.
+            with database.reader() as conn:
+                conn.execute(...)
+        Nested use within a thread shares one connection. Reads see the last committed state of the database.
+        """
+        local = self._local
+        if not getattr(local, "depth", 0):
+            if self._pool is None:
+                raise DatabaseError("No database connected")
+            local.reader = self._pool.checkout()
+            local.depth = 0
+        local.depth += 1
+        try:
+            yield local.reader
+        finally:
+            local.depth -= 1
+            if not local.depth:
+                conn, local.reader = local.reader, None
+                self._pool.checkin(conn) if self._pool is not None else conn.close()
+
+    @contextmanager
+    def writer(self):
+        """Hold the writer connection for the calling thread. Any other thread's writes wait until the block ends"""
+        with self._write_lock:
+            yield self.CONN
+
+    def _stream(self, statement, parameters=()):
+        # Rows are read lazily, on a reader connection held until the stream is exhausted
+        with self.reader() as conn:
+            yield from conn.execute(statement, parameters)
+
+    # Change tracking
+    def has_changed(self):
+        """Return True if another connection (another process, or a job with its own Database) has committed changes
+        since the last call. Costs no disk read, so it is cheap enough to poll"""
+        # data_version is per connection, so it is read on the writer, but without the write lock -> a poll never
+        # waits on a write in progress. sqlite3 serializes the calls of threads sharing a connection (threadsafety 3)
+        conn = self.CONN
+        if conn is None:
+            return False
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        changed, self._data_version = version != self._data_version, version
+        return changed
+
+    def last_change(self):
+        """Return the id of the latest recorded change -> 0 if none"""
+        with self.reader() as conn:
+            return conn.execute("SELECT MAX(change_id) FROM change_log").fetchone()[0] or 0
+
+    def changes_since(self, change_id, limit=None):
+        """
+        change_id -> the latest change already seen, see last_change
+        limit -> the most changes worth patching in -> beyond it, reloading in full is cheaper. None for no limit
+        returns (latest change id, {table: [row, ...]}) of every row changed since, read from the same snapshot
+            "tag_groups"        -> (group_id, group_name)
+            "tags"              -> (tag_id, tag_name, tag_group)
+            "files"             -> (file_id, file_path, file_hash_name)
+            "tagged_files_m2m"  -> (tag, file, linked: 1 or 0)
+            -> all but the id are None for a removed row
+            -> (latest change id, None) if the log no longer reaches back to change_id, or there are more than limit
+               changes, and the caller must reload in full
+        """
+        with self.reader() as conn:
+            conn.execute("BEGIN")   # All reads from the same snapshot
+            try:
+                oldest, latest = conn.execute("SELECT MIN(change_id), MAX(change_id) FROM change_log").fetchone()
+                latest = latest or 0
+                if change_id > latest or (oldest is not None and oldest > change_id + 1):     # Pruned or rebuilt log
+                    return latest, None
+                if limit is not None and latest - change_id > limit:
+                    return latest, None
+                return latest, {table: conn.execute(statement, (change_id, )).fetchall()
+                                for table, statement in self._CHANGE_QUERIES.items()}
+            finally:
+                conn.execute("COMMIT")
+
+    # Performance profiles
+    def _read_settings(self):
+        return {pragma: self.CONN.execute(f"PRAGMA {pragma}").fetchone()[0] for pragma in self._PROFILES["desktop"]}
+
+    def _apply_settings(self, settings):
+        if self.CONN.in_transaction:
+            errmsg = "Cannot change performance settings inside a transaction"
+            db_logger.error(errmsg)
+            raise DatabaseError(errmsg)
+        for pragma in settings.keys():
+            if pragma == "journal_mode":    # Only switch if it differs - the mode is persistent, and changing it is slow
+                current = self.CONN.execute("PRAGMA journal_mode").fetchone()[0]
+                if str(current).lower() == str(settings[pragma]).lower():
+                    continue
+            self.CONN.execute(f"PRAGMA {pragma} = {settings[pragma]}")
+
+    @_writer
+    def set_profile(self, name):
+        """
+        name -> performance profile to switch the open database to.     options: "desktop", "bulk-import", "read-only"
+        returns the settings that were replaced, which can be given back to restore_settings
+        """
+        if name not in self._PROFILES:
+            errmsg = f"'{name}' is not a valid performance profile"
+            db_logger.error(errmsg)
+            raise DatabaseError(errmsg)
+        previous = self._read_settings()
+        self._apply_settings(self._PROFILES[name])
+        db_logger.info(f"Database '{self.PATH}' switched to '{name}' performance profile")
+        return previous
+
+    @_writer
+    def restore_settings(self, settings):
+        """settings -> as returned by set_profile"""
+        self._apply_settings(settings)
+        db_logger.info(f"Database '{self.PATH}' performance settings restored")
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Run a block under a different performance profile, and restore the previous settings afterwards, e.g.
+            with database.profile("bulk-import"):
+                database.create_entry("file", values, batch=True)
+        Holds the write lock for the whole block. A long job that reads files in between its writes should switch with
+        set_profile and restore_settings instead, so other threads aren't locked out of the database meanwhile.
+        """
+        with self._write_lock:      # Other threads' writes wait for the job, rather than run under its settings
+            previous = self.set_profile(name)
+            try:
+                yield self
+                self.CONN.commit()      # Settings can't be restored while a transaction is open
+            except BaseException:
+                self.CONN.rollback()
+                raise
+            finally:
+                self.restore_settings(previous)
+
+    # Query planning
+    @_writer
+    def explain(self, statement, parameters=()):
+        """
+        statement -> any SQL statement, with optional '?' parameters
+        returns a list of the steps in sqlite's query plan for the statement, e.g.
+            ["SEARCH tagged_files_m2m USING COVERING INDEX idx_tagged_files_file (file=?)"]
+        """
+        return [step[3] for step in self.CONN.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+
+    @_writer
+    def index_report(self):
+        """
+        returns a list of (index_name, exists, used, query_plan) for every secondary index the database declares.
+            used -> the lookup the index is meant to serve is planned through it
+        """
+        self.CURS.execute("SELECT name FROM sqlite_schema WHERE type='index'")
+        existing = {x[0] for x in self.CURS.fetchall()}
+        report = []
+        for index in self._INDEXES.keys():
+            query = self._INDEXES[index][1]
+            plan = self.explain(query, (None, ) * query.count("?"))
+            report.append((index, index in existing, any(index in step for step in plan), plan))
+        return report
+
     # CRUD operations
-    # TODO could probably modify to take any kind and number of valid items and do batch ops
-    #   because ideally we'd like to minimize disk writes and reads.
-    def create_entry(self, item, values: list):
+    def _write_row(self, statement, row, returning=False):
+        # Run one write inside its own savepoint, so a failing row is undone without touching the rest of a batch
+        self.CURS.execute("SAVEPOINT write_row")
+        try:
+            self.CURS.execute(statement, row)
+            returned = self.CURS.fetchall() if returning else None
+        except IntegrityError as errmsg:
+            self.CURS.execute("ROLLBACK TO write_row")
+            self.CURS.execute("RELEASE write_row")
+            return errmsg
+        except DatabaseError:       # Not a problem with this row (locked, read-only...) -> undo it and let it raise
+            self.CURS.execute("ROLLBACK TO write_row")
+            self.CURS.execute("RELEASE write_row")
+            raise
+        rowid = self.CURS.lastrowid
+        self.CURS.execute("RELEASE write_row")
+        return returned if returning else rowid
+
+    def _write_rows(self, statement, rows: list, batch=False, many=False, returning=False):
+        """
+        statement -> a single parameterized INSERT, UPDATE or DELETE statement
+        rows -> an iterable of parameter tuples, one per row to write. A None row is skipped, and reported as None
+        batch -> apply the whole list in a single transaction (one commit), instead of committing after every row
+        many -> in batch mode, first try the whole list with one executemany call. Rowids are not reported on this
+            path, so only use it where the caller does not need them
+        returning -> the statement has a RETURNING clause. Report the list of rows it returned instead of the lastrowid
+        returns a list (in order) of the lastrowid of each row, or the IntegrityError that row raised
+        """
+        if batch and many:
+            self.CURS.execute("SAVEPOINT write_many")
+            try:
+                self.CURS.executemany(statement, rows)
+            except IntegrityError as errmsg:
+                # Some row failed - undo the whole attempt and find out which one(s), row by row
+                self.CURS.execute("ROLLBACK TO write_many")
+                self.CURS.execute("RELEASE write_many")
+                db_logger.info(f"Batch write failed ({errmsg}). Retrying row by row...")
+            else:
+                self.CURS.execute("RELEASE write_many")
+                self.CONN.commit()
+                return [None] * len(rows)
+
+        if batch and not self.CONN.in_transaction:
+            self.CURS.execute("BEGIN")
+        results = []
+        try:
+            for row in rows:
+                if row is None:
+                    results.append(None)
+                    continue
+                results.append(self._write_row(statement, row, returning))
+                if not batch:
+                    self.CONN.commit()
+        except DatabaseError:       # Locked, read-only... -> abandon the whole batch rather than commit part of it
+            self.CONN.rollback()
+            raise
+        self.CONN.commit()
+        return results
+
+    def create_entry(self, item, values: list, batch=False, verify=False):
         """
         item -> specify the type of entry to make.      options: "file", "group", "tag"
         values -> a list of dicts containing the parameters of the specified item
@@ -258,8 +1050,19 @@ class Database:
                 'file_id': int file_id
                 'tag_id':  int tag_id
             }
+        batch -> write the whole list in one transaction, rather than committing each entry on its own. Entries are
+            still accepted or rejected one by one.
+        verify -> "file" only. Identify new files by their full digest. By default a file is identified by its size and
+            sampled fingerprint, and only digested in full if that collides with a file already stored.
         returns a list (in order) of newly created items id's or True -> if an entry failed, None (or False?) instead
         """
+        # Files are read before the write lock is taken -> the insert transaction never waits on the disk
+        identified = self._identify_new((new_file['file_path'] for new_file in values), verify) \
+            if item == "file" else None
+        return self._create_entry(item, values, batch, identified)
+
+    @_writer
+    def _create_entry(self, item, values, batch, identified):
         # Relying on the cur.execute (?) replacement method for input sanitization
 
         if item not in ["file", "group", "tag", "tag-file"]:  # self._DEFINITION.keys()
@@ -267,76 +1070,66 @@ class Database:
             db_logger.error(errmsg)
             raise IntegrityError(errmsg)
 
-        # TODO unfortunately, cur.execute only stores the last rowid of a newly created item, so we will have to call
-        #   the function iteratively. Perhaps create a custom sql func that can return the list of a batch transaction?
-
         if item == "file":
             newly_created_files = []
-            for new_file in values:  # Iterate over list of dicts
-                unique_hash = self.digest(new_file['file_path'])  # return false if not valid path. else hash
-                if not unique_hash:
+            hashes = [unique_hash for _, unique_hash in identified]     # False if not a valid path
+            rows = [None if not unique_hash else (path, unique_hash, signature[0], fingerprint, signature[1])
+                    for (path, signature, fingerprint, _), unique_hash in identified]
+            rows = self._write_rows("INSERT INTO files (file_path, file_hash_name, file_size, file_fingerprint, "
+                                    "file_mtime) VALUES (?, ?, ?, ?, ?)", rows, batch)
+            for i, new_file in enumerate(values):
+                if not hashes[i]:
                     newly_created_files.append((False, f"{new_file['file_path']} is not a valid file."))
                     continue
-                try:
-                    self.CURS.execute("INSERT INTO files (file_path, file_hash_name) VALUES (?, ?)",
-                                      (os.path.abspath(new_file['file_path']), unique_hash))
-                except IntegrityError as errmsg:
+                if isinstance(rows[i], IntegrityError):
                     # sqlite3 is ambiguous about UNIQUE constraints - it doesn't seem to have a set order - sometimes
                     # it'll return a file_path error, other times a file_hash error for a file that violates both, so
                     # it's hard to know which constraint was actually violated in the case of a file that violates only
                     # one. Some additional checking is required by the caller to verify.
-                    db_logger.error(errmsg)
-                    newly_created_files.append((False, errmsg, unique_hash))
+                    db_logger.error(rows[i])
+                    newly_created_files.append((False, rows[i], hashes[i]))
                     continue
-                self.CONN.commit()
-                newly_created_files.append((self.CURS.lastrowid, unique_hash))
+                newly_created_files.append((rows[i], hashes[i]))
                 db_logger.info(f"Added file '{new_file['file_path']}' to database")
             return newly_created_files
 
         if item == "group":
             newly_created_groups = []
-            for new_group in values:  # Iterate over list of dicts
-                # TODO santitize new_group['group_name']
-                try:
-                    self.CURS.execute("INSERT INTO tag_groups (group_name) VALUES (?)",
-                                      (new_group["group_name"], ))
-                except IntegrityError as errmsg:
-                    db_logger.error(errmsg)
-                    newly_created_groups.append((False, errmsg))
+            # TODO santitize new_group['group_name']
+            rows = self._write_rows("INSERT INTO tag_groups (group_name) VALUES (?)",
+                                    [(new_group["group_name"], ) for new_group in values], batch)
+            for new_group, rowid in zip(values, rows):
+                if isinstance(rowid, IntegrityError):
+                    db_logger.error(rowid)
+                    newly_created_groups.append((False, rowid))
                     continue
-                self.CONN.commit()
-                newly_created_groups.append((True, self.CURS.lastrowid))
+                newly_created_groups.append((True, rowid))
                 db_logger.info(f"New group '{new_group['group_name']}' added to database")
             return newly_created_groups
 
         if item == "tag":
             newly_created_tags = []
-            for new_tag in values:  # Iterate over list of dicts
-                # group = new_tag['group']
-                # if type(group) != int:                # TODO support group names as txt in future
-                try:
-                    self.CURS.execute("INSERT INTO tags (tag_name, tag_group) VALUES (?, ?)",
-                                      (new_tag['tag_name'], new_tag['group']))
-                except IntegrityError as errmsg:
-                    db_logger.error(errmsg)
-                    newly_created_tags.append((False, errmsg))
+            # TODO support group names as txt in future
+            rows = self._write_rows("INSERT INTO tags (tag_name, tag_group) VALUES (?, ?)",
+                                    [(new_tag['tag_name'], new_tag['group']) for new_tag in values], batch)
+            for new_tag, rowid in zip(values, rows):
+                if isinstance(rowid, IntegrityError):
+                    db_logger.error(rowid)
+                    newly_created_tags.append((False, rowid))
                     continue
-                self.CONN.commit()
-                newly_created_tags.append((True, self.CURS.lastrowid))
+                newly_created_tags.append((True, rowid))
                 db_logger.info(f"New tag '{new_tag['tag_name']}' added to database")
             return newly_created_tags
 
         if item == "tag-file":
             newly_linked_tag_files = []
-            for link in values:
-                try:
-                    self.CURS.execute("INSERT INTO tagged_files_m2m (tag, file) VALUES (?, ?)",
-                                      (link['tag_id'], link['file_id']))
-                except IntegrityError as errmsg:
-                    db_logger.error(errmsg)
-                    newly_linked_tag_files.append((False, errmsg))
+            rows = self._write_rows("INSERT INTO tagged_files_m2m (tag, file) VALUES (?, ?)",
+                                    [(link['tag_id'], link['file_id']) for link in values], batch, many=True)
+            for link, rowid in zip(values, rows):
+                if isinstance(rowid, IntegrityError):
+                    db_logger.error(rowid)
+                    newly_linked_tag_files.append((False, rowid))
                     continue
-                self.CONN.commit()
                 newly_linked_tag_files.append((link['tag_id'], link['file_id']))    # tuple of tag-file pairs
                 db_logger.info(f"Linked tag '{link['tag_id']}' to file '{link['file_id']}'")
             return newly_linked_tag_files
@@ -376,59 +1169,51 @@ class Database:
             'group_name': str                           -> return all tags associated with this group       (list)
         }
         """
-        valid_props = {'group_id', 'group_name', 'tag_id', 'tag_name', 'file_id', 'file_hash_name', 'file_path', 'tag_group', 'file'}
+        valid_props = {'group_id', 'group_name', 'tag_id', 'tag_name', 'file_id', 'file_hash_name', 'file_path', 'tag_group',
+                       'file', 'file_size', 'file_fingerprint'}
         valid_items = {"files", "tag_groups", "tags"}
         results = []
-        for entry in values:  # Expect a tuple ( "item", "property", "prop_value" )
-            if entry[0] in valid_items:
-                if entry[1] == 'all':  # return all items of type
-                    self.CURS.execute(f"SELECT * FROM {entry[0]}")
-                    res = self.CURS.fetchall()
-                    ans = []
-                    for item in res:
-                        if entry[0] == "files":
-                            self.CURS.execute(f"SELECT tag FROM tagged_files_m2m WHERE file='{item[0]}'")
-                            ans.append((*item, [x[0] for x in self.CURS.fetchall()]))
-                        if entry[0] == "tags":
-                            self.CURS.execute(f"SELECT file FROM tagged_files_m2m WHERE tag='{item[0]}'")
-                            ans.append((*item, [x[0] for x in self.CURS.fetchall()]))
-                        if entry[0] == "tag_groups":
-                            self.CURS.execute(f"SELECT tag_id FROM tags WHERE tag_group='{item[0]}'")
-                            ans.append((*item, [x[0] for x in self.CURS.fetchall()]))
-                    results.append(ans)
-
-                elif entry[1] in valid_props:
-                    if entry[1] in self._DEFINITION[entry[0]][0]:  # inside its own table
-                        self.CURS.execute(f"SELECT * FROM {entry[0]} WHERE {entry[1]}='{entry[2]}'")
-                        results.append(self.CURS.fetchall())
-
-                    elif (entry[0] == "files") and (entry[1] == "tag_id"):  # m2m tag-file query
-                        self.CURS.execute(f"SELECT file, tag FROM tagged_files_m2m WHERE tag='{entry[2]}'")
-                        results.append(self.CURS.fetchall())
-
-                    elif (entry[0] == "tags") and ("file" in entry[1]):  # m2m tag-file query
-                        self.CURS.execute(f"SELECT tag, file FROM tagged_files_m2m WHERE file='{entry[2]}'")
-                        results.append(self.CURS.fetchall())
-
-                    # elif (entry[0] == "files") and ("group" in entry[1]):          # Cross query - get files from group
-                    #     self.CURS.execute(
-                    #         f"SELECT * FROM {entry[0]} WHERE file_id='{entry[2]}'")
-                    #     results.append(self.CURS.fetchall())
-                    #
-                    # elif (entry[0] == "tag_groups") and ("file" in entry[1]):      # Cross query - get groups from file
-                    #     pass
-                    else:
+        with self.reader() as conn:
+            curs = conn.cursor()
+            for entry in values:  # Expect a tuple ( "item", "property", "prop_value" )
+                if entry[0] in valid_items:
+                    if entry[1] == 'all':  # return all items of type
+                        # Two ordered scans merged in a single pass, instead of one child lookup per row
+                        rows, children = self.read_snapshot([entry[0], self._SNAPSHOT_CHILDREN[entry[0]]])
+                        child = next(children, None)
+                        ans = []
+                        for item in rows:
+                            linked = []
+                            while child is not None and child[0] <= item[0]:
+                                if child[0] == item[0]:
+                                    linked.append(child[1])
+                                child = next(children, None)
+                            ans.append((*item, linked))
+                        results.append(ans)
+
+                    elif (entry[0], entry[1]) in self._READ_STATEMENTS:
+                        statement, key_type = self._READ_STATEMENTS[(entry[0], entry[1])]
+                        try:
+                            key = key_type(entry[2])
+                        except (TypeError, ValueError):
+                            errmsg = f"'{entry[2]}' is not a valid value for {entry[0]} property '{entry[1]}'"
+                            db_logger.error(errmsg)
+                            results.append(None)
+                            continue
+                        results.append(curs.execute(statement, (key, )).fetchall())
+
+                    elif entry[1] in valid_props:
                         errmsg = f"Retrieve '{entry[0]}' for property '{entry[1]}' not yet implemented"
                         db_logger.warning(errmsg)
                         results.append(None)
+                    else:
+                        errmsg = f"'{entry[1]}' is not a valid property of {entry[0]}"
+                        db_logger.error(errmsg)
+                        results.append(None)
                 else:
-                    errmsg = f"'{entry[1]}' is not a valid property of {entry[0]}"
+                    errmsg = f"Item '{entry[0]}' is not a valid database object"
                     db_logger.error(errmsg)
                     results.append(None)
-            else:
-                errmsg = f"Item '{entry[0]}' is not a valid database object"
-                db_logger.error(errmsg)
-                results.append(None)
         return results
 
         # First implementation -> # TODO Refine the API to make sense across the CRUD ops
@@ -510,35 +1295,236 @@ class Database:
         #             requested_tags.extend(self.CURS.fetchall())
         #             continue
 
-    def update_entry(self, item, values: list):
-        # """
-        # """
-        #
-        # if item not in ["file", "group", "tag"]:        # self._DEFINITION.keys()
-        #     errmsg = f"Item '{item}' is not a valid database object"
-        #     db_logger.error(errmsg)
-        #     raise IntegrityError(errmsg)
-        #
-        # if item == "file":
-        #
-        # if item == "group":
-        #     Database.CURSOR.execute(f'UPDATE tag_groups SET group_name="{new_name}" WHERE group_id={g.db_id}')
-        #     Database.CONNECTION.commit()
-        #     db_logger.info(f"Group '{g.name}' renamed to '{new_name}'")
-        #
-        # if item == "tag":
-        #     Database.CURSOR.execute(f'UPDATE tags SET tag_name="{new_name}" WHERE tag_id={t.db_id}')
-        #     Database.CONNECTION.commit()
-        #     db_logger.info(f"Tag '{t.name}' renamed to '{new_name}'")
-        pass
+    def query_files(self, expression):
+        """
+        expression -> a boolean tag query over tags and groups, e.g. '(People:"Benoit Blanc" AND Places:*) AND NOT Pets:*'
+            see tagQuery for the full syntax
+        returns a list of the matching file ids, in order -> raises TagQueryError for a malformed query
 
-    def delete_entry(self, item, values: list):
+        The whole query runs as one compound statement over the tag-file links, so no per-file work is done in Python.
+        """
+        statement, parameters = compile_query(expression)
+        with self.reader() as conn:
+            return [row[0] for row in conn.execute(statement, parameters)]
+
+    def file_counts(self):
+        """
+        returns ({tag_id: file count}, {group_id: file count}, untagged file count)
+            -> a group counts each file once, however many of its tags the file has. Tags and groups without files
+               are left out
+
+        Counts are stored in the database and kept current by triggers, so this is a lookup rather than a scan.
+        """
+        counts = {"tag": {}, "group": {}, "untagged": {0: 0}}
+        with self.reader() as conn:
+            for scope, scope_id, file_count in conn.execute("SELECT scope, scope_id, file_count FROM file_counts "
+                                                               "WHERE file_count > 0 OR scope='untagged'"):
+                counts[scope][scope_id] = file_count
+        return counts["tag"], counts["group"], counts["untagged"][0]
+
+    def load_checkpoint(self, root):
+        """Return the (last_path, imported, existing, duplicates, failed) of an unfinished import of root -> else None"""
+        with self.reader() as conn:
+            return conn.execute("SELECT last_path, imported, existing, duplicates, failed FROM import_checkpoints "
+                                "WHERE root=?", (root, )).fetchone()
+
+    @_writer
+    def save_checkpoint(self, root, last_path=None, totals=(0, 0, 0, 0)):
+        """Record the progress of an import of root -> last_path None clears it, once the import is complete"""
+        if last_path is None:
+            self.CONN.execute("DELETE FROM import_checkpoints WHERE root=?", (root, ))
+        else:
+            self.CONN.execute("INSERT OR REPLACE INTO import_checkpoints VALUES (?, ?, ?, ?, ?, ?)",
+                              (root, last_path, *totals))
+        self.CONN.commit()
+
+    def locate_missing(self, paths, workers=None):
+        """
+        Match files that are not in the database to stored files missing from their path -> moved or renamed files
+        paths -> an iterable of paths of files not in the database, e.g. from a scan of the library's folders
+        workers -> number of files read concurrently. Defaults to HASH_WORKERS
+        returns [(file_id, stored path, new path), ...] -> nothing is written, apply with update_entry("file", ...)
+
+        A file whose stat signature is the one last cached for a missing file is matched without being read. Any other
+        file of a missing file's size is identified, and matched on fingerprint, or on its full digest where that is
+        what the missing file is stored by. Where a fingerprint is shared by more than one file, only a digest can
+        tell them apart -> a missing file stored by fingerprint is then matched on the digest last cached for it, or
+        not at all.
+        """
+        missing = {}        # file_id: stored path
+        by_signature = {}   # (size, mtime_ns, inode, device): file_id
+        by_size = {}        # size: [(file_id, file_hash_name, file_fingerprint, cached digest), ...]
+        with self.reader() as conn:
+            for row in conn.execute("SELECT file_id, files.file_path, files.file_hash_name, files.file_size, "
+                                    "files.file_fingerprint, c.file_size, mtime_ns, inode, device, "
+                                    "c.file_hash_name, c.file_fingerprint "
+                                    "FROM files LEFT JOIN hash_cache AS c USING (file_path)"):
+                file_id, path, file_hash, size, fingerprint = row[:5]
+                signature, (cached_hash, cached_fingerprint) = row[5:9], row[9:]
+                if os.path.isfile(path):
+                    continue
+                missing[file_id] = path
+                if signature[0] is not None:
+                    by_signature[signature] = file_id
+                cached_hash = cached_hash if cached_fingerprint == fingerprint else None    # Cached for this content
+                by_size.setdefault(size, []).append((file_id, file_hash, fingerprint, cached_hash))
+
+        moves = []
+        unread = []
+        for path in paths:
+            if not missing:
+                break
+            path = os.path.abspath(path)
+            signature = self.stat_signature(path)
+            if signature is None:
+                continue
+            file_id = by_signature.get(signature)
+            if file_id in missing:
+                moves.append((file_id, missing.pop(file_id), path))
+            elif signature[0] in by_size or None in by_size:
+                unread.append(path)
+
+        identities = [identity for identity in self._identify_all(unread, workers=workers) if identity[2]]
+        shared = Counter((signature[0], fingerprint) for _, signature, fingerprint, _ in identities)
+        shared.update((size, row[2]) for size, rows in by_size.items() for row in rows if row[0] in missing)
+        for path, signature, fingerprint, file_hash in identities:
+            for file_id, stored_hash, stored_fingerprint, cached_hash in \
+                    by_size.get(signature[0], []) + by_size.get(None, []):
+                if file_id not in missing or stored_fingerprint not in (fingerprint, None):
+                    continue
+                if stored_hash == fingerprint and shared[signature[0], fingerprint] > 2 and \
+                        signature[0] > 3 * self._SAMPLE_SIZE:   # Ambiguous fingerprint -> confirm by digest
+                    if cached_hash is None:
+                        db_logger.warning(f"'{path}' may be missing file '{missing[file_id]}', but no digest of it "
+                                          f"is known to confirm")
+                        continue
+                    stored_hash = cached_hash
+                if stored_hash != fingerprint:      # Stored by digest
+                    file_hash = file_hash or next(self.digest_all([path]))
+                    if stored_hash != file_hash:
+                        continue
+                moves.append((file_id, missing.pop(file_id), path))
+                break
+        db_logger.info(f"Located {len(moves)} of {len(moves) + len(missing)} missing files")
+        return moves
+
+    def columnar_snapshot(self):
+        """Return a read-only LibrarySnapshot of all files and tag links -> typed columns for analytical reports"""
+        with self.reader() as conn:
+            return LibrarySnapshot.load(conn)
+
+    def read_snapshot(self, values: list):
+        """
+        values -> a list of snapshot names to stream.   options: "tag_groups", "tags", "files",
+                                                                 "tags_by_group", "tags_by_file", "files_by_tag"
+            "tag_groups"    -> (group_id, group_name)               ordered by group_id
+            "tags"          -> (tag_id, tag_name, tag_group)        ordered by tag_id
+            "files"         -> (file_id, file_path, file_hash_name) ordered by file_id
+            "tags_by_group" -> (tag_group, tag_id, tag_name)        ordered by tag_group, tag_id
+            "tags_by_file"  -> (file, tag)                          ordered by file, tag
+            "files_by_tag"  -> (tag, file)                          ordered by tag, file
+        returns a list (in order) of row iterators -> None for an unknown snapshot
+
+        Each snapshot is a single ordered scan, so a caller can merge a table with its links in one pass
+        instead of querying once per row. Rows are streamed from the cursor and never held in memory at once.
+        """
+        streams = []
+        for name in values:
+            if name not in self._SNAPSHOT_QUERIES:
+                db_logger.error(f"'{name}' is not a valid snapshot")
+                streams.append(None)
+                continue
+            streams.append(self._stream(self._SNAPSHOT_QUERIES[name]))     # Own cursor per stream
+        return streams
+
+    @_writer
+    def update_entry(self, item, values: list, batch=False):
+        """
+        item -> specify the type of entry to update.      options: "file", "directory", "group", "tag"
+        values -> a list of dicts naming the entry by id, with its new values
+            "file" : {
+                'file_id': int,
+                'file_path': 'new path of the moved or renamed file'
+            }
+            "directory" : {                             -> every file below the directory, in one statement
+                'old_path': 'path of the moved or renamed directory',
+                'new_path': 'its new path'
+            }
+            "group" : {
+                'group_id': int,
+                'group_name': 'new name'
+            }
+            "tag" : {
+                'tag_id': int,
+                'tag_name': 'new name',                 -> optional, either or both
+                'group': int id of the group to move it to
+            }
+        batch -> apply the whole list in one transaction, rather than committing each entry on its own. Entries are
+            still accepted or rejected one by one.
+        returns a list (in order) of (True, ) if the update succeeded -> else (False, errmsg)
+            "directory" -> (True, [(file_id, old path, new path), ...]) of every file moved, see File.relocate_all
+        """
+        if item not in ["file", "directory", "group", "tag"]:
+            errmsg = f"Item '{item}' is not a valid database object"
+            db_logger.error(errmsg)
+            raise IntegrityError(errmsg)
+
+        if item == "file":
+            # A file keeps its id, tags and hash -> the hash cache entry follows it (see move_hash_cache)
+            statement = "UPDATE files SET file_path=? WHERE file_id=? RETURNING file_id"
+            rows = [(os.path.abspath(update['file_path']), update['file_id']) for update in values]
+            missing = "No file with id '{file_id}' in database"
+            message = "Moved file '{file_id}' to '{file_path}'"
+        elif item == "directory":
+            # The path range of everything below old_path is a single range scan over the file_path index
+            statement = "UPDATE files SET file_path=? || substr(file_path, ?) WHERE file_path >= ? AND file_path < ? " \
+                        "RETURNING file_id, file_path"
+            rows = []
+            for update in values:
+                old, new = (os.path.abspath(update[key]).rstrip(os.sep) for key in ('old_path', 'new_path'))
+                rows.append((new, len(old) + 1, old + os.sep, old + chr(ord(os.sep) + 1)))
+            missing = None      # Nothing below it is not an error -> no files are moved
+            message = "Moved directory '{old_path}' to '{new_path}'"
+        elif item == "group":
+            statement = "UPDATE tag_groups SET group_name=? WHERE group_id=? RETURNING group_id"
+            rows = [(update['group_name'], update['group_id']) for update in values]
+            missing = "No group with id '{group_id}' in database"
+            message = "Group '{group_id}' renamed to '{group_name}'"
+        else:   # "tag"
+            statement = "UPDATE tags SET tag_name=coalesce(?, tag_name), tag_group=coalesce(?, tag_group) " \
+                        "WHERE tag_id=? RETURNING tag_id"
+            rows = [(update.get('tag_name'), update.get('group'), update['tag_id']) for update in values]
+            missing = "No tag with id '{tag_id}' in database"
+            message = "Updated tag '{tag_id}'"
+
+        updated = []
+        for update, row, result in zip(values, rows, self._write_rows(statement, rows, batch, returning=True)):
+            if isinstance(result, IntegrityError):
+                db_logger.error(result)
+                updated.append((False, result))
+                continue
+            if not result and missing:
+                errmsg = missing.format_map(update)
+                db_logger.error(errmsg)
+                updated.append((False, errmsg))
+                continue
+            db_logger.info(message.format_map(update))
+            if item == "directory":
+                updated.append((True, [(file_id, row[2][:-1] + path[len(row[0]):], path) for file_id, path in result]))
+                continue
+            updated.append((True, ))
+        return updated
+
+    @_writer
+    def delete_entry(self, item, values: list, batch=False):
         """
         item -> specify the type of entry to make.      options: "file", "group", "tag"
         values -> a list of dicts containing the parameters of the specified item
             "file" : {'file_id': int}
             "group" : {'group_id': int}
             "tag" : {'tag_id': int}
+        batch -> delete the whole list in one transaction, rather than committing each entry on its own. Entries are
+            still accepted or rejected one by one.
         returns a list (in order) of "True" if deletion succeeded -> else "False"
         """
 
@@ -549,63 +1535,32 @@ class Database:
 
         if item == "file":
             # TODO Should be able to delete files even if tagged.
-            success_resp = []
-            for rem_file in values:  # dict - prop_identifier (always "id")
-                try:
-                    # This SQL should cascade auto
-                    self.CURS.execute(f"DELETE FROM files WHERE file_id='{rem_file['file_id']}'")
-                except IntegrityError as errmsg:
-                    db_logger.error(errmsg)
-                    success_resp.append((False, errmsg))
-                    continue
-                self.CONN.commit()
-                db_logger.info(f"Removed file '{rem_file['file_id']}' from database")
-                success_resp.append((True, ))
-            return success_resp
-
-        if item == "group":
-            success_resp = []
-            for rem_group in values:  # dict - prop_identifier (always "id")
-                try:
-                    self.CURS.execute(f"DELETE FROM tag_groups WHERE group_id='{rem_group['group_id']}'")
-                except IntegrityError as errmsg:
-                    db_logger.error(errmsg)
-                    success_resp.append((False, errmsg))
-                    continue
-                self.CONN.commit()
-                db_logger.info(f"Group '{rem_group['group_id']}' removed from database")
-                success_resp.append((True, ))
-            return success_resp
-
-        if item == "tag":
+            statement = "DELETE FROM files WHERE file_id=?"     # This SQL should cascade auto
+            rows = [(rem_file['file_id'], ) for rem_file in values]     # dict - prop_identifier (always "id")
+            message = "Removed file '{}' from database"
+        elif item == "group":
+            statement = "DELETE FROM tag_groups WHERE group_id=?"
+            rows = [(rem_group['group_id'], ) for rem_group in values]
+            message = "Group '{}' removed from database"
+        elif item == "tag":
             # Must not be able to delete tags attached to files
-            success_resp = []
-            for rem_tag in values:  # dict - prop_identifier (always "id")
-                try:
-                    self.CURS.execute(f"DELETE FROM tags WHERE tag_id='{rem_tag['tag_id']}'")
-                except IntegrityError as errmsg:
-                    db_logger.error(errmsg)
-                    success_resp.append((False, errmsg))
-                    continue
-                self.CONN.commit()
-                db_logger.info(f"Tag '{rem_tag['tag_id']}' removed from database")
-                success_resp.append((True, ))
-            return success_resp
+            statement = "DELETE FROM tags WHERE tag_id=?"
+            rows = [(rem_tag['tag_id'], ) for rem_tag in values]
+            message = "Tag '{}' removed from database"
+        else:   # "tag-file"
+            statement = "DELETE FROM tagged_files_m2m WHERE file=? AND tag=?"
+            rows = [(unlink['file_id'], unlink['tag_id']) for unlink in values]
+            message = "Untagged file '{}' from tag '{}'"
 
-        if item == "tag-file":
-            success_resp = []
-            for unlink in values:  # dict - prop_identifier (always "id")
-                try:
-                    self.CURS.execute(
-                        f"DELETE FROM tagged_files_m2m WHERE tag='{unlink['tag_id']}' AND file='{unlink['file_id']}'")
-                except IntegrityError as errmsg:
-                    db_logger.error(errmsg)
-                    success_resp.append((False, errmsg))
-                    continue
-                self.CONN.commit()
-                db_logger.info(f"Untagged file '{unlink['file_id']}' from tag '{unlink['tag_id']}'")
-                success_resp.append((True, ))
-            return success_resp
+        success_resp = []
+        for row, result in zip(rows, self._write_rows(statement, rows, batch, many=True)):
+            if isinstance(result, IntegrityError):
+                db_logger.error(result)
+                success_resp.append((False, result))
+                continue
+            db_logger.info(message.format(*row))
+            success_resp.append((True, ))
+        return success_resp
 
     # Files
 
@@ -0,0 +1,104 @@
+"""Read-only columnar snapshot of a library -> typed arrays for analytical reports, without building File objects"""
+from array import array
+from collections import Counter
+from heapq import nlargest
+from itertools import chain, compress, islice, repeat
+from operator import eq, ne, sub
+from os.path import basename, dirname, join, splitext
+
+import logging
+snapshot_logger = logging.getLogger(__name__)
+
+
+class LibrarySnapshot:
+    """
+    Every file is a row, in order of file_id. Per row columns are typed arrays:
+        file_ids, sizes, mtimes (ns), directory_ids, extension_ids     -> -1 where a size or time is unknown
+    Tag links are in compressed sparse row (CSR) layout: the tag ids of row r are
+        tag_ids[tag_offsets[r]:tag_offsets[r + 1]]
+    Directory and extension ids index into the directories and extensions lists. Tag ids map to (tag name, group name)
+    in tags.
+
+    Reports are scans over whole columns (zip, compress, Counter...), which run in C rather than per-object Python.
+    """
+
+    def __init__(self):
+        self.file_ids = array('q')
+        self.sizes = array('q')
+        self.mtimes = array('q')
+        self.directory_ids = array('l')
+        self.extension_ids = array('l')
+        self.names = []                 # File names -> with directories, rebuilds paths for report output
+        self.tag_offsets = array('q', [0])
+        self.tag_ids = array('q')
+        self.directories = []
+        self.extensions = []
+        self.tags = {}                  # tag_id: (tag_name, group_name)
+
+    @classmethod
+    def load(cls, conn):
+        """Bulk load a snapshot over a database connection, in a single read transaction"""
+        snapshot = cls()
+        directories = {}
+        extensions = {}
+        conn.execute("BEGIN")   # All scans from the same database state
+        try:
+            files = conn.execute("SELECT file_id, file_path, file_size, file_mtime FROM files ORDER BY file_id")
+            links = conn.execute("SELECT file, tag FROM tagged_files_m2m ORDER BY file, tag")
+            link = next(links, None)
+            for file_id, path, size, mtime in files:
+                name = basename(path)
+                directory = directories.setdefault(dirname(path), len(directories))
+                extension = extensions.setdefault(splitext(name)[1].lower(), len(extensions))
+                snapshot.file_ids.append(file_id)
+                snapshot.sizes.append(-1 if size is None else size)
+                snapshot.mtimes.append(-1 if mtime is None else mtime)
+                snapshot.directory_ids.append(directory)
+                snapshot.extension_ids.append(extension)
+                snapshot.names.append(name)
+                while link is not None and link[0] == file_id:
+                    snapshot.tag_ids.append(link[1])
+                    link = next(links, None)
+                snapshot.tag_offsets.append(len(snapshot.tag_ids))
+            snapshot.tags = {tag_id: (tag_name, group_name) for tag_id, tag_name, group_name in conn.execute(
+                "SELECT tag_id, tag_name, group_name FROM tags JOIN tag_groups ON tag_group=group_id")}
+        finally:
+            conn.execute("COMMIT")
+        snapshot.directories = list(directories)
+        snapshot.extensions = list(extensions)
+        snapshot_logger.info(f"Loaded snapshot of {len(snapshot)} files and {len(snapshot.tag_ids)} tag links")
+        return snapshot
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def path(self, row):
+        return join(self.directories[self.directory_ids[row]], self.names[row])
+
+    def tags_of(self, row):
+        return self.tag_ids[self.tag_offsets[row]:self.tag_offsets[row + 1]]
+
+    def _link_rows(self):
+        # Row of every link, in link order -> the CSR offsets expanded to one entry per link
+        counts = map(sub, islice(self.tag_offsets, 1, None), self.tag_offsets)
+        return chain.from_iterable(map(repeat, range(len(self)), counts))
+
+    def _tagged(self):
+        # Mask of rows with at least one tag
+        return map(ne, self.tag_offsets, islice(self.tag_offsets, 1, None))
+
+    def files_per_tag_per_folder(self):
+        """Return a Counter of {(tag_id, directory): number of files}"""
+        counts = Counter(zip(self.tag_ids, map(self.directory_ids.__getitem__, self._link_rows())))
+        return Counter({(tag_id, self.directories[directory]): n for (tag_id, directory), n in counts.items()})
+
+    def untagged_by_extension(self):
+        """Return a Counter of {extension: number of untagged files}"""
+        untagged = map(eq, self.tag_offsets, islice(self.tag_offsets, 1, None))
+        return Counter({self.extensions[extension]: n for extension, n in
+                        Counter(compress(self.extension_ids, untagged)).items()})
+
+    def largest_tagged(self, count=10):
+        """Return [(file_id, path, size), ...] of the largest tagged files, largest first"""
+        rows = nlargest(count, compress(range(len(self)), self._tagged()), key=self.sizes.__getitem__)
+        return [(self.file_ids[row], self.path(row), self.sizes[row]) for row in rows]
@@ -1,5 +1,6 @@
 from os import environ, sep, getcwd, name
 from os.path import expanduser, isfile, join
+from threading import Thread
 environ['KIVY_NO_CONSOLELOG'] = '1'
 if name == "nt":        # Set suitable provider for Windows users - normal sdl2 fails.
     environ['KIVY_GL_BACKEND'] = 'angle_sdl2'
@@ -18,18 +19,23 @@ from kivy.resources import resource_add_path, resource_find
 from kivy import require as kivy_require
 kivy_require("2.1.0")
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.uix.boxlayout import BoxLayout
 from kivy.properties import DictProperty, ObjectProperty, StringProperty
 from kivy.uix.settings import SettingsWithSidebar
 
 from elorydb import Database, db_logger, DatabaseError
-from databaseObjects import TagGroup, File, object_logger
+from asyncDatabase import AsyncDatabase, async_logger
+from thumbnailService import ThumbnailService, thumb_logger
+from bulkImport import import_tree, reconcile, import_logger
+from databaseObjects import TagGroup, File, ChangeTracker, object_logger
 from modals import SelectSystemObject, Notification, UserInputWithOption
 from displayTagPane import TagPane, tagpane_logger
 from displayFileNavigator import FileNavigationPane, filenav_logger
 from displayFilePane import FileDisplayPane, display_logger
 import setup
 
+import asyncio
 import sys
 from traceback import format_tb
 import logging
@@ -39,6 +45,9 @@ object_logger.parent = elory_logger
 filenav_logger.parent = elory_logger
 tagpane_logger.parent = elory_logger
 display_logger.parent = elory_logger
+import_logger.parent = elory_logger
+async_logger.parent = elory_logger
+thumb_logger.parent = elory_logger
 
 
 def log_uncaught_exception(e_type, e_value, e_traceback):
@@ -57,18 +66,28 @@ class RootWidget(BoxLayout):
     current_db = StringProperty()                       # Hold path to current open db file
 
     db = ObjectProperty(Database())
+    adb = ObjectProperty()                              # Awaitable calls on db, see asyncDatabase
+    thumbnails = ObjectProperty()                       # File previews, see thumbnailService
     files = DictProperty({})
     groups = DictProperty({})
     tags = DictProperty({})
 
+    SYNC_INTERVAL = 1.0                                 # Seconds between checks for changes by other connections
+    tracker = None                                      # ChangeTracker of the current db
+
     def __init__(self, data_dir, user_dir, default_db, systemview, default_sort, default_view, app_config, **kwargs):
         super(RootWidget, self).__init__(**kwargs)
         self.DATA_DIR = data_dir        # App's location and conf files
         self.USER_DIR = user_dir        # User home directory
+        self.adb = AsyncDatabase(self.db)
+        self.thumbnails = ThumbnailService(join(data_dir, "thumbnails"))
 
         self.ids["file_nav"].system_view_path = systemview
         self.ids["file_nav"].default_sort = default_sort
         self.ids["file_nav"].default_view = default_view
+        self.ids["file_nav"].lazy = bool(app_config.getdefaultint("Basic Settings", "lazy_navigation", 0))
+        self.ids["file_nav"].release_after = app_config.getdefaultint("Basic Settings", "release_idle_branches", 60)
+        Clock.schedule_interval(self.sync_database, self.SYNC_INTERVAL)
 
         if default_db == "":
             new_db = self.DATA_DIR + sep + "elory"          # default name for a new database
@@ -99,6 +118,7 @@ class RootWidget(BoxLayout):
         self.tags.clear()
         self.groups.clear()
 
+        self.tracker = None
         try:
             self.db.connect_db(path)
         except DatabaseError as errmsg:
@@ -115,14 +135,42 @@ class RootWidget(BoxLayout):
             return False, f"Failed to open database '{path}'\n\n{str(errmsg)}"
         self.current_db = path                      # Success - set path
 
+        self.tracker = ChangeTracker(self.db)       # Before loading, so no change can fall in between
         self.groups, self.tags = TagGroup.load_tag_collection(self.db)
         self.files = File.load_files(self.db, self.tags)
 
         self.ids["tag_pane"].load_objects()
         self.ids["file_nav"].load_objects()
+        Thread(target=self._fill_fingerprints, args=(path, ), name="fill-fingerprints", daemon=True).start()
         elory_logger.info("Environment load successful...")
         return True, None
 
+    @staticmethod
+    def _fill_fingerprints(path):
+        # Own connection on a worker thread -> files stored by an older version are read once, off the UI thread
+        database = Database()
+        try:
+            database.connect_db(path)
+            database.fill_fingerprints()
+        except Exception as errmsg:
+            elory_logger.warning(f"Failed to fingerprint older files of '{path}' - {errmsg}")
+        finally:
+            database._disconnect()
+
+    def sync_database(self, *args):
+        # Patch in changes committed by any other process (CLI, background job...) to the open db
+        if self.tracker is None:
+            return
+        changed = self.tracker.poll(self.groups, self.tags, self.files)
+        if changed is None:             # Too far behind -> reload in full
+            self.load_database(self.current_db)
+            return
+        if changed & {"tag_groups", "tags"}:       # Renamed groups and tags -> files and links patch the tree themselves
+            self.ids["tag_pane"].load_objects()
+            self.ids["file_nav"].refresh_view()
+        if changed:
+            elory_logger.info(f"Synced external changes to {', '.join(sorted(changed))}")
+
     def open_db(self):
         def open_(*args):
             success, msg = self.load_database(args[1][0][0])
@@ -134,6 +182,35 @@ class RootWidget(BoxLayout):
         d = SelectSystemObject(heading="Select Database", submit_call=open_, path=self.DATA_DIR, dirselect=False)
         d.open()
 
+    def import_folder(self):
+        def import_(*args):
+            root, path = args[1][0][0], self.current_db
+
+            def run():
+                # Own connection on a worker thread -> its commits reach the open db through sync_database
+                database = Database()
+                try:
+                    database.connect_db(path)
+                    moved = reconcile(database, [root])     # Files moved within the folder keep their tags
+                    report = import_tree(database, root)
+                except Exception as errmsg:     # Unreadable folder, locked db... -> the user is always told
+                    elory_logger.exception(f"Import of '{root}' failed")
+                    info = f"Import of '{root}' failed\n\n{errmsg}"
+                else:
+                    info = f"Imported {report['imported']} files, and found {len(moved)} moved files. " \
+                           f"{report['existing'] - len(moved)} were already in the " \
+                           f"database, {len(report['duplicates'])} duplicate and {len(report['failed'])} " \
+                           f"unreadable files were skipped."
+                finally:
+                    database._disconnect()
+                Clock.schedule_once(lambda dt: Notification(heading="Import Folder", info=info).open())
+
+            Thread(target=run, name="import-folder", daemon=True).start()
+
+        d = SelectSystemObject(heading="Select Folder to Import", submit_call=import_, path=self.USER_DIR,
+                               dirselect=True)
+        d.open()
+
     def create_new_db(self):
 
         def create(*args):
@@ -192,6 +269,8 @@ class EloryApp(App):
         self.title = "Elory - The Elephant Memory Database"
 
     def on_stop(self):
+        self.root.adb.close()
+        self.root.thumbnails.close()
         elory_logger.info("App closed...\n")
 
     def get_application_config(self, defaultpath='%(appdir)s/%(appname)s.ini'):
@@ -214,6 +293,8 @@ class EloryApp(App):
                         "default_database_path": "",
                         "default_sort_options": "Tag",
                         "default_view_options": "System",
+                        "lazy_navigation": 0,           # Fill tree branches only when opened -> large libraries
+                        "release_idle_branches": 60,    # Seconds until a collapsed branch is emptied again
                     }
                 )
                 config.setdefaults(
@@ -235,6 +316,8 @@ class EloryApp(App):
                         "default_database_path": "",
                         "default_sort_options": "Tag",
                         "default_view_options": "System",
+                        "lazy_navigation": 0,           # Fill tree branches only when opened -> large libraries
+                        "release_idle_branches": 60,    # Seconds until a collapsed branch is emptied again
                     }
                 )
                 config.setdefaults(
@@ -262,4 +345,5 @@ class EloryApp(App):
 if __name__ == "__main__":
     if hasattr(sys, '_MEIPASS'):
         resource_add_path(join(sys._MEIPASS))
-    EloryApp().run()
+    # On an asyncio loop, so database work awaited by the panes resumes on the Kivy thread (see asyncDatabase)
+    asyncio.run(EloryApp().async_run(async_lib="asyncio"))
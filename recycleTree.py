@@ -0,0 +1,315 @@
+"""Virtualized tree -> the add_node / remove_node / toggle_node interface of Kivy's TreeView, over a RecycleView
+
+TreeView builds a widget for every node, open or not. Here nodes are plain TreeNode objects. Whenever the tree changes,
+its open part is flattened into a list of visible rows (at most once a frame), and the RecycleView only binds the rows
+scrolled into view to the few row widgets it keeps. Tens of thousands of nodes cost a list of small dicts, not
+tens of thousands of widgets.
+
+Branches can also be lazy: a BranchNode only shows how many entries it holds until it is first opened, when load_func
+adds its children. Collapsed branches give their children up again after release_after seconds.
+"""
+from functools import partial
+
+from kivy.clock import Clock
+from kivy.properties import BooleanProperty, DictProperty, NumericProperty, ObjectProperty, StringProperty
+from kivy.uix.behaviors import FocusBehavior
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+
+import logging
+tree_logger = logging.getLogger(__name__)
+
+
+class TreeNode:
+    """
+    A node of a RecycleTree. Only row widgets on screen exist, so a node holds what its row displays.
+    viewclass -> name of the row widget class that displays this kind of node (see recycleTree.kv)
+    """
+    __slots__ = ("text", "no_selection", "is_open", "nodes", "parent_node", "level")
+    viewclass = "TreeRow"
+    row_height = 28
+
+    def __init__(self, text="", no_selection=False, is_open=False):
+        self.text = text
+        self.no_selection = no_selection
+        self.is_open = is_open
+        self.nodes = []
+        self.parent_node = None
+        self.level = 0
+
+    @property
+    def is_leaf(self):
+        return not self.nodes
+
+    def on_double_press(self, touch):
+        pass
+
+
+class TreeLabel(TreeNode):
+    """A node that only shows its text -> in place of TreeView's TreeViewLabel"""
+    __slots__ = ()
+
+
+class BranchNode(TreeNode):
+    """
+    A node whose children are only added when it is first opened (see RecycleTree.load_func)
+    key -> what the branch holds, for load_func
+    count -> number of entries in the branch, shown next to its name
+    """
+    __slots__ = ("name", "key", "count", "loaded")
+
+    def __init__(self, name, key, count, **kwargs):
+        super(BranchNode, self).__init__(no_selection=True, **kwargs)
+        self.name = name
+        self.key = key
+        self.loaded = False
+        self.set_count(count)
+
+    def set_count(self, count):
+        self.count = count
+        self.text = f"{self.name} ({count})"
+
+    @property
+    def is_leaf(self):
+        return self.loaded and not self.nodes
+
+
+class TreeRow(RecycleDataViewBehavior, BoxLayout):
+    """Row widget of a RecycleTree -> re-bound to whichever node is scrolled into its place"""
+    tree = ObjectProperty(None, allownone=True)
+    node = ObjectProperty(None, allownone=True)
+    text = StringProperty()
+    indent = NumericProperty()
+    is_open = BooleanProperty(False)
+    is_leaf = BooleanProperty(True)
+    row_size = ObjectProperty()     # Read by the layout (key_size) -> kept here so every data key is a property
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.tree = rv
+        return super(TreeRow, self).refresh_view_attrs(rv, index, data)
+
+    def on_touch_down(self, touch):
+        if not self.collide_point(*touch.pos) or self.node is None:
+            return False
+        if super(TreeRow, self).on_touch_down(touch):     # A button of the row
+            return True
+        if touch.is_double_tap:
+            self.node.on_double_press(touch)
+            return True
+        if not self.is_leaf and (self.node.no_selection or touch.x - self.x < self.indent + self.tree.indent_level):
+            self.tree.toggle_node(self.node)
+            return True
+        self.tree.select_node(self.node)
+        return True
+
+
+class RecycleTree(FocusBehavior, RecycleView):
+    """Focused by a touch -> the up and down keys then move the selection"""
+    root_options = DictProperty({})
+    hide_root = BooleanProperty(False)
+    indent_level = NumericProperty(16)
+    selected_node = ObjectProperty(None, allownone=True)
+    load_func = ObjectProperty(None, allownone=True)    # load_func(tree, node) -> adds the children of a BranchNode
+    release_after = NumericProperty(0)      # Seconds a collapsed BranchNode keeps its children -> 0: until removed
+
+    __events__ = ("on_node_expand", "on_node_collapse")
+
+    def __init__(self, **kwargs):
+        self.root = TreeLabel(is_open=True)
+        self._idle = {}     # Collapsed BranchNode: its scheduled release
+        self._refresh = Clock.create_trigger(self._flatten)
+        super(RecycleTree, self).__init__(**kwargs)
+        self._refresh()
+
+    def on_root_options(self, *args):
+        for option, value in self.root_options.items():
+            setattr(self.root, option, value)
+        self._refresh()
+
+    def on_hide_root(self, *args):
+        self._refresh()
+
+    def on_indent_level(self, *args):
+        self._refresh()
+
+    def add_node(self, node, parent=None):
+        parent = self.root if parent is None else parent
+        node.parent_node = parent
+        parent.nodes.append(node)
+        for child in self.iterate_all_nodes(node):
+            child.level = child.parent_node.level + 1
+        if self._visible(parent):
+            self._refresh()
+        return node
+
+    def remove_node(self, node):
+        parent = node.parent_node
+        if parent is None:
+            return
+        parent.nodes.remove(node)
+        node.parent_node = None
+        for removed in self.iterate_all_nodes(node):
+            if removed is self.selected_node:
+                self.selected_node = None
+            release = self._idle.pop(removed, None)
+            if release is not None:
+                release.cancel()
+        if self._visible(parent):
+            self._refresh()
+
+    def clear_all_nodes(self):
+        for node in self.root.nodes:
+            node.parent_node = None
+        self.root.nodes = []
+        for release in self._idle.values():
+            release.cancel()
+        self._idle.clear()
+        self.selected_node = None
+        self._refresh()
+        tree_logger.info("All nodes cleared..")
+
+    def toggle_node(self, node):
+        node.is_open = not node.is_open
+        if self._visible(node):
+            self._refresh()
+        self.dispatch("on_node_expand" if node.is_open else "on_node_collapse", node)
+
+    def on_node_expand(self, node):
+        release = self._idle.pop(node, None)
+        if release is not None:
+            release.cancel()
+        if isinstance(node, BranchNode) and not node.loaded and self.load_func is not None:
+            node.loaded = True
+            self.load_func(self, node)
+
+    def on_node_collapse(self, node):
+        if isinstance(node, BranchNode) and node.loaded and self.release_after > 0:
+            self._idle[node] = Clock.schedule_once(partial(self._release_idle, node), self.release_after)
+
+    def _release_idle(self, node, *args):
+        if self._idle.pop(node, None) is not None and not node.is_open:
+            self.release_node(node)
+
+    def release_node(self, node):
+        """Remove the children of a BranchNode -> load_func adds them again when it is next opened"""
+        for child in node.nodes:
+            for released in self.iterate_all_nodes(child):
+                if released is self.selected_node:
+                    self.selected_node = None
+                release = self._idle.pop(released, None)
+                if release is not None:
+                    release.cancel()
+            child.parent_node = None
+        node.nodes = []
+        node.loaded = False
+        if self._visible(node):
+            self._refresh()
+
+    def set_count(self, node, count):
+        """Show a new count on a BranchNode"""
+        node.set_count(count)
+        self.refresh_node(node)
+
+    def select_node(self, node):
+        if node.no_selection:
+            return
+        self.selected_node = node
+
+    def keyboard_on_key_down(self, window, keycode, text, modifiers):
+        step = {"up": -1, "down": 1}.get(keycode[1])
+        if step is None or self.selected_node is None:
+            return super(RecycleTree, self).keyboard_on_key_down(window, keycode, text, modifiers)
+        self.select_adjacent(step)
+        return True
+
+    def select_adjacent(self, step):
+        """Select the nearest selectable row below (step 1) or above (-1) the selected one, and scroll it into view"""
+        index = self._row_index(self.selected_node)
+        if index is None:
+            return
+        index += step
+        while 0 <= index < len(self.data) and self.data[index]["node"].no_selection:
+            index += step
+        if 0 <= index < len(self.data):
+            self.select_node(self.data[index]["node"])
+            self._scroll_to_row(index)
+
+    def neighbours(self, node, count):
+        """Nodes of up to count rows either side of node's row, nearest first -> [] if the row isn't shown"""
+        index = self._row_index(node)
+        if index is None:
+            return []
+        near = []
+        for distance in range(1, count + 1):
+            near.extend(self.data[i]["node"] for i in (index + distance, index - distance) if 0 <= i < len(self.data))
+        return near
+
+    def _row_index(self, node):
+        return next((i for i, row in enumerate(self.data) if row["node"] is node), None)
+
+    def _scroll_to_row(self, index):
+        scrollable = self.children[0].height - self.height if self.children else 0
+        if scrollable <= 0:
+            return
+        top = sum(row["row_size"][1] for row in self.data[:index])     # Of the row, from the top of all rows
+        bottom = top + self.data[index]["row_size"][1]
+        hidden_above = (1 - self.scroll_y) * scrollable
+        if top < hidden_above:
+            hidden_above = top
+        elif bottom > hidden_above + self.height:
+            hidden_above = bottom - self.height
+        else:
+            return
+        self.scroll_y = 1 - min(1, hidden_above / scrollable)
+
+    def refresh_node(self, node):
+        """Redraw after a node's text (or other displayed value) was changed"""
+        if self._visible(node):
+            self._refresh()
+
+    def iterate_all_nodes(self, node=None):
+        """Yield node (the root by default) and all nodes below it, depth first"""
+        stack = [self.root if node is None else node]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.nodes))
+
+    def iterate_open_nodes(self, node=None):
+        """Yield node (the root by default) and the nodes below it that are shown, depth first"""
+        stack = [self.root if node is None else node]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.is_open:
+                stack.extend(reversed(node.nodes))
+
+    def _visible(self, node):
+        # Whether node's row is in the flattened rows -> changes below a closed node don't need a refresh
+        while node.parent_node is not None:
+            node = node.parent_node
+            if not node.is_open:
+                return False
+        return node is self.root
+
+    def _flatten(self, *args):
+        rows = []
+        nodes = self.iterate_open_nodes()
+        if self.hide_root:
+            next(nodes)
+        base = 1 if self.hide_root else 0
+        for node in nodes:
+            rows.append({"viewclass": node.viewclass, "node": node, "text": node.text,
+                         "indent": (node.level - base) * self.indent_level, "is_open": node.is_open,
+                         "is_leaf": node.is_leaf, "row_size": (None, node.row_height)})
+        # scroll_y is a fraction of the content height -> keep the distance scrolled from the top instead, so rows
+        # added or removed further down don't shift the ones in view
+        hidden_above = (1 - self.scroll_y) * max(0, self.children[0].height - self.height) if self.children else 0
+        self.data = rows
+        if hidden_above:
+            Clock.schedule_once(lambda dt: self._restore_scroll(hidden_above), 0)
+
+    def _restore_scroll(self, hidden_above):
+        scrollable = self.children[0].height - self.height
+        self.scroll_y = 1 - min(1, hidden_above / scrollable) if scrollable > 0 else 1
@@ -0,0 +1,167 @@
+"""Boolean tag queries -> compiled to a single set-based sqlite statement over tagged_files_m2m
+
+    expression  := or_expr
+    or_expr     := and_expr ( OR and_expr )*
+    and_expr    := not_expr ( AND not_expr )*
+    not_expr    := NOT not_expr | '(' or_expr ')' | term
+    term        := name ':' name            -> files with this tag of this group     e.g. People:"Benoit Blanc"
+                 | name ':' '*'             -> files with any tag of this group      e.g. Places:*
+                 | name                     -> files with a tag of this name, in any group
+                 | '*'                      -> every file
+
+Names with spaces or special characters are double quoted. Keywords are case insensitive.
+"""
+import re
+
+import logging
+query_logger = logging.getLogger(__name__)
+
+
+class TagQueryError(ValueError):
+    """The expression is not a valid tag query"""
+
+
+_TOKENS = re.compile(r'\s*(?:(?P<punct>[():*])|"(?P<quoted>(?:[^"\\]|\\.)*)"|(?P<word>[^\s():*"]+))')
+_KEYWORDS = {"AND", "OR", "NOT"}
+
+_ALL_FILES = "SELECT file_id AS file FROM files"
+_BY_TAG = "SELECT file FROM tagged_files_m2m WHERE tag IN " \
+          "(SELECT tag_id FROM tags WHERE tag_name=? AND tag_group=(SELECT group_id FROM tag_groups WHERE group_name=?))"
+_BY_GROUP = "SELECT DISTINCT file FROM tagged_files_m2m WHERE tag IN " \
+            "(SELECT tag_id FROM tags WHERE tag_group=(SELECT group_id FROM tag_groups WHERE group_name=?))"
+_BY_TAG_NAME = "SELECT DISTINCT file FROM tagged_files_m2m WHERE tag IN (SELECT tag_id FROM tags WHERE tag_name=?)"
+
+
+def _tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKENS.match(expression, position)
+        if match is None:
+            raise TagQueryError(f"Unexpected character at position {position}: {expression[position:]!r}")
+        position = match.end()
+        if match["punct"]:
+            tokens.append((match["punct"], None))
+        elif match["quoted"] is not None:
+            tokens.append(("name", re.sub(r'\\(.)', r'\1', match["quoted"])))
+        elif match["word"].upper() in _KEYWORDS:
+            tokens.append((match["word"].upper(), None))
+        else:
+            tokens.append(("name", match["word"]))
+    return tokens
+
+
+class _Parser:
+    # Recursive descent over the grammar above. Nodes are tuples:
+    #   ("all",) ("tag", group, tag) ("group", group) ("name", tag) ("not", node) ("and", [nodes]) ("or", [nodes])
+
+    def __init__(self, expression):
+        self.tokens = _tokenize(expression)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self, kind):
+        if self.peek() != kind:
+            found = self.peek() or "end of query"
+            raise TagQueryError(f"Expected {kind} but found {found}")
+        token = self.tokens[self.position]
+        self.position += 1
+        return token[1]
+
+    def parse(self):
+        if not self.tokens:
+            raise TagQueryError("Empty tag query")
+        node = self.or_expr()
+        if self.peek() is not None:
+            raise TagQueryError(f"Unexpected {self.peek()} after complete query")
+        return node
+
+    def or_expr(self):
+        nodes = [self.and_expr()]
+        while self.peek() == "OR":
+            self.take("OR")
+            nodes.append(self.and_expr())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def and_expr(self):
+        nodes = [self.not_expr()]
+        while self.peek() == "AND":
+            self.take("AND")
+            nodes.append(self.not_expr())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def not_expr(self):
+        if self.peek() == "NOT":
+            self.take("NOT")
+            return "not", self.not_expr()
+        if self.peek() == "(":
+            self.take("(")
+            node = self.or_expr()
+            self.take(")")
+            return node
+        if self.peek() == "*":
+            self.take("*")
+            return "all",
+        name = self.take("name")
+        if self.peek() != ":":
+            return "name", name
+        self.take(":")
+        if self.peek() == "*":
+            self.take("*")
+            return "group", name
+        return "tag", name, self.take("name")
+
+
+def parse(expression):
+    """Parse a tag query into its expression tree. Raises TagQueryError on a malformed query"""
+    return _Parser(expression).parse()
+
+
+def _compile(node, parameters):
+    # Returns the SQL of a select of a single 'file' column. Compound selects can't be parenthesized in sqlite,
+    # so nested compounds are wrapped as a subquery instead.
+    kind = node[0]
+    if kind == "all":
+        return _ALL_FILES
+    if kind == "tag":
+        parameters.extend((node[2], node[1]))
+        return _BY_TAG
+    if kind == "group":
+        parameters.append(node[1])
+        return _BY_GROUP
+    if kind == "name":
+        parameters.append(node[1])
+        return _BY_TAG_NAME
+    if kind == "not":
+        return f"{_ALL_FILES} EXCEPT {_operand(node[1], parameters)}"
+    if kind == "or":
+        return " UNION ".join(_operand(child, parameters) for child in node[1])
+    # "and" -> intersect the positive terms first, then take away the negated ones
+    positives = [child for child in node[1] if child[0] != "not"]
+    negatives = [child[1] for child in node[1] if child[0] == "not"]
+    parts = [_operand(child, parameters) for child in positives] or [_ALL_FILES]
+    statement = " INTERSECT ".join(parts)
+    for child in negatives:
+        statement += f" EXCEPT {_operand(child, parameters)}"
+    return statement
+
+
+def _operand(node, parameters):
+    statement = _compile(node, parameters)
+    if node[0] in ("not", "and", "or"):
+        return f"SELECT file FROM ({statement})"
+    return statement
+
+
+def compile_query(expression):
+    """
+    expression -> a boolean tag query, e.g. '(People:"Benoit Blanc" AND Places:*) AND NOT Pets:*'
+    returns (statement, parameters) -> one statement selecting the matching file ids, ordered by id
+    """
+    parameters = []
+    statement = f"{_compile(parse(expression), parameters)} ORDER BY file"
+    query_logger.debug(f"Compiled tag query '{expression}' -> {statement}")
+    return statement, parameters
@@ -2,7 +2,15 @@
 import unittest
 import sqlite3
 import os
+import tempfile
+import threading
+import asyncio
 from elorydb import Database, db_logger
+from databaseObjects import TagGroup, File, TagIndex, ChangeTracker, events
+from tagQuery import TagQueryError
+from bulkImport import scan, import_tree, reconcile
+from duplicateReport import find_duplicates
+from asyncDatabase import AsyncDatabase
 
 
 # --- DB Connection Tests ---
@@ -62,6 +70,945 @@ class TestDataBaseConnections(unittest.TestCase):
     pass
 
 
+class TemporaryDatabase(unittest.TestCase):
+    """Base case that creates a fresh database with default values in a temporary directory"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db = Database(data_dir=self.tmp.name)
+        self.db.create_new_db("test")
+        self.addCleanup(self.db._disconnect)
+
+    def make_file(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+
+# --- Snapshot Loading Tests ---
+class TestSnapshotLoading(TemporaryDatabase):
+
+    def test_read_all_merges_links(self):
+        a = self.db.create_entry("file", [{'file_path': self.make_file("a.txt", b"a")}])[0][0]
+        b = self.db.create_entry("file", [{'file_path': self.make_file("b.txt", b"b")}])[0][0]
+        self.db.create_entry("tag-file", [{'file_id': a, 'tag_id': 1}, {'file_id': a, 'tag_id': 2}])
+        files, tags = self.db.read_entry([("files", "all"), ("tags", "all")])
+        self.assertEqual([f[3] for f in files], [[1, 2], []])
+        self.assertEqual(tags[0][3], [a])
+        self.assertEqual(tags[2][3], [])
+        self.assertNotEqual(a, b)
+
+    def test_load_objects_from_snapshot(self):
+        path = self.make_file("a.txt", b"a")
+        a = self.db.create_entry("file", [{'file_path': path}])[0][0]
+        self.db.create_entry("tag-file", [{'file_id': a, 'tag_id': 4}])
+        groups, tags = TagGroup.load_tag_collection(self.db)
+        files = File.load_files(self.db, tags)
+        self.assertEqual(set(groups), set(Database._DEFAULT_VALUES))
+        self.assertEqual(len(tags), sum(len(x) for x in Database._DEFAULT_VALUES.values()))
+        self.assertIs(tags[4].group, groups["Places"])
+        self.assertEqual(files[path].path, path)
+        self.assertEqual(files[path].name, "a.txt")
+        self.assertEqual(list(files[path].tags), [4])
+        self.assertIs(tags[4].files[a], files[path])
+
+    def test_compact_objects(self):
+        path = self.make_file("a.txt", b"a")
+        a = self.db.create_entry("file", [{'file_path': path}])[0][0]
+        self.db.create_entry("tag-file", [{'file_id': a, 'tag_id': 4}])
+        files = File.load_files(self.db, TagGroup.load_tag_collection(self.db)[1])
+        file = files[path]
+        self.assertFalse(hasattr(file, "__dict__"))
+        self.assertIs(file.path, next(iter(files)))     # Shared with the dict key, not copied
+        self.assertEqual((file.name, file.directory), ("a.txt", self.tmp.name))
+        self.assertEqual(file.hash_id, Database.digest(path))
+        self.assertEqual(File(1, path, "not-a-digest").hash_id, "not-a-digest")
+        with self.assertRaises(TypeError):
+            file.tags[5] = file.tags[4]
+
+
+# --- Batch Write Tests ---
+class TestBatchWrites(TemporaryDatabase):
+
+    def test_batch_keeps_rows_around_a_failure(self):
+        a = self.db.create_entry("file", [{'file_path': self.make_file("a.txt", b"a")}])[0][0]
+        links = [{'file_id': a, 'tag_id': 1}, {'file_id': a, 'tag_id': 1}, {'file_id': a, 'tag_id': 2}]
+        result = self.db.create_entry("tag-file", links, batch=True)
+        self.assertEqual(result[0], (1, a))
+        self.assertFalse(result[1][0])
+        self.assertEqual(result[2], (2, a))
+        self.assertEqual(len(self.db.read_entry([("tags", "file_id", a)])[0]), 2)
+
+    def test_batch_reports_new_ids(self):
+        result = self.db.create_entry("group", [{"group_name": "Food"}, {"group_name": "People"},
+                                                {"group_name": "Music"}], batch=True)
+        self.assertTrue(result[0][0])
+        self.assertFalse(result[1][0])
+        self.assertEqual(result[2][1], result[0][1] + 1)
+        self.assertFalse(self.db.CONN.in_transaction)
+
+    def test_batch_delete(self):
+        a = self.db.create_entry("file", [{'file_path': self.make_file("a.txt", b"a")}])[0][0]
+        self.db.create_entry("tag-file", [{'file_id': a, 'tag_id': 1}])
+        result = self.db.delete_entry("tag", [{'tag_id': 2}, {'tag_id': 1}, {'tag_id': 3}], batch=True)
+        self.assertEqual([r[0] for r in result], [True, False, True])
+        self.assertEqual([t[0] for t in self.db.read_entry([("tags", "all")])[0]][:2], [1, 4])
+
+
+# --- File Ingestion Tests ---
+class TestFileIngestion(TemporaryDatabase):
+
+    def test_parallel_hashes_keep_input_order(self):
+        paths = [self.make_file(f"{i}.bin", bytes([i]) * (i * 1000)) for i in range(20)]
+        paths.insert(5, os.path.join(self.tmp.name, "missing.bin"))
+        expected = [Database.digest(p) for p in paths]
+        for workers in (1, 3):
+            self.assertEqual(list(self.db.digest_all(paths, workers=workers)), expected)
+
+    def test_create_files_in_order(self):
+        paths = [self.make_file(f"{i}.bin", bytes([i]) * 100) for i in range(10)]
+        paths.insert(3, paths[0])       # A duplicate
+        result = self.db.create_entry("file", [{'file_path': p} for p in paths], batch=True)
+        self.assertFalse(result[3][0])
+        ids = [r[0] for r in result if r[0]]
+        self.assertEqual(ids, list(range(1, 11)))
+        for r, p in zip(result, paths):
+            self.assertEqual(r[-1], Database.digest(p))
+
+
+# --- Hash Cache Tests ---
+class TestHashCache(TemporaryDatabase):
+
+    def test_unchanged_file_is_not_rehashed(self):
+        path = self.make_file("a.txt", b"original")
+        self.assertEqual(list(self.db.digest_all([path])), [Database.digest(path)])
+        self.assertEqual(self.db.CONN.execute("SELECT COUNT(*) FROM hash_cache").fetchone()[0], 1)
+        # Forge the cached digest -> a cache hit must return it without reading the file
+        self.db.CONN.execute("UPDATE hash_cache SET file_hash_name='cached'")
+        self.assertEqual(list(self.db.digest_all([path])), ["cached"])
+        self.assertEqual(list(self.db.digest_all([path], refresh=True)), [Database.digest(path)])
+
+    def test_changed_file_is_rehashed(self):
+        path = self.make_file("a.txt", b"original")
+        list(self.db.digest_all([path]))
+        self.db.CONN.execute("UPDATE hash_cache SET file_hash_name='cached'")
+        self.make_file("a.txt", b"modified content")
+        self.assertEqual(list(self.db.digest_all([path])), [Database.digest(path)])
+
+    def test_cache_table_added_on_connect(self):
+        self.db.CONN.execute("DROP TABLE hash_cache")
+        self.db.connect_db(self.db.PATH)
+        path = self.make_file("a.txt", b"a")
+        self.assertEqual(list(self.db.digest_all([path])), [Database.digest(path)])
+
+
+# --- Tiered File Identity Tests ---
+class TestFileIdentity(TemporaryDatabase):
+
+    def large_content(self, middle=b"m"):
+        # Large enough to be sampled rather than read whole. 'middle' lands outside the three samples
+        sample = Database._SAMPLE_SIZE
+        return b"h" * sample + middle * sample + b"t" * (6 * sample)
+
+    def stored(self, file_id):
+        return self.db.CONN.execute("SELECT file_hash_name, file_size, file_fingerprint FROM files "
+                                    "WHERE file_id=?", (file_id, )).fetchone()
+
+    def test_unique_large_file_is_not_digested(self):
+        path = self.make_file("a.bin", self.large_content())
+        file_id, file_hash = self.db.create_entry("file", [{'file_path': path}])[0]
+        self.assertEqual(self.stored(file_id), (Database.fingerprint(path), os.path.getsize(path), file_hash))
+        self.assertNotEqual(file_hash, Database.digest(path))
+
+    def test_small_file_fingerprint_is_digest(self):
+        path = self.make_file("a.txt", b"small")
+        self.assertEqual(Database.fingerprint(path), Database.digest(path))
+
+    def test_verify_stores_digest(self):
+        path = self.make_file("a.bin", self.large_content())
+        file_hash = self.db.create_entry("file", [{'file_path': path}], verify=True)[0][1]
+        self.assertEqual(file_hash, Database.digest(path))
+
+    def test_fingerprint_collision_is_resolved_by_digest(self):
+        a = self.make_file("a.bin", self.large_content(b"1"))
+        b = self.make_file("b.bin", self.large_content(b"2"))
+        self.assertEqual(Database.fingerprint(a), Database.fingerprint(b))
+        first, second = self.db.create_entry("file", [{'file_path': a}, {'file_path': b}])
+        self.assertTrue(second[0])      # Not a duplicate after all
+        self.assertEqual(self.stored(first[0])[0], Database.digest(a))
+        self.assertEqual(second[1], Database.digest(b))
+
+    def test_duplicate_large_file_is_rejected(self):
+        a = self.make_file("a.bin", self.large_content())
+        b = self.make_file("b.bin", self.large_content())
+        self.db.create_entry("file", [{'file_path': a}])
+        success, message = File.new_file(b, self.db)
+        self.assertFalse(success)
+        self.assertIn(a, message)
+
+    def test_older_database_is_upgraded(self):
+        path = self.make_file("a.txt", b"legacy")
+        self.db.CONN.executescript(
+            "DROP TABLE files; CREATE TABLE files(file_id INTEGER PRIMARY KEY, file_path TEXT UNIQUE NOT NULL, "
+            f"file_hash_name TEXT UNIQUE NOT NULL); INSERT INTO files VALUES (1, '{path}', 'legacy-hash');")
+        self.db.connect_db(self.db.PATH)
+        self.assertEqual(self.stored(1), ("legacy-hash", 6, None))      # Only a stat on connect
+        duplicate = self.make_file("b.txt", b"legacy")
+        self.assertTrue(self.db.create_entry("file", [{'file_path': duplicate}])[0][0])
+        self.assertEqual(self.db.fill_fingerprints(), 1)
+        self.assertEqual(self.stored(1)[2], Database.digest(path))
+
+    def test_connect_to_database_of_the_first_version(self):
+        legacy = os.path.join(self.tmp.name, "legacy.edb")
+        large = self.large_content()
+        path = self.make_file("a.bin", large)
+        conn = sqlite3.connect(legacy)     # The schema before any auxiliary table, index or late column
+        conn.executescript(
+            "CREATE TABLE files(file_id INTEGER PRIMARY KEY, file_path TEXT UNIQUE NOT NULL, "
+            "file_hash_name TEXT UNIQUE NOT NULL); "
+            "CREATE TABLE tag_groups(group_id INTEGER PRIMARY KEY, group_name TEXT UNIQUE NOT NULL); "
+            "CREATE TABLE tags(tag_id INTEGER PRIMARY KEY, tag_name TEXT NOT NULL, tag_group INTEGER NOT NULL, "
+            "FOREIGN KEY(tag_group) REFERENCES tag_groups(group_id) ON DELETE RESTRICT ON UPDATE CASCADE, "
+            "UNIQUE(tag_name, tag_group) ON CONFLICT FAIL); "
+            "CREATE TABLE tagged_files_m2m(tag INTEGER NOT NULL, file INTEGER NOT NULL, "
+            "FOREIGN KEY(tag) REFERENCES tags(tag_id) ON DELETE RESTRICT ON UPDATE CASCADE, "
+            "FOREIGN KEY(file) REFERENCES files(file_id) ON DELETE RESTRICT ON UPDATE CASCADE, "
+            "UNIQUE(tag, file) ON CONFLICT FAIL); "
+            "INSERT INTO tag_groups VALUES (1, 'People'); INSERT INTO tags VALUES (1, 'Benoit Blanc', 1); "
+            f"INSERT INTO files VALUES (1, '{path}', '{Database.digest(path)}'); "
+            "INSERT INTO tagged_files_m2m VALUES (1, 1);")
+        conn.close()
+        self.db.connect_db(legacy)
+        self.assertEqual(self.stored(1), (Database.digest(path), len(large), None))
+        self.assertEqual(self.db.file_counts()[0], {1: 1})
+        copy = self.make_file("copy.bin", large)    # Compared by digest until the row is fingerprinted
+        self.assertFalse(self.db.create_entry("file", [{'file_path': copy}])[0][0])
+        self.assertEqual(self.db.fill_fingerprints(), 1)
+        self.assertEqual(self.stored(1)[2], Database.fingerprint(path))
+        self.assertFalse(self.db.create_entry("file", [{'file_path': copy}])[0][0])
+
+    def test_missing_legacy_file_is_left_for_reconciliation(self):
+        self.db.CONN.execute("INSERT INTO files (file_path, file_hash_name) VALUES (?, 'legacy-hash')",
+                             (os.path.join(self.tmp.name, "gone.txt"), ))
+        self.db.CONN.commit()
+        self.db.connect_db(self.db.PATH)
+        self.assertEqual(self.stored(1), ("legacy-hash", None, None))
+        self.assertTrue(self.db.create_entry("file", [{'file_path': self.make_file("a.txt", b"new")}])[0][0])
+
+
+# --- Index Tests ---
+class TestIndexes(TemporaryDatabase):
+
+    def test_declared_indexes_are_used(self):
+        for index, exists, used, plan in self.db.index_report():
+            self.assertTrue(exists, index)
+            self.assertTrue(used, plan)
+
+    def test_indexes_added_on_connect(self):
+        self.db.CONN.execute("DROP INDEX idx_tagged_files_file")
+        self.assertFalse(self.db.index_report()[0][1])
+        self.db.connect_db(self.db.PATH)
+        self.assertTrue(self.db.index_report()[0][2])
+        plan = self.db.explain("SELECT tag FROM tagged_files_m2m WHERE file=?", (1, ))
+        self.assertIn("idx_tagged_files_file", plan[0])
+
+
+# --- Performance Profile Tests ---
+class TestPerformanceProfiles(TemporaryDatabase):
+
+    def test_connect_applies_default_profile(self):
+        settings = self.db._read_settings()
+        self.assertEqual(settings["journal_mode"], "wal")
+        self.assertEqual(settings["cache_size"], Database._PROFILES["desktop"]["cache_size"])
+
+    def test_profile_is_restored(self):
+        before = self.db._read_settings()
+        with self.db.profile("bulk-import"):
+            self.assertEqual(self.db._read_settings()["cache_size"], Database._PROFILES["bulk-import"]["cache_size"])
+            self.db.create_entry("group", [{"group_name": "Food"}], batch=True)
+        self.assertEqual(self.db._read_settings(), before)
+
+    def test_read_only_profile_rejects_writes(self):
+        with self.db.profile("read-only"):
+            with self.assertRaises(sqlite3.OperationalError):
+                self.db.create_entry("group", [{"group_name": "Food"}])
+            self.assertFalse(self.db.CONN.in_transaction)
+        self.assertTrue(self.db.create_entry("group", [{"group_name": "Food"}])[0][0])
+
+    def test_read_only_profile_can_disconnect(self):
+        reader = Database(profile="read-only")
+        reader.connect_db(self.db.PATH)
+        reader._disconnect()
+        self.assertIsNone(reader.CONN)
+        self.db.set_profile("read-only")
+        self.db.connect_db(self.db.PATH)        # Disconnects first
+        self.assertEqual(len(self.db.read_entry([("tag_groups", "all")])[0]), 3)
+
+
+# --- Connection Pool Tests ---
+class TestConnectionPool(TemporaryDatabase):
+
+    def test_readers_see_committed_writes(self):
+        self.db.create_entry("group", [{"group_name": "Food"}])
+        found = self.db.read_entry([("tag_groups", "group_name", "Food")])[0]
+        self.assertEqual(len(found), 1)
+
+    def test_nested_reads_share_a_connection(self):
+        with self.db.reader() as outer:
+            with self.db.reader() as inner:
+                self.assertIs(outer, inner)
+            self.db.read_entry([("tags", "all")])
+        with self.assertRaises(sqlite3.OperationalError):    # Readers are read-only
+            with self.db.reader() as conn:
+                conn.execute("DELETE FROM tags")
+
+    def test_concurrent_reads_and_writes(self):
+        errors = []
+
+        def read():
+            try:
+                for _ in range(20):
+                    groups, tags = TagGroup.load_tag_collection(self.db)
+                    self.assertIn("People", groups)
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=read) for _ in range(Database.READERS + 2)]
+        for thread in threads:
+            thread.start()
+        for i in range(20):
+            self.db.create_entry("group", [{"group_name": f"Group {i}"}])
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(self.db._pool._opened, Database.READERS)
+        self.assertEqual(len(self.db.read_entry([("tag_groups", "all")])[0]), 23)
+
+
+# --- Read Query Tests ---
+class TestReadQueries(TemporaryDatabase):
+
+    def test_keys_are_typed(self):
+        by_int, by_text = self.db.read_entry([("tags", "tag_id", 2), ("tags", "tag_id", "2")])
+        self.assertEqual(by_int, by_text)
+        self.assertEqual(by_int[0][1], "Benoit Blanc")
+        self.assertIsNone(self.db.read_entry([("tags", "tag_id", "two")])[0])
+
+    def test_values_are_bound(self):
+        name = "O'Brien\"; DROP TABLE tags; --"
+        self.db.create_entry("group", [{"group_name": name}])
+        self.assertEqual(self.db.read_entry([("tag_groups", "group_name", name)])[0][0][1], name)
+        self.assertTrue(self.db.read_entry([("tags", "all")])[0])
+
+    def test_cross_table_lookups(self):
+        path = self.make_file("a.txt", b"a")
+        a = self.db.create_entry("file", [{'file_path': path}])[0][0]
+        self.db.create_entry("tag-file", [{'file_id': a, 'tag_id': 5}])
+        by_path, group, tags = self.db.read_entry([("tags", "file_path", path), ("tag_groups", "tag_id", 5),
+                                                   ("tags", "group_name", "Pets")])
+        self.assertEqual(by_path, [(5, a)])
+        self.assertEqual(group[0][1], "Places")
+        self.assertEqual([t[1] for t in tags], Database._DEFAULT_VALUES["Pets"])
+
+
+class TaggedDatabase(TemporaryDatabase):
+    """Five files linked to a few default tags"""
+
+    def setUp(self):
+        super().setUp()
+        self.paths = [self.make_file(f"{i}.txt", bytes([i])) for i in range(5)]
+        self.ids = [r[0] for r in self.db.create_entry("file", [{'file_path': p} for p in self.paths], batch=True)]
+        links = {0: [2, 4], 1: [2, 5, 8], 2: [1, 6], 3: [2], 4: []}   # Benoit Blanc is tag 2, Pets are 8 - 10
+        self.db.create_entry("tag-file", [{'file_id': self.ids[f], 'tag_id': t} for f, tags in links.items()
+                                          for t in tags], batch=True)
+
+    def query(self, expression):
+        return [self.ids.index(file_id) for file_id in self.db.query_files(expression)]
+
+
+# --- Tag Query Tests ---
+class TestTagQueries(TaggedDatabase):
+
+    def test_boolean_operators(self):
+        self.assertEqual(self.query('(People:"Benoit Blanc" AND Places:*) AND NOT Pets:*'), [0])
+        self.assertEqual(self.query('People:"Benoit Blanc" and not Places:*'), [3])
+        self.assertEqual(self.query('Pets:* OR People:"Jack Pembleton"'), [1, 2])
+        self.assertEqual(self.query('NOT (People:* OR Places:*)'), [4])
+        self.assertEqual(self.query('*'), [0, 1, 2, 3, 4])
+
+    def test_names_and_unknowns(self):
+        self.assertEqual(self.query('"Benoit Blanc"'), [0, 1, 3])
+        self.assertEqual(self.query('Places:*'), [0, 1, 2])
+        self.assertEqual(self.query('Nowhere:*'), [])
+
+    def test_malformed_queries(self):
+        for expression in ('', 'People:', '(Pets:*', 'Pets:* AND', 'Pets:* Places:*', '"unterminated'):
+            with self.assertRaises(TagQueryError):
+                self.db.query_files(expression)
+
+    def test_file_objects(self):
+        groups, tags = TagGroup.load_tag_collection(self.db)
+        files = File.load_files(self.db, tags)
+        found = File.query(self.db, 'Pets:*', files)
+        self.assertEqual([f.db_id for f in found], [self.ids[1]])
+        self.assertIs(found[0], files[found[0].path])
+
+
+# --- Columnar Snapshot Tests ---
+class TestColumnarSnapshot(TaggedDatabase):
+
+    def test_columns_and_links(self):
+        snapshot = self.db.columnar_snapshot()
+        self.assertEqual(list(snapshot.file_ids), self.ids)
+        self.assertEqual(list(snapshot.sizes), [1] * 5)
+        self.assertEqual(snapshot.mtimes[0], os.stat(self.paths[0]).st_mtime_ns)
+        self.assertEqual(list(snapshot.tags_of(1)), [2, 5, 8])
+        self.assertEqual(list(snapshot.tags_of(4)), [])
+        self.assertEqual(snapshot.path(3), self.paths[3])
+        self.assertEqual(snapshot.tags[8], ("Leah -Dog", "Pets"))
+
+    def test_reports(self):
+        sub = os.path.join(self.tmp.name, "sub")
+        os.mkdir(sub)
+        big = self.make_file(os.path.join("sub", "big.JPG"), b"x" * 100)
+        file_id = self.db.create_entry("file", [{'file_path': big}])[0][0]
+        self.db.create_entry("tag-file", [{'file_id': file_id, 'tag_id': 2}])
+        self.make_file("untagged.jpg", b"y")
+        self.db.create_entry("file", [{'file_path': os.path.join(self.tmp.name, "untagged.jpg")}])
+        snapshot = self.db.columnar_snapshot()
+        per_folder = snapshot.files_per_tag_per_folder()
+        self.assertEqual(per_folder[(2, self.tmp.name)], 3)
+        self.assertEqual(per_folder[(2, sub)], 1)
+        self.assertEqual(snapshot.untagged_by_extension(), {".txt": 1, ".jpg": 1})
+        self.assertEqual(snapshot.largest_tagged(2)[0], (file_id, big, 100))
+        self.assertEqual(len(snapshot.largest_tagged(10)), 5)
+
+
+# --- File Count Tests ---
+class TestFileCounts(TaggedDatabase):
+
+    def expected(self):
+        # Counted from scratch, as the fill on a new or rebuilt table does
+        links = self.db.read_entry([("files", "all")])[0]
+        tags, groups = {}, {}
+        group_of = {t[0]: t[2] for t in self.db.read_entry([("tags", "all")])[0]}
+        for file in links:
+            for tag in file[-1]:
+                tags[tag] = tags.get(tag, 0) + 1
+            for group in {group_of[tag] for tag in file[-1]}:
+                groups[group] = groups.get(group, 0) + 1
+        return tags, groups, sum(1 for file in links if not file[-1])
+
+    def test_counts_follow_links(self):
+        self.assertEqual(self.db.file_counts(), self.expected())
+        self.db.create_entry("tag-file", [{'file_id': self.ids[0], 'tag_id': 1}])
+        self.assertEqual(self.db.file_counts()[1][1], 4)   # Files with 2 People tags count once
+        self.db.create_entry("tag-file", [{'file_id': self.ids[4], 'tag_id': 1}, {'file_id': self.ids[3], 'tag_id': 3}])
+        self.db.delete_entry("tag-file", [{'file_id': self.ids[2], 'tag_id': 6}, {'file_id': self.ids[1], 'tag_id': 2}])
+        self.db.delete_entry("file", [{'file_id': self.ids[2]}])   # Still tagged -> rejected, count unchanged
+        self.db.CONN.execute("UPDATE tags SET tag_group=3 WHERE tag_id=1")
+        self.db.CONN.commit()
+        self.assertEqual(self.db.file_counts(), self.expected())
+
+    def test_counts_are_filled_on_connect(self):
+        self.db.CONN.execute("DROP TABLE file_counts")
+        self.db.CONN.commit()
+        self.db.connect_db(self.db.PATH)
+        self.assertEqual(self.db.file_counts(), self.expected())
+
+    def test_model_counts(self):
+        groups, tags = TagGroup.load_tag_collection(self.db)
+        files = File.load_files(self.db, tags)
+        self.assertEqual([g.file_count for g in groups.values()], [4, 3, 1])
+        pets = groups["Pets"]
+        file = files[self.paths[1]]
+        file.remove_tags(self.db, tags[8])
+        self.assertFalse(pets.has_files())
+        file.add_tags(self.db, tags[9], tags[10])
+        self.assertEqual(pets.file_count, 1)
+        self.assertEqual(tags[9].file_count, 1)
+        self.assertEqual(self.db.file_counts()[1][pets.db_id], 1)
+
+
+# --- Tag Index Tests ---
+class TestTagIndex(TaggedDatabase):
+
+    def setUp(self):
+        super().setUp()
+        self.groups, self.tags = TagGroup.load_tag_collection(self.db)
+        self.files = File.load_files(self.db, self.tags)
+
+    def test_index_matches_database(self):
+        for expression in ('(People:"Benoit Blanc" AND Places:*) AND NOT Pets:*', 'Pets:* OR People:"Jack Pembleton"',
+                           'NOT (People:* OR Places:*)', '"Benoit Blanc"', '*', 'Nowhere:*'):
+            found = File.index.members(File.index.query(expression))
+            self.assertEqual([f.db_id for f in found], self.db.query_files(expression))
+
+    def test_set_operations(self):
+        index = File.index
+        self.assertEqual(index.count(index.all_of(self.tags[2], self.tags[4])), 1)
+        self.assertEqual(index.count(index.any_of(self.tags[2], self.tags[6])), 4)
+        self.assertEqual([f.db_id for f in index.members(index.none_of(*self.tags.values()))], [self.ids[4]])
+
+    def test_index_follows_changes(self):
+        file = File.index.members(File.index.none_of(*self.tags.values()))[0]
+        file.add_tags(self.db, self.tags[9])
+        self.assertEqual(File.index.members(File.index.query("Pets:*")), [self.files[f.path] for f in
+                                                                           File.query(self.db, "Pets:*", self.files)])
+        file.remove_tags(self.db, self.tags[9])
+        file.delete(self.db)
+        self.assertEqual(File.index.count(File.index.universe), 4)
+        self.assertEqual(File.index.count(File.index.query("NOT Pets:*")), 3)
+
+    def test_bulk_add_matches_single_adds(self):
+        self.assertEqual(File.index.universe, (1 << len(self.files)) - 1)
+        single, bulk = TagIndex(), TagIndex()
+        files = list(self.files.values())
+        for file in files[:2]:
+            single.add(file)
+            bulk.add(file)
+        single.remove(files[0])
+        bulk.remove(files[0])
+        for file in files:
+            single.add(file)
+        bulk.add_all(files)
+        self.assertEqual((bulk.universe, bulk.ordinals), (single.universe, single.ordinals))
+
+
+# --- Directory Trie Tests ---
+class TestDirectoryTrie(TaggedDatabase):
+
+    def setUp(self):
+        super().setUp()
+        self.groups, self.tags = TagGroup.load_tag_collection(self.db)
+        self.files = File.load_files(self.db, self.tags)
+        self.top = File.folders.folder(self.tmp.name)
+
+    def test_trie_matches_paths(self):
+        self.assertEqual(len(File.folders), 5)
+        self.assertEqual(self.top.path, os.path.join(self.tmp.name, ""))
+        self.assertEqual(sorted(self.top.files), [f"{i}.txt" for i in range(5)])
+        self.assertEqual(set(File.folders.root.iterate_files()), set(self.files.values()))
+        folder = self.top
+        while folder.parent is not None:        # Every folder above counts them all
+            self.assertEqual(folder.file_count, 5)
+            folder = folder.parent
+
+    def test_trie_follows_changes(self):
+        os.mkdir(os.path.join(self.tmp.name, "sub"))
+        moved = os.path.join(self.tmp.name, "sub", "moved.txt")
+        os.rename(self.paths[4], moved)
+        self.files[self.paths[4]].relocate(self.files, moved)
+        sub = File.folders.folder(os.path.dirname(moved))
+        self.assertEqual((sub.file_count, self.top.file_count), (1, 5))
+        self.assertNotIn("4.txt", self.top.files)
+
+        new_file = File.new_file(self.make_file(os.path.join("sub", "new.txt"), b"new"), self.db)[1]
+        self.assertEqual((sub.file_count, self.top.file_count), (2, 6))
+        new_file.delete(self.db)
+        self.files[moved].delete(self.db)
+        self.assertIsNone(File.folders.folder(os.path.dirname(moved)))      # Emptied -> pruned
+        self.assertNotIn("sub", self.top.folders)
+        self.assertEqual(self.top.file_count, 4)
+
+
+# --- Change Tracking Tests ---
+class TestChangeTracking(TaggedDatabase):
+
+    def setUp(self):
+        super().setUp()
+        self.tracker = ChangeTracker(self.db)
+        self.groups, self.tags = TagGroup.load_tag_collection(self.db)
+        self.files = File.load_files(self.db, self.tags)
+        self.other = Database()         # Another writer to the same file, e.g. a CLI job
+        self.other.connect_db(self.db.PATH)
+        self.addCleanup(self.other._disconnect)
+
+    def test_poll_applies_changes_by_other_connections(self):
+        self.assertEqual(self.tracker.poll(self.groups, self.tags, self.files), set())
+        group = self.other.create_entry("group", [{"group_name": "Food"}])[0][1]
+        tag = self.other.create_entry("tag", [{"tag_name": "Pizza", "group": group}])[0][1]
+        path = self.make_file("new.txt", b"new")
+        file_id = self.other.create_entry("file", [{'file_path': path}])[0][0]
+        self.other.create_entry("tag-file", [{'file_id': file_id, 'tag_id': tag}, {'file_id': self.ids[0], 'tag_id': tag}])
+        self.other.delete_entry("tag-file", [{'file_id': self.ids[0], 'tag_id': 2}])
+
+        changed = self.tracker.poll(self.groups, self.tags, self.files)
+        self.assertEqual(changed, {"tag_groups", "tags", "files", "tagged_files_m2m"})
+        self.assertIs(self.tags[tag].group, self.groups["Food"])
+        self.assertEqual(set(self.tags[tag].files), {file_id, self.ids[0]})
+        self.assertNotIn(2, self.files[self.paths[0]].tags)
+        self.assertEqual(self.db.query_files('Food:Pizza'),
+                         [f.db_id for f in File.index.members(File.index.query('Food:Pizza'))])
+        self.assertEqual(self.tracker.poll(self.groups, self.tags, self.files), set())
+
+    def test_removals(self):
+        untagged = self.files[self.paths[4]]
+        self.other.delete_entry("file", [{'file_id': untagged.db_id}])
+        self.other.delete_entry("tag", [{'tag_id': 3}])
+        food = self.other.create_entry("group", [{"group_name": "Food"}])[0][1]
+        self.other.delete_entry("group", [{'group_id': food}])
+        self.tracker.sync(self.groups, self.tags, self.files)
+        self.assertNotIn(untagged.path, self.files)
+        self.assertIsNone(File.index.file(untagged.db_id))
+        self.assertNotIn(3, self.tags)
+        self.assertNotIn(3, self.groups["People"].tags)
+        self.assertNotIn("Food", self.groups)
+
+    def test_own_changes_are_applied_once(self):
+        file = self.files[self.paths[4]]
+        file.add_tags(self.db, self.tags[9])
+        self.assertEqual(self.tracker.sync(self.groups, self.tags, self.files), {"tagged_files_m2m"})
+        self.assertEqual(list(file.tags), [9])
+        self.assertEqual(list(self.tags[9].files), [file.db_id])
+
+    def test_truncated_log_requires_reload(self):
+        self.tracker.last_change = -5
+        self.assertIsNone(self.tracker.sync(self.groups, self.tags, self.files))
+
+    def test_changed_rows_are_read_per_table(self):
+        paths = [self.make_file(f"new{i}.txt", bytes([i]) * 10) for i in range(50)]
+        file_ids = [row[0] for row in self.other.create_entry("file", [{'file_path': p} for p in paths], batch=True)]
+        self.other.create_entry("tag-file", [{'file_id': file_id, 'tag_id': 9} for file_id in file_ids], batch=True)
+
+        def read_entry(values):
+            raise AssertionError(f"Read row by row: {values}")
+        self.db.read_entry = read_entry
+        self.assertEqual(self.tracker.sync(self.groups, self.tags, self.files), {"files", "tagged_files_m2m"})
+        self.assertEqual(set(self.tags[9].files), set(file_ids))
+
+    def test_many_changes_require_reload(self):
+        self.tracker.RELOAD_AFTER = 2
+        self.other.create_entry("group", [{"group_name": name} for name in ("Food", "Music", "Sports")], batch=True)
+        self.assertIsNone(self.tracker.sync(self.groups, self.tags, self.files))
+        self.assertEqual(self.tracker.sync(self.groups, self.tags, self.files), set())     # Not asked again
+
+    def test_polling_does_not_wait_for_writes(self):
+        locked, release = threading.Event(), threading.Event()
+
+        def write():        # A long write holding the lock, e.g. a batch on the async executor
+            with self.db._write_lock:
+                locked.set()
+                release.wait(10)
+        writer = threading.Thread(target=write)
+        writer.start()
+        locked.wait(10)
+        poll = threading.Thread(target=self.db.has_changed)
+        poll.start()
+        poll.join(5)
+        waited = poll.is_alive()
+        release.set()
+        writer.join()
+        self.assertFalse(waited)
+
+
+# --- Model Event Tests ---
+class TestModelEvents(TaggedDatabase):
+
+    def setUp(self):
+        super().setUp()
+        self.tracker = ChangeTracker(self.db)
+        self.groups, self.tags = TagGroup.load_tag_collection(self.db)
+        self.files = File.load_files(self.db, self.tags)
+        self.other = Database()
+        self.other.connect_db(self.db.PATH)
+        self.addCleanup(self.other._disconnect)
+        self.seen = []
+        handlers = {event: (lambda *args, event=event: self.seen.append((event, *args))) for event in events.EVENTS}
+        events.bind(**handlers)
+        self.addCleanup(events.unbind, **handlers)
+
+    def test_own_changes(self):
+        file = self.files[self.paths[4]]
+        file.add_tags(self.db, self.tags[9])
+        file.remove_tags(self.db, self.tags[9])
+        moved = self.make_file("moved.txt", bytes([4]))
+        file.relocate(self.files, moved)
+        new_file = File.new_file(self.make_file("new.txt", b"new"), self.db)[1]
+        new_file.delete(self.db)
+        self.assertEqual(self.seen, [("on_tag_linked", file, self.tags[9]), ("on_tag_unlinked", file, self.tags[9]),
+                                     ("on_file_moved", file, self.paths[4]), ("on_file_added", new_file),
+                                     ("on_file_removed", new_file)])
+        self.tracker.sync(self.groups, self.tags, self.files)     # Already applied -> not announced again
+        self.assertEqual(len(self.seen), 5)
+
+    def test_changes_by_other_connections(self):
+        path = self.make_file("new.txt", b"new")
+        file_id = self.other.create_entry("file", [{'file_path': path}])[0][0]
+        self.other.create_entry("tag-file", [{'file_id': file_id, 'tag_id': 9}])
+        self.other.delete_entry("tag-file", [{'file_id': self.ids[3], 'tag_id': 2}])
+        self.tracker.poll(self.groups, self.tags, self.files)
+        new_file = self.files[path]
+        self.assertEqual(self.seen, [("on_file_added", new_file), ("on_tag_linked", new_file, self.tags[9]),
+                                     ("on_tag_unlinked", self.files[self.paths[3]], self.tags[2])])
+
+
+# --- Bulk Import Tests ---
+class TestBulkImport(TemporaryDatabase):
+
+    def setUp(self):
+        super().setUp()
+        self.root = os.path.join(self.tmp.name, "library")
+        for name, content in [("a/1.jpg", b"1"), ("a/b/2.JPG", b"2"), ("a/b/notes.txt", b"3"), ("c/3.png", b"4"),
+                              ("c/copy.png", b"1"), ("IMG_4.raw", b"5")]:
+            os.makedirs(os.path.dirname(os.path.join(self.root, name)), exist_ok=True)
+            with open(os.path.join(self.root, name), 'wb') as f:
+                f.write(content)
+        self.under = lambda *names: [os.path.join(self.root, *name.split("/")) for name in names]
+
+    def test_scan_filters_in_walk_order(self):
+        self.assertEqual(list(scan(self.root, extensions=["jpg", ".png"])),
+                         self.under("a/1.jpg", "a/b/2.JPG", "c/3.png", "c/copy.png"))
+        self.assertEqual(list(scan(self.root, globs=["IMG_*"], extensions=["txt"])),
+                         self.under("IMG_4.raw", "a/b/notes.txt"))
+
+    def test_scan_resumes_after_path(self):
+        everything = list(scan(self.root))
+        for i, path in enumerate(everything):
+            self.assertEqual(list(scan(self.root, after=path)), everything[i + 1:])
+
+    def test_import_reports_duplicates_and_existing(self):
+        report = import_tree(self.db, self.root, batch_size=2)
+        self.assertEqual(report["imported"], 5)
+        self.assertEqual(report["duplicates"], [tuple(self.under("c/copy.png", "a/1.jpg"))])
+        self.assertIsNone(self.db.load_checkpoint(os.path.abspath(self.root)))
+        report = import_tree(self.db, self.root, batch_size=2)
+        self.assertEqual((report["imported"], report["existing"]), (0, 5))
+
+    def test_import_resumes_from_checkpoint(self):
+        first = self.under("IMG_4.raw", "a/1.jpg")
+        self.db.create_entry("file", [{'file_path': path} for path in first])
+        self.db.save_checkpoint(self.root, first[-1], (2, 0, 0, 0))
+        report = import_tree(self.db, self.root)
+        self.assertEqual(report["resumed_from"], first[-1])
+        self.assertEqual((report["imported"], report["existing"]), (5, 0))     # Nothing before the checkpoint re-read
+        self.assertEqual(len(self.db.read_entry([("files", "all")])[0]), 5)
+
+    def test_others_can_write_while_a_batch_is_read(self):
+        other = Database()
+        other.connect_db(self.db.PATH)
+        self.addCleanup(other._disconnect)
+        groups = []
+
+        def fingerprint(path):      # Another connection writes while every file is being read
+            groups.append(other.create_entry("group", [{'group_name': os.path.basename(path)}])[0])
+            return Database.fingerprint(path)
+        self.db.fingerprint = fingerprint
+        report = import_tree(self.db, self.root)
+        self.assertEqual(report["imported"], 5)
+        self.assertEqual(len(groups), 6)
+        self.assertTrue(all(success for success, _ in groups))
+
+    def test_same_database_can_write_while_a_batch_is_read(self):
+        waited = []
+
+        def fingerprint(path):      # A thread sharing the database writes while every file is being read
+            writer = threading.Thread(target=self.db.create_entry, args=("group", [{'group_name': path}]))
+            writer.start()
+            writer.join(5)
+            waited.append(writer.is_alive())
+            return Database.fingerprint(path)
+        self.db.fingerprint = fingerprint
+        self.assertEqual(import_tree(self.db, self.root, batch_size=2)["imported"], 5)
+        self.assertEqual(waited, [False] * 6)
+        self.assertEqual(self.db._read_settings()["cache_size"], Database._PROFILES["desktop"]["cache_size"])
+
+
+# --- Reconciliation Tests ---
+class TestReconciliation(TaggedDatabase):
+
+    def setUp(self):
+        super().setUp()
+        self.groups, self.tags = TagGroup.load_tag_collection(self.db)
+        self.files = File.load_files(self.db, self.tags)
+        self.moved = os.path.join(self.tmp.name, "moved")
+        os.mkdir(self.moved)
+
+    def move(self, i, name):
+        new = os.path.join(self.moved, name)
+        os.rename(self.paths[i], new)
+        return new
+
+    def test_update_file_path(self):
+        new = self.move(0, "renamed.txt")
+        self.assertEqual(self.db.update_entry("file", [{'file_id': self.ids[0], 'file_path': new},
+                                                       {'file_id': -1, 'file_path': new}], batch=True)[0], (True, ))
+        self.assertEqual(self.db.read_entry([("files", "file_id", self.ids[0])])[0][0][1], new)
+        self.assertEqual([row[0] for row in self.db.read_entry([("tags", "file_path", new)])[0]], [2, 4])
+
+    def test_moves_matched_by_signature_and_hash(self):
+        renamed = self.move(1, "renamed.txt")
+        with open(self.paths[2], 'rb') as f:
+            content = f.read()
+        os.remove(self.paths[2])
+        copied = self.make_file("moved/copied.txt", content)       # New inode and mtime -> matched by content
+        self.make_file("moved/unrelated.txt", b"unrelated")
+        moves = reconcile(self.db, [self.moved])
+        self.assertEqual(sorted(moves), [(self.ids[1], self.paths[1], renamed), (self.ids[2], self.paths[2], copied)])
+        self.assertEqual(self.db.read_entry([("files", "file_path", os.path.join(self.moved, "unrelated.txt"))])[0], [])
+
+        File.relocate_all(self.files, moves)
+        self.assertNotIn(self.paths[1], self.files)
+        self.assertIs(self.files[renamed], self.tags[5].files[self.ids[1]])
+        self.assertEqual(self.files[copied].path, copied)
+        self.assertIs(self.files[copied], self.tags[6].files[self.ids[2]])
+
+    def test_ambiguous_fingerprint_is_confirmed_by_digest(self):
+        sample = Database._SAMPLE_SIZE
+        content = b"h" * sample + b"m" * sample + b"t" * (6 * sample)
+        stored = self.make_file("stored.bin", content)
+        file_id = self.db.create_entry("file", [{'file_path': stored}])[0][0]     # Stored by fingerprint only
+        os.remove(stored)
+        self.make_file("moved/a-lookalike.bin", content.replace(b"m", b"x"))    # Same fingerprint, found first
+        real = self.make_file("moved/b-real.bin", content)
+        self.assertEqual(reconcile(self.db, [self.moved]), [])      # No digest of the missing file to decide by
+        self.db.CONN.execute("UPDATE hash_cache SET file_hash_name=? WHERE file_path=?",
+                             (Database.digest(real), stored))
+        self.db.CONN.commit()
+        self.assertEqual(reconcile(self.db, [self.moved]), [(file_id, stored, real)])
+
+
+# --- Update Tests ---
+class TestUpdates(TaggedDatabase):
+
+    def setUp(self):
+        super().setUp()
+        os.mkdir(os.path.join(self.tmp.name, "album"))
+        os.mkdir(os.path.join(self.tmp.name, "album-2"))
+        self.album = [self.make_file(f"album/{i}.bin", bytes([i, i])) for i in range(3)]
+        self.other = self.make_file("album-2/0.bin", b"x")
+        self.db.create_entry("file", [{'file_path': p} for p in self.album + [self.other]], batch=True)
+        self.groups, self.tags = TagGroup.load_tag_collection(self.db)
+        self.files = File.load_files(self.db, self.tags)
+
+    def test_directory_move(self):
+        album, renamed = os.path.join(self.tmp.name, "album"), os.path.join(self.tmp.name, "renamed")
+        self.assertEqual(File.move_directory(self.db, self.files, album + os.sep, renamed), (True, 3))
+        moved = [os.path.join(renamed, f"{i}.bin") for i in range(3)]
+        self.assertEqual(sorted(path for path in self.files if path.startswith(renamed)), moved)
+        self.assertNotIn(self.album[0], self.files)
+        self.assertIn(self.other, self.files)       # album-2 shares the prefix, but is not below album
+        self.assertEqual([self.db.read_entry([("files", "file_path", p)])[0][0][1] for p in moved], moved)
+
+    def test_directory_move_is_atomic(self):
+        album_2 = os.path.join(self.tmp.name, "album-2")
+        result = self.db.update_entry("directory", [{'old_path': os.path.join(self.tmp.name, "album"),
+                                                     'new_path': album_2}])[0]
+        self.assertFalse(result[0])         # album/0.bin would overwrite album-2/0.bin -> nothing moves
+        self.assertEqual(self.db.read_entry([("files", "file_path", self.album[1])])[0][0][1], self.album[1])
+        self.assertEqual(self.db.update_entry("directory", [{'old_path': album_2 + "x", 'new_path': album_2}]),
+                         [(True, [])])
+
+    def test_rename_group_and_tags(self):
+        self.assertTrue(self.groups["Pets"].rename(self.db, "Animals", self.groups))
+        self.assertNotIn("Pets", self.groups)
+        self.assertEqual(self.db.read_entry([("tag_groups", "group_id", self.groups["Animals"].db_id)])[0][0][1],
+                         "Animals")
+        self.assertTrue(self.tags[8].rename(self.db, "Leah -Hound"))
+        self.assertFalse(self.tags[1].rename(self.db, "Benoit Blanc"))      # Already a People tag
+        self.assertEqual([rows[0][1] for rows in self.db.read_entry([("tags", "tag_id", 8), ("tags", "tag_id", 1)])],
+                         ["Leah -Hound", "Jack Pembleton"])
+        self.assertEqual(self.tags[1].name, "Jack Pembleton")
+        self.assertFalse(self.db.update_entry("group", [{'group_id': 99, 'group_name': "None"}])[0][0])
+
+    def test_move_tag_to_group(self):
+        people, pets = self.groups["People"], self.groups["Pets"]
+        self.assertTrue(self.tags[8].move(self.db, people))
+        self.assertIs(self.tags[8].group, people)
+        self.assertIn(8, people.tags)
+        self.assertNotIn(8, pets.tags)
+        self.assertEqual((people.file_count, pets.file_count), (4, 0))     # File 1 was already in People
+        self.assertEqual(self.db.read_entry([("tags", "tag_id", 8)])[0][0][2], people.db_id)
+
+
+# --- Duplicate Report Tests ---
+class TestDuplicateReport(TaggedDatabase):
+
+    def setUp(self):
+        super().setUp()
+        self.root = os.path.join(self.tmp.name, "incoming")
+        os.mkdir(self.root)
+        self.copy = self.make_file("incoming/copy.txt", bytes([1]))
+        self.pair = [self.make_file(f"incoming/{name}", b"dup") for name in ("a.bin", "b.bin")]
+        self.make_file("incoming/different.bin", b"dif")
+
+    def test_groups_new_and_stored_copies(self):
+        self.assertEqual(list(find_duplicates(self.db, [self.root])), [
+            (3, [(self.pair[0], None, ()), (self.pair[1], None, ())]),
+            (1, [(self.paths[1], self.ids[1], ("People:Benoit Blanc", "Pets:Leah -Dog", "Places:Livingstone Beach")),
+                 (self.copy, None, ())])])
+
+    def test_candidates_only(self):
+        self.assertEqual([size for size, _ in find_duplicates(self.db, [self.root], library=False)], [3])
+        self.assertEqual(list(find_duplicates(self.db, [self.root], extensions=["txt"], library=False)), [])
+
+    def test_missing_stored_copy_is_not_a_duplicate(self):
+        os.remove(self.paths[1])
+        self.assertEqual([size for size, _ in find_duplicates(self.db, [self.root])], [3])
+
+    def test_changed_stored_copy_is_read_again(self):
+        sample = Database._SAMPLE_SIZE
+        content = b"h" * sample + b"m" * sample + b"t" * (6 * sample)
+        stored = self.make_file("stored.bin", content)
+        self.db.create_entry("file", [{'file_path': stored}], verify=True)
+        self.make_file("incoming/copy.bin", content)
+        self.assertEqual([size for size, _ in find_duplicates(self.db, [self.root])], [len(content), 3, 1])
+        # Edited outside the samples -> same size and fingerprint, but its stored digest is stale
+        os.utime(self.make_file("stored.bin", content.replace(b"m", b"x")), ns=(1, 1))
+        self.assertEqual([size for size, _ in find_duplicates(self.db, [self.root])], [3, 1])
+
+    def test_no_transaction_is_held_between_groups(self):
+        for _ in find_duplicates(self.db, [self.root], workers=1):
+            self.assertFalse(self.db.CONN.in_transaction)
+
+
+# --- Async Database Tests ---
+class TestAsyncDatabase(TaggedDatabase):
+
+    def setUp(self):
+        super().setUp()
+        self.adb = AsyncDatabase(self.db)
+        self.addCleanup(self.adb.close)
+        self.groups, self.tags = TagGroup.load_tag_collection(self.db)
+        self.files = File.load_files(self.db, self.tags)
+
+    def test_calls_run_off_the_awaiting_thread(self):
+        async def calls():
+            return await self.adb.run(threading.get_ident), await self.adb.read_entry([("files", "file_id", 1)])
+        worker, rows = asyncio.run(calls())
+        self.assertNotEqual(worker, threading.get_ident())
+        self.assertEqual(rows[0][0][1], self.paths[0])
+
+    def test_object_calls(self):
+        path = self.make_file("new.txt", b"new")
+
+        async def tag_new_file():
+            success, file = await File.new_file_async(path, self.adb)
+            await file.add_tags_async(self.adb, self.tags[3], self.tags[9])
+            await file.remove_tags_async(self.adb, self.tags[9])
+            return file, await File.new_file_async(self.make_file("copy.txt", b"new"), self.adb)
+        file, duplicate = asyncio.run(tag_new_file())
+        self.assertEqual(list(file.tags), [3])
+        self.assertIs(self.tags[3].files[file.db_id], file)
+        self.assertEqual([row[0] for row in self.db.read_entry([("tags", "file_id", file.db_id)])[0]], [3])
+        self.assertFalse(duplicate[0])
+        self.assertIn(path, duplicate[1])
+
+    def test_close_does_not_wait_for_running_calls(self):
+        adb = AsyncDatabase(self.db, workers=1)
+        started, release = threading.Event(), threading.Event()
+        running = adb.executor.submit(lambda: started.set() or release.wait(10))
+        queued = adb.executor.submit(threading.get_ident)
+        started.wait(10)
+        adb.close()
+        self.assertFalse(running.done())
+        self.assertTrue(queued.cancelled())
+        release.set()
+        self.assertTrue(running.result())
+
+
 # print("\ntags: ")
 # for i in db.TagManager.tags.values():
 #     print(i)
@@ -0,0 +1,62 @@
+"""Memory benchmark -> size of the loaded object model, against the plain dict-per-object layout it replaced
+
+Run from the project root:  python tests/memoryBenchmark.py [files]
+"""
+import os
+import sys
+import tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from databaseObjects import TagGroup, Tag, File
+
+
+class LegacyFile:
+    # Object layout before __slots__: instance dict, full path plus a copy of its basename, links keyed by path
+    def __init__(self, db_id, path, hash_id):
+        self.db_id = db_id
+        self.path = path
+        self.name = os.path.basename(self.path)
+        self.hash_id = hash_id
+        self.tags = {}
+
+
+class LegacyTag:
+    def __init__(self, db_id, name, group):
+        self.db_id = db_id
+        self.name = name
+        self.group = group
+        self.files = {}
+
+
+def rows(count, folders=1000):
+    for i in range(count):
+        # Paths arrive from sqlite as fresh strings, so build each one anew
+        yield i, os.sep.join(("", "home", "user", "Pictures", f"album {i % folders:04}", f"IMG_{i:07}.jpg")), f"{i:032x}"
+
+
+def measure(file_cls, tag_cls, count, key, link):
+    group = TagGroup(1, "People")
+    tracemalloc.start()
+    tags = [tag_cls(t, f"Tag {t}", group) for t in range(20)]
+    files = {}
+    for db_id, path, hash_id in rows(count):
+        f = file_cls(db_id, path, hash_id)
+        files[path] = f
+        linked = (tags[db_id % 20], tags[(db_id * 7 + 1) % 20])
+        for tag in linked:
+            tag.files[key(f)] = f
+        link(f, linked)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    legacy = measure(LegacyFile, LegacyTag, count, lambda f: f.path,
+                     lambda f, linked: f.tags.update((tag.db_id, tag) for tag in linked))
+    compact = measure(File, Tag, count, lambda f: f.db_id, lambda f, linked: setattr(f, "_tags", linked))
+    print(f"{count} files, 2 tags each")
+    print(f"legacy  : {legacy / 2 ** 20:8.1f} MiB  ({legacy // count} bytes per file)")
+    print(f"compact : {compact / 2 ** 20:8.1f} MiB  ({compact // count} bytes per file)")
+    print(f"saving  : {1 - compact / legacy:8.1%}")
@@ -0,0 +1,149 @@
+"""Previews of files for the display pane -> decoded off the Kivy thread, shrunk once, and cached in memory and on disk
+
+Full size photos take far longer to decode than to show. The first preview of a stored file is decoded on a worker
+thread, shrunk on the GPU to at most SIZE pixels a side, and written to the cache directory as <file_hash_name>.png.
+Every later preview of that content (in this run or the next) is a small png, or a texture already in memory. The
+navigator prefetches the rows around its selection, so stepping through them finds their previews ready.
+
+Runs on the app's asyncio loop (see asyncDatabase), so previews are awaited on the Kivy thread:
+
+    texture = await thumbnails.preview(path, file.hash_id)    # None if the file can't be shown as an image
+"""
+import asyncio
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from kivy.core.image import ImageLoader
+from kivy.graphics import ClearBuffers, ClearColor, Fbo, Rectangle
+from kivy.graphics.texture import Texture
+
+from asyncDatabase import spawn
+
+import logging
+thumb_logger = logging.getLogger(__name__)
+
+
+class ThumbnailService:
+    """
+    cache_dir -> directory of the on-disk cache, created if needed
+    size -> longest side of a preview, in pixels
+    memory -> bytes of preview textures kept in memory, least recently shown dropped first
+    workers -> files decoded in parallel
+    """
+    SIZE = 512
+
+    def __init__(self, cache_dir, size=SIZE, memory=64 * 2 ** 20, workers=2):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.size = size
+        self.capacity = memory
+        self.used = 0
+        self.memory = OrderedDict()     # key: Texture -> most recently shown last
+        self._pending = {}              # key: Task of a preview being made -> shared by everyone awaiting it
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="elory_thumbnails")
+
+    @staticmethod
+    def _key(path, hash_name):
+        # Stored files by content. Others by path and modification time, so an edited file isn't shown stale
+        if hash_name is not None:
+            return hash_name
+        try:
+            return path, os.stat(path).st_mtime_ns
+        except OSError:
+            return path, None
+
+    async def preview(self, path, hash_name=None):
+        """Return a Texture previewing the file at path -> None if it can't be decoded as an image"""
+        key = self._key(path, hash_name)
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        task = self._pending.get(key)
+        if task is None:
+            task = self._pending[key] = asyncio.ensure_future(self._make(path, hash_name, key))
+        return await asyncio.shield(task)       # One waiter giving up doesn't cancel it for the others
+
+    def prefetch(self, files):
+        """Start making the previews of files [(path, hash_name or None), ...] not yet cached -> nearest first"""
+        for path, hash_name in files:
+            key = self._key(path, hash_name)
+            if key not in self.memory and key not in self._pending:
+                spawn(self.preview(path, hash_name))
+
+    async def _make(self, path, hash_name, key):
+        try:
+            loop = asyncio.get_running_loop()
+            cached = None if hash_name is None else os.path.join(self.cache_dir, hash_name + ".png")
+            image, from_cache = await loop.run_in_executor(self.executor, self._decode, path, cached)
+            if image is None:
+                return None
+            texture = image.texture         # Uploaded here, on the Kivy thread
+            if not from_cache:
+                texture, pixels = self._shrink(texture)
+                if cached is not None and pixels is not None:
+                    loop.run_in_executor(self.executor, self._save, cached, texture.size, pixels)
+            self._remember(key, texture)
+            return texture
+        finally:
+            self._pending.pop(key, None)
+
+    @staticmethod
+    def _decode(path, cached):
+        # Worker thread -> decoded pixels only. Kivy creates the texture on first use, on its own thread
+        if cached is not None and os.path.isfile(cached):
+            try:
+                return ImageLoader.load(cached, keep_data=True, nocache=True), True
+            except Exception as e:      # Kivy image providers raise bare Exceptions
+                thumb_logger.warning(f"Unreadable cached preview '{cached}': {e}")
+        try:
+            return ImageLoader.load(path, keep_data=True, nocache=True), False
+        except Exception as e:          # Not an image, or no provider for its type
+            thumb_logger.debug(f"No preview for '{path}': {e}")
+            return None, False
+
+    def _shrink(self, texture):
+        # Scale down on the GPU -> returns (texture, its rgba pixels) or (texture, None) if already small enough
+        scale = self.size / max(texture.size)
+        if scale >= 1:
+            return texture, None
+        size = max(1, round(texture.width * scale)), max(1, round(texture.height * scale))
+        fbo = Fbo(size=size)
+        with fbo:
+            ClearColor(0, 0, 0, 0)
+            ClearBuffers()
+            Rectangle(texture=texture, size=size)
+        fbo.draw()
+        pixels = fbo.pixels
+        thumbnail = Texture.create(size=size, colorfmt="rgba")     # Independent of the fbo, which is released
+        thumbnail.blit_buffer(pixels, colorfmt="rgba", bufferfmt="ubyte")
+        return thumbnail, pixels
+
+    @staticmethod
+    def _save(cached, size, pixels):
+        # Worker thread -> written aside and renamed into place, so a crash never leaves half a png in the cache
+        partial = cached + ".part"
+        try:
+            saver = next(loader for loader in ImageLoader.loaders if loader.can_save("png", False))
+            saver.save(partial, size[0], size[1], "rgba", pixels, False, "png")
+            os.replace(partial, cached)
+        except StopIteration:
+            thumb_logger.warning("No image provider can save png files -> previews are not cached on disk")
+        except Exception as e:
+            thumb_logger.warning(f"Failed to cache preview '{cached}': {e}")
+
+    def _remember(self, key, texture):
+        if key in self.memory:
+            self.used -= self._bytes(self.memory.pop(key))
+        self.memory[key] = texture
+        self.used += self._bytes(texture)
+        while self.used > self.capacity and len(self.memory) > 1:
+            self.used -= self._bytes(self.memory.popitem(last=False)[1])
+
+    @staticmethod
+    def _bytes(texture):
+        return texture.width * texture.height * 4
+
+    def close(self):
+        """Drop queued work and release the threads"""
+        self.executor.shutdown(wait=False, cancel_futures=True)